@@ -7,6 +7,9 @@ from .models import (
     StratifiedData,
     UploadLog,
     MasterData,
+    StratumCount,
+    IncidenceCube,
+    DimensionCode,
 )
 
 from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin
@@ -71,10 +74,10 @@ class UploadLogInline(admin.TabularInline):
 
 @admin.register(ValidEntries)
 class ValidEntriesAdmin(admin.ModelAdmin):
-    list_display = ['id', 'upload', 'get_registration_number', 'created_at']
-    list_filter = ['upload', 'created_at']
-    search_fields = ['upload__upload_id', 'data__registration_number']
-    readonly_fields = ['upload', 'data', 'created_at']
+    list_display = ['id', 'upload_id', 'get_registration_number', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['upload_id', 'data__registration_number']
+    readonly_fields = ['upload_id', 'upload', 'data', 'created_at']
     ordering = ['-created_at']
 
     def get_registration_number(self, obj):
@@ -109,12 +112,36 @@ class StratifiedDataAdmin(admin.ModelAdmin):
 
 @admin.register(UploadLog)
 class UploadLogAdmin(admin.ModelAdmin):
-    list_display = ['id', 'upload', 'step', 'created_at']
+    list_display = ['id', 'upload_id', 'user', 'step', 'created_at']
     list_filter = ['step', 'created_at']
-    search_fields = ['upload__upload_id', 'step']
-    readonly_fields = ['upload', 'step', 'details', 'created_at']
+    search_fields = ['upload_id', 'user__username', 'step']
+    readonly_fields = ['upload_id', 'user', 'upload', 'step', 'details', 'created_at']
     ordering = ['-created_at']
 
+@admin.register(StratumCount)
+class StratumCountAdmin(admin.ModelAdmin):
+    list_display = ['dimension', 'value', 'missing', 'count', 'updated_at']
+    list_filter = ['dimension', 'missing']
+    search_fields = ['value']
+    readonly_fields = ['dimension', 'value', 'missing', 'count', 'updated_at']
+    ordering = ['dimension', '-count']
+
+@admin.register(IncidenceCube)
+class IncidenceCubeAdmin(admin.ModelAdmin):
+    list_display = ['upload_id', 'incidence_year', 'sex', 'topography', 'age_group', 'count']
+    list_filter = ['incidence_year', 'sex', 'age_group']
+    search_fields = ['upload_id', 'topography']
+    readonly_fields = ['upload_id', 'incidence_year', 'sex', 'topography', 'age_group', 'count']
+
+@admin.register(DimensionCode)
+class DimensionCodeAdmin(admin.ModelAdmin):
+    list_display = ['id', 'dimension', 'code', 'description']
+    list_filter = ['dimension']
+    search_fields = ['code', 'description']
+    # Renaming a code would recode every MasterData row stored under it
+    readonly_fields = ['dimension', 'code']
+    ordering = ['dimension', 'code']
+
 @admin.register(MasterData)
 class MasterDataAdmin(admin.ModelAdmin):
     list_display = [
@@ -130,9 +157,13 @@ class MasterDataAdmin(admin.ModelAdmin):
         'behavior',
         'grade_code',
         'basis_of_diagnosis',
+        'age_at_incidence',
         'created_at',
     ]
     list_filter = ['sex', 'created_at']
+    # Code columns sort by DimensionCode id, not by code, so they are not offered
+    sortable_by = ['id', 'user', 'upload_id', 'registration_number', 'birth_date', 'date_of_incidence',
+                   'age_at_incidence', 'created_at']
     search_fields = [
         'user__username',
         'registration_number',
@@ -0,0 +1,35 @@
+# api/backends/sqlite3/base.py
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend with a performance profile for single-node deployments.
+
+    Extra OPTIONS:
+        pragmas (dict): PRAGMA name -> value, applied to every new connection.
+        transaction_mode (str): 'DEFERRED', 'IMMEDIATE' or 'EXCLUSIVE'. With
+            'IMMEDIATE', a transaction takes the write lock when it begins and
+            waits up to busy_timeout for it. A deferred transaction that reads
+            first fails with "database is locked" when it later tries to write
+            while another connection holds the lock. (Django 5.1 has this
+            option built in.)
+    """
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            self.cursor().execute("BEGIN")
+        else:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
@@ -0,0 +1,196 @@
+# api/code_tables.py
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from types import MappingProxyType
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DATA_FILES_DIR = os.path.join(settings.BASE_DIR, 'api', 'data_files')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Files whose JSON keys are human-readable descriptions and whose values are
+# the codes. All other files are keyed by code (e.g. topography_codes.json).
+DESCRIPTION_KEYED_TABLES = frozenset({'morphology_codes', 'sex', 'behavior_codes', 'grade_codes'})
+
+
+def normalize_search_key(value):
+    """
+    Normalizes a string for matching: case-folded, trimmed and with runs of
+    whitespace collapsed to a single space.
+    """
+    if not isinstance(value, str):
+        return ''
+    return _WHITESPACE_RE.sub(' ', value).strip().casefold()
+
+
+class CodeIndex:
+    """
+    Bidirectional code <-> description index.
+
+    Both directions are one-to-many: a morphology code has several descriptions,
+    and after normalization the same description can belong to several codes.
+    Descriptions keep their file order, so code_for() is deterministic.
+
+    Attributes:
+        codes (frozenset): Every known code.
+        descriptions (tuple): Distinct descriptions in file order (fuzzy-match choices).
+        code_to_descriptions (Mapping): Code -> tuple of descriptions.
+        description_to_codes (Mapping): Exact description -> tuple of codes.
+        search_to_codes (Mapping): Normalized description -> tuple of codes.
+        search_descriptions (tuple): Distinct normalized descriptions in file order.
+    """
+
+    def __init__(self, pairs):
+        code_to_descriptions = {}
+        description_to_codes = {}
+        search_to_codes = {}
+        for code, description in pairs:
+            code_to_descriptions.setdefault(code, []).append(description)
+            description_to_codes.setdefault(description, []).append(code)
+            search_to_codes.setdefault(normalize_search_key(description), []).append(code)
+
+        self.codes = frozenset(code_to_descriptions)
+        self.descriptions = tuple(description_to_codes)
+        self.code_to_descriptions = MappingProxyType({k: tuple(v) for k, v in code_to_descriptions.items()})
+        self.description_to_codes = MappingProxyType({k: tuple(v) for k, v in description_to_codes.items()})
+        self.search_to_codes = MappingProxyType({k: tuple(v) for k, v in search_to_codes.items()})
+        self.search_descriptions = tuple(self.search_to_codes)
+
+    def code_for(self, description):
+        """
+        Returns the first code for a description, falling back to its normalized
+        form. Returns None when the description is unknown.
+        """
+        codes = self.description_to_codes.get(description) or self.search_to_codes.get(normalize_search_key(description))
+        return codes[0] if codes else None
+
+
+class CodeTable:
+    """
+    Immutable, pre-indexed view of one JSON code file from api/data_files.
+
+    Attributes:
+        name (str): File stem, e.g. 'topography_codes'.
+        version (str): SHA-256 of the file contents; changes whenever the file does.
+        forward (Mapping): Key -> value exactly as stored in the file.
+        reverse (Mapping): Value -> key (the last key wins for repeated values).
+        keys (frozenset): All keys of the file.
+        values (frozenset): All values of the file.
+        key_list (tuple): Keys in file order, for use as fuzzy-match choices.
+        value_list (tuple): Values in file order.
+        index (CodeIndex): Code <-> description index, oriented using DESCRIPTION_KEYED_TABLES.
+    """
+
+    def __init__(self, name, content, version):
+        self.name = name
+        self.version = version
+        self.forward = MappingProxyType(dict(content))
+        self.reverse = MappingProxyType({value: key for key, value in content.items()})
+        self.keys = frozenset(self.forward)
+        self.values = frozenset(self.forward.values())
+        self.key_list = tuple(self.forward)
+        self.value_list = tuple(self.forward.values())
+
+        if name in DESCRIPTION_KEYED_TABLES:
+            self.index = CodeIndex((code, description) for description, code in self.forward.items())
+        else:
+            self.index = CodeIndex(self.forward.items())
+
+    def __len__(self):
+        return len(self.forward)
+
+    def __repr__(self):
+        return f"<CodeTable {self.name} ({len(self)} entries, version {self.version[:12]})>"
+
+
+class _TrackedFile:
+    """
+    Holds the parsed form of a file together with the stat signature and
+    content hash it was built from.
+    """
+
+    __slots__ = ('signature', 'digest', 'value')
+
+    def __init__(self, signature, digest, value):
+        self.signature = signature
+        self.digest = digest
+        self.value = value
+
+
+class FileBackedRegistry:
+    """
+    Process-wide cache of objects compiled from files on disk.
+
+    Each lookup costs one os.stat(). The file is only re-read when its mtime or
+    size changes, and only recompiled when the content hash differs as well, so
+    touching a file without editing it does not rebuild anything.
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(path)
+        if entry is not None and entry.signature == signature:
+            return entry.value
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.signature == signature:
+                return entry.value
+
+            with open(path, 'rb') as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+
+            if entry is not None and entry.digest == digest:
+                entry.signature = signature
+                return entry.value
+
+            logger.info(f"Compiling {path} (version {digest[:12]})")
+            value = self._builder(path, raw, digest)
+            self._entries[path] = _TrackedFile(signature, digest, value)
+            return value
+
+
+def _build_code_table(path, raw, digest):
+    name = os.path.splitext(os.path.basename(path))[0]
+    content = json.loads(raw.decode('utf-8-sig'))
+    if not isinstance(content, dict):
+        raise ValueError(f"Code file {path} must contain a JSON object")
+    return CodeTable(name, content, digest)
+
+
+_code_tables = FileBackedRegistry(_build_code_table)
+
+
+def code_table_path(name):
+    """
+    Resolves a table name ('topography_codes') to the path of its file.
+    """
+    return os.path.join(DATA_FILES_DIR, f"{name}.json")
+
+
+def get_code_table(name):
+    """
+    Returns the compiled CodeTable for a file in api/data_files, loading it on
+    first use and reloading it if the file has changed since.
+
+    Args:
+        name (str): Table name without extension, e.g. 'morphology_codes'.
+
+    Returns:
+        CodeTable: The shared, read-only table.
+    """
+    return _code_tables.get(code_table_path(name))
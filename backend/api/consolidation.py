@@ -0,0 +1,361 @@
+# api/consolidation.py
+import copy
+import uuid
+import hashlib
+import logging
+from itertools import islice
+import pandas as pd
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .models import MasterData, MasterDataRevision
+from .dates import completed_years, parse_date_column
+from .dimensions import register_instance_codes
+from .strata import record_row_changes
+
+logger = logging.getLogger(__name__)
+
+# Fields copied from a validated record onto MasterData.
+MASTER_DATA_FIELDS = (
+    'registration_number',
+    'sex',
+    'birth_date',
+    'date_of_incidence',
+    'topography',
+    'histology',
+    'behavior',
+    'grade_code',
+    'basis_of_diagnosis',
+)
+
+# MasterData's natural key; a second entry with the same key is a conflict.
+CONFLICT_KEY = ('registration_number', 'date_of_incidence')
+
+# Fields an update overwrites. The row keeps its user and upload_id, so it stays
+# part of the upload that first brought it in; its previous values are kept as a
+# MasterDataRevision of the overwriting upload.
+UPDATE_FIELDS = tuple(field for field in MASTER_DATA_FIELDS if field not in CONFLICT_KEY) + ('age_at_incidence',)
+
+# What to do with an entry whose key is already in MasterData.
+ON_CONFLICT_CHOICES = ('update', 'skip')
+
+# Conflicting keys listed in a report; further conflicts are only counted.
+MAX_REPORTED_CONFLICTS = 1000
+
+# Date fields are parsed with the validation date formats, so day-first dates
+# that passed validation are stored as the same dates.
+DATE_FIELDS = ('birth_date', 'date_of_incidence')
+
+
+class ConsolidationReport:
+    """
+    Outcome of a consolidation: rows inserted, updated and skipped, and the
+    keys that conflicted with MasterData or with another entry of the batch.
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.conflict_count = 0
+        self.conflicts = []
+
+    @property
+    def submitted(self):
+        return self.inserted + self.updated + self.skipped
+
+    def add_conflict(self, instance, action):
+        self.conflict_count += 1
+        if len(self.conflicts) < MAX_REPORTED_CONFLICTS:
+            self.conflicts.append({
+                'registration_number': instance.registration_number,
+                'date_of_incidence': instance.date_of_incidence,
+                'action': action,
+            })
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'conflict_count': self.conflict_count,
+            'conflicts': self.conflicts,
+        }
+
+
+def _date_values(entries, field):
+    parsed = parse_date_column((entry.get(field) for entry in entries), field)
+    return [None if pd.isna(value) else value.date() for value in pd.DatetimeIndex(parsed)]
+
+
+def build_instances(user, upload_id, entries):
+    """
+    Builds unsaved MasterData rows from valid record dicts, parsing the dates
+    and computing the age at incidence.
+    """
+    dates = {field: _date_values(entries, field) for field in DATE_FIELDS}
+    instances = []
+    for row, entry in enumerate(entries):
+        values = {field: entry.get(field) for field in MASTER_DATA_FIELDS}
+        for field, parsed in dates.items():
+            values[field] = parsed[row]
+        values['age_at_incidence'] = completed_years(values['birth_date'], values['date_of_incidence'])
+        instances.append(MasterData(user=user, upload_id=upload_id, **values))
+    return instances
+
+
+def _key(instance):
+    return tuple(getattr(instance, field) for field in CONFLICT_KEY)
+
+
+# Registration numbers per existing-row query, below SQLite's bound-parameter limit.
+EXISTING_KEY_QUERY_SIZE = 900
+
+
+def _existing_rows(instances):
+    """
+    Fetches the MasterData rows sharing a key with the batch, with one query per
+    EXISTING_KEY_QUERY_SIZE registration numbers rather than one per entry.
+    """
+    numbers = sorted({instance.registration_number for instance in instances if instance.registration_number is not None})
+    existing = {}
+    for start in range(0, len(numbers), EXISTING_KEY_QUERY_SIZE):
+        for row in MasterData.objects.filter(registration_number__in=numbers[start:start + EXISTING_KEY_QUERY_SIZE]):
+            existing[_key(row)] = row
+    return existing
+
+
+# Staging table the PostgreSQL bulk load copies into; dropped with the session.
+LOAD_TABLE = 'masterdata_load'
+
+
+def copy_merge(connection, instances):
+    """
+    PostgreSQL bulk load: streams the rows into a temporary table with
+    COPY FROM STDIN, then merges them into MasterData with a single
+    INSERT ... SELECT ... ON CONFLICT DO UPDATE.
+
+    Returns:
+        int: Rows inserted or updated.
+    """
+    if not instances:
+        return 0
+    quote = connection.ops.quote_name
+    fields = [field for field in MasterData._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(quote(field.column) for field in fields)
+    table = quote(MasterData._meta.db_table)
+    key = ', '.join(quote(MasterData._meta.get_field(name).column) for name in CONFLICT_KEY)
+    updates = ', '.join(
+        f"{quote(column)} = EXCLUDED.{quote(column)}"
+        for column in (MasterData._meta.get_field(name).column for name in UPDATE_FIELDS)
+    )
+
+    created_at = timezone.now()
+    with connection.cursor() as cursor:
+        # Rows are only ever read within the transaction that copied them
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {LOAD_TABLE} ON COMMIT DELETE ROWS AS "
+            f"SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        cursor.execute(f"TRUNCATE {LOAD_TABLE}")
+        with cursor.copy(f"COPY {LOAD_TABLE} ({columns}) FROM STDIN") as load:
+            for instance in instances:
+                instance.created_at = created_at
+                load.write_row([field.get_db_prep_save(getattr(instance, field.attname), connection) for field in fields])
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {LOAD_TABLE} "
+            f"ON CONFLICT ({key}) DO UPDATE SET {updates}"
+        )
+        return cursor.rowcount
+
+
+def _revision(instance, row):
+    return MasterDataRevision(
+        upload_id=instance.upload_id,
+        user_id=instance.user_id,
+        row_id=row.pk,
+        **{field: getattr(row, field) for field in UPDATE_FIELDS},
+    )
+
+
+def _key_lock_id(key):
+    # Stable signed 64-bit id of a conflict key for pg_advisory_xact_lock
+    digest = hashlib.blake2b('\x1f'.join(str(value) for value in key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def lock_keys(connection, instances):
+    """
+    Serialises consolidations that touch the same keys. Between reading the
+    existing rows and writing the batch, another transaction could otherwise
+    insert one of the keys, and the upsert would then overwrite that row without
+    a revision or a summary delta for its old values.
+
+    On PostgreSQL, takes a transaction-level advisory lock per key, in sorted order
+    so two batches never deadlock. SQLite needs nothing: the profile's IMMEDIATE
+    transactions already hold the write lock from the start of the batch.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    lock_ids = sorted({_key_lock_id(key) for key in map(_key, instances) if None not in key})
+    if lock_ids:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(lock_id) FROM unnest(%s::bigint[]) AS lock_id", [lock_ids])
+
+
+def _consolidate_batch(instances, on_conflict, report):
+    connection = connections[MasterData.objects.db]
+    lock_keys(connection, instances)
+    existing = _existing_rows(instances)
+
+    # Last entry wins within a batch; ON CONFLICT DO UPDATE cannot touch a row twice in one statement
+    latest = {}
+    inserts = []
+    for instance in instances:
+        key = _key(instance)
+        if None in key:  # NULLs never collide in the unique constraint
+            inserts.append(instance)
+            continue
+        if key in latest:
+            report.skipped += 1
+            report.add_conflict(latest[key], 'duplicate_in_batch')
+        latest[key] = instance
+
+    merged, updated, previous, revisions = [], [], [], []
+    for key, instance in latest.items():
+        row = existing.get(key)
+        if row is None:
+            inserts.append(instance)
+        elif on_conflict == 'skip' or all(getattr(row, field) == getattr(instance, field) for field in UPDATE_FIELDS):
+            report.skipped += 1
+            report.add_conflict(instance, 'skipped')
+        else:
+            merged.append(instance)
+            changed = copy.copy(row)
+            for field in UPDATE_FIELDS:
+                setattr(changed, field, getattr(instance, field))
+            updated.append(changed)
+            previous.append(row)
+            revisions.append(_revision(instance, row))
+            report.add_conflict(instance, 'updated')
+
+    if connection.vendor == 'postgresql':
+        copy_merge(connection, inserts + merged)
+    elif merged and connection.features.supports_update_conflicts_with_target:
+        # One INSERT ... ON CONFLICT DO UPDATE for new and changed rows alike
+        MasterData.objects.bulk_create(
+            inserts + merged,
+            update_conflicts=True,
+            unique_fields=list(CONFLICT_KEY),
+            update_fields=list(UPDATE_FIELDS),
+        )
+    else:
+        MasterData.objects.bulk_create(inserts, ignore_conflicts=True)
+        MasterData.objects.bulk_update(updated, list(UPDATE_FIELDS))
+
+    MasterDataRevision.objects.bulk_create(revisions)
+
+    # Same transaction, so the summary tables never disagree with MasterData
+    record_row_changes(added=inserts + updated, removed=previous)
+    report.inserted += len(inserts)
+    report.updated += len(updated)
+
+
+def consolidate_entries(user, upload_id, entries, batch_size=None, on_conflict='update'):
+    """
+    Saves validated entries into MasterData, streaming them in batches.
+
+    Each batch is written in its own transaction together with its summary-table
+    deltas, so only one batch is held in memory. An entry whose
+    (registration_number, date_of_incidence) is already in MasterData either
+    overwrites that row (on_conflict='update', an upsert where the database
+    supports it) or is skipped (on_conflict='skip'); entries identical to the
+    stored row are skipped either way.
+
+    Args:
+        user: The uploading user.
+        upload_id (str or UUID): The upload the entries belong to.
+        entries (iterable): Valid record dicts.
+        batch_size (int): Entries per batch (default: CONSOLIDATION_BATCH_SIZE setting).
+        on_conflict (str): 'update' or 'skip'.
+
+    Returns:
+        ConsolidationReport: Inserted, updated and skipped counts and the conflicting keys.
+    """
+    if on_conflict not in ON_CONFLICT_CHOICES:
+        raise ValueError(f"on_conflict must be one of: {', '.join(ON_CONFLICT_CHOICES)}")
+    upload_uuid = upload_id if isinstance(upload_id, uuid.UUID) else uuid.UUID(str(upload_id))
+    batch_size = batch_size or settings.CONSOLIDATION_BATCH_SIZE
+
+    report = ConsolidationReport()
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, batch_size))
+        if not batch:
+            break
+        instances = build_instances(user, upload_uuid, batch)
+        # New codes are committed before the batch, so the batch itself encodes from the cache
+        register_instance_codes(instances)
+        with transaction.atomic():
+            _consolidate_batch(instances, on_conflict, report)
+
+    logger.info(
+        f"Consolidated upload_id {upload_id}: {report.inserted} inserted, {report.updated} updated, "
+        f"{report.skipped} skipped."
+    )
+    return report
+
+
+def revert_upload_updates(upload_id):
+    """
+    Undoes the updates an upload made to MasterData rows of other uploads.
+
+    Each overwritten row gets back the values stored in the upload's
+    MasterDataRevision. When a later upload has overwritten the row again, the
+    row keeps that later value, and the later upload's revision takes over the
+    restored values, so rolling it back afterwards still ends at the original row.
+    The summary tables are adjusted in the same transaction. The upload's
+    revisions are deleted.
+
+    Returns:
+        int: Number of MasterData rows restored.
+    """
+    upload_uuid = upload_id if isinstance(upload_id, uuid.UUID) else uuid.UUID(str(upload_id))
+    revisions = MasterDataRevision.objects.filter(upload_id=upload_uuid)
+    # Rows the upload inserted itself are deleted with it, revisions and all
+    row_ids = set(revisions.exclude(row__upload_id=upload_uuid).values_list('row_id', flat=True))
+    if not row_ids:
+        revisions.delete()
+        return 0
+
+    with transaction.atomic():
+        rows = {row.pk: row for row in MasterData.objects.select_for_update().filter(pk__in=row_ids)}
+        chains = {}
+        for revision in MasterDataRevision.objects.filter(row_id__in=row_ids).order_by('id'):
+            chains.setdefault(revision.row_id, []).append(revision)
+
+        restored, removed, handed_on = [], [], []
+        for row_id, chain in chains.items():
+            row = rows[row_id]
+            before = copy.copy(row)
+            # Walk the row's history oldest first, passing each of the upload's
+            # previous values on to whatever came after it
+            for position, revision in enumerate(chain):
+                if revision.upload_id != upload_uuid:
+                    continue
+                target = chain[position + 1] if position + 1 < len(chain) else row
+                for field in UPDATE_FIELDS:
+                    setattr(target, field, getattr(revision, field))
+                if target is not row and target.upload_id != upload_uuid:
+                    handed_on.append(target)
+            if any(getattr(row, field) != getattr(before, field) for field in UPDATE_FIELDS):
+                restored.append(row)
+                removed.append(before)
+
+        MasterData.objects.bulk_update(restored, list(UPDATE_FIELDS))
+        MasterDataRevision.objects.bulk_update(handed_on, list(UPDATE_FIELDS))
+        revisions.delete()
+        record_row_changes(added=restored, removed=removed)
+
+    logger.info(f"Restored {len(restored)} MasterData rows overwritten by upload {upload_id}.")
+    return len(restored)
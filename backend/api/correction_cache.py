@@ -0,0 +1,173 @@
+# api/correction_cache.py
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# How long to stop using Redis after a connection error before trying again.
+REDIS_RETRY_SECONDS = 30
+
+
+class CorrectionCache:
+    """
+    Two-tier memo cache for fuzzy auto-corrections.
+
+    Entries are keyed by (field, normalized input, threshold, vocabulary version)
+    and hold (code, score); code is None when the input had no match, so known
+    misses are not re-scored either. The first tier is an in-process LRU. The
+    optional second tier is Redis, shared by the daphne and celery containers.
+    A new vocabulary version changes every key, so stale corrections are never
+    served after a code file is edited.
+
+    Args:
+        max_entries (int): Capacity of the in-process LRU tier.
+        redis_url (str): Redis connection URL; None disables the shared tier.
+        ttl (int): Expiry of Redis entries in seconds.
+        prefix (str): Namespace for Redis keys.
+    """
+
+    def __init__(self, max_entries=50000, redis_url=None, ttl=None, prefix='zeda:correction'):
+        self.max_entries = max_entries
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_down_until = 0
+        self._counters = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(field, normalized_input, threshold, version):
+        return (field, normalized_input, round(float(threshold), 4), version)
+
+    def _redis_key(self, key):
+        field, normalized_input, threshold, version = key
+        digest = hashlib.sha1(normalized_input.encode('utf-8')).hexdigest()
+        return f"{self.prefix}:{field}:{version[:16]}:{threshold}:{digest}"
+
+    def _get_redis(self):
+        if not self.redis_url or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._redis
+
+    def _redis_failed(self, e):
+        logger.warning(f"Correction cache Redis tier unavailable, retrying in {REDIS_RETRY_SECONDS}s: {e}")
+        self._redis = None
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+    def _remember(self, key, value):
+        # Caller holds self._lock
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def get_many(self, field, normalized_inputs, threshold, version):
+        """
+        Looks up several inputs at once.
+
+        Returns:
+            dict: Maps each cached normalized input to (code, score). Inputs that
+            are missing from both tiers are left out.
+        """
+        found = {}
+        pending = []
+        with self._lock:
+            for normalized_input in normalized_inputs:
+                key = self.make_key(field, normalized_input, threshold, version)
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[normalized_input] = value
+                else:
+                    pending.append(key)
+            self._counters['local_hits'] += len(found)
+
+        client = self._get_redis() if pending else None
+        if client is not None:
+            try:
+                raw_values = client.mget([self._redis_key(key) for key in pending])
+            except Exception as e:
+                self._redis_failed(e)
+                raw_values = [None] * len(pending)
+
+            with self._lock:
+                still_pending = []
+                for key, raw in zip(pending, raw_values):
+                    if raw is None:
+                        still_pending.append(key)
+                        continue
+                    code, score = json.loads(raw)
+                    value = (code, score)
+                    self._remember(key, value)
+                    found[key[1]] = value
+                    self._counters['redis_hits'] += 1
+                pending = still_pending
+
+        with self._lock:
+            self._counters['misses'] += len(pending)
+        return found
+
+    def set_many(self, field, results, threshold, version):
+        """
+        Stores (code, score) results keyed by normalized input in both tiers.
+        """
+        if not results:
+            return
+        keyed = {self.make_key(field, normalized_input, threshold, version): tuple(value)
+                 for normalized_input, value in results.items()}
+        with self._lock:
+            for key, value in keyed.items():
+                self._remember(key, value)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for key, value in keyed.items():
+                    pipe.set(self._redis_key(key), json.dumps(value), ex=self.ttl)
+                pipe.execute()
+            except Exception as e:
+                self._redis_failed(e)
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this process together with the LRU size.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters['size'] = len(self._entries)
+        counters['max_entries'] = self.max_entries
+        counters['redis_enabled'] = bool(self.redis_url)
+        lookups = counters['local_hits'] + counters['redis_hits'] + counters['misses']
+        counters['hit_rate'] = round((lookups - counters['misses']) / lookups, 4) if lookups else None
+        return counters
+
+    def clear(self):
+        """
+        Empties the in-process tier and resets the counters. Redis entries are
+        left to expire.
+        """
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+_config = getattr(settings, 'CORRECTION_CACHE', {})
+
+correction_cache = CorrectionCache(
+    max_entries=_config.get('MAX_ENTRIES', 50000),
+    redis_url=_config.get('REDIS_URL'),
+    ttl=_config.get('TTL'),
+)
@@ -0,0 +1,146 @@
+# api/dates.py
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Accepted date layouts, tried in this order. Day-first layouts come before
+# ISO so '01/02/2020' keeps meaning 1 February, as it always has.
+DATE_FORMATS = (
+    "%d/%m/%Y",
+    "%Y-%m-%d",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%Y/%m/%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+)
+
+# Field name -> formats ordered by how well they matched the last column parsed
+# for that field. Registries send the same layout upload after upload, so the
+# first format tried usually parses the whole column.
+_format_order = {}
+_format_lock = threading.Lock()
+
+
+def _formats_for(field):
+    return _format_order.get(field, DATE_FORMATS)
+
+
+def _remember_formats(field, hits):
+    ranked = sorted(DATE_FORMATS, key=lambda fmt: (-hits.get(fmt, 0), DATE_FORMATS.index(fmt)))
+    with _format_lock:
+        _format_order[field] = tuple(ranked)
+
+
+def parse_date_column(values, field=None):
+    """
+    Parses a whole column of dates in bulk.
+
+    Strings are tried against DATE_FORMATS with explicit formats (no per-value
+    guessing), each format only seeing the values the previous ones could not
+    parse. Date and datetime objects are converted as-is. Anything else, or a
+    string matching no format, becomes NaT.
+
+    Args:
+        values (iterable): Raw column values.
+        field (str): Column name, used to remember which format matched best.
+
+    Returns:
+        np.ndarray: datetime64[ns] array, NaT where a value could not be parsed.
+    """
+    series = pd.Series(list(values), dtype=object)
+    result = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
+    if series.empty:
+        return result.to_numpy()
+
+    is_text = series.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    objects = series[~is_text & series.notna().to_numpy()]
+    if len(objects):
+        result[objects.index] = pd.to_datetime(objects, errors='coerce')
+
+    remaining = series[is_text].str.strip()
+    remaining = remaining[remaining != '']
+    hits = {}
+    for fmt in _formats_for(field):
+        if remaining.empty:
+            break
+        parsed = pd.to_datetime(remaining, format=fmt, errors='coerce', cache=True)
+        matched = parsed.notna().to_numpy()
+        if matched.any():
+            result[remaining.index[matched]] = parsed[matched]
+            hits[fmt] = int(matched.sum())
+            remaining = remaining[~matched]
+
+    if hits and field:
+        _remember_formats(field, hits)
+    if len(remaining):
+        logger.info(f"{len(remaining)} '{field}' values did not match any accepted date format")
+    return result.to_numpy()
+
+
+def ages_at_incidence(birth_dates, incidence_dates):
+    """
+    Computes completed years between two datetime64 arrays.
+
+    Returns:
+        np.ndarray: float array of ages, NaN where either date is missing.
+    """
+    birth = pd.DatetimeIndex(birth_dates)
+    incidence = pd.DatetimeIndex(incidence_dates)
+    years = (incidence.year - birth.year).to_numpy(dtype=float)
+    before_birthday = (
+        (incidence.month < birth.month)
+        | ((incidence.month == birth.month) & (incidence.day < birth.day))
+    )
+    return years - np.asarray(before_birthday, dtype=float)
+
+
+def completed_years(birth, incidence):
+    """
+    Completed years between two date objects, None if either is missing.
+    """
+    if birth is None or incidence is None:
+        return None
+    return incidence.year - birth.year - ((incidence.month, incidence.day) < (birth.month, birth.day))
+
+
+class ParsedDates:
+    """
+    Birth and incidence dates of a dataset, parsed once and shared by every
+    validation stage that needs them.
+
+    Attributes:
+        birth (np.ndarray): datetime64 birth dates (NaT when missing/invalid).
+        incidence (np.ndarray): datetime64 incidence dates.
+        ages (np.ndarray): Float ages at incidence (NaN when unknown).
+        present (np.ndarray): True where the record has both date fields filled in,
+            whether or not they parsed.
+    """
+
+    def __init__(self, dataset):
+        self.birth = parse_date_column((record.get("birth_date") for record in dataset), "birth_date")
+        self.incidence = parse_date_column((record.get("date_of_incidence") for record in dataset), "date_of_incidence")
+        self.ages = ages_at_incidence(self.birth, self.incidence)
+        self.present = np.fromiter(
+            (bool(record.get("birth_date")) and bool(record.get("date_of_incidence")) for record in dataset),
+            dtype=bool, count=len(dataset),
+        )
+
+    def __len__(self):
+        return len(self.ages)
+
+    def age_list(self):
+        """
+        Returns the ages as a list of int or None, ready to store on records.
+        """
+        return [None if np.isnan(age) else int(age) for age in self.ages.tolist()]
+
+    def incidence_not_after_birth(self):
+        """
+        Returns a boolean mask of records whose incidence date is on or before the birth date.
+        """
+        known = ~(np.isnat(self.birth) | np.isnat(self.incidence))
+        return known & (self.incidence <= self.birth)
@@ -0,0 +1,157 @@
+# api/dimensions.py
+import logging
+import threading
+from django.apps import apps
+from django.db import transaction
+from .code_tables import get_code_table
+
+logger = logging.getLogger(__name__)
+
+# MasterData dimension -> code file in api/data_files (None: codes are only
+# collected from consolidated data).
+DIMENSION_FILES = {
+    'sex': 'sex',
+    'behavior': 'behavior_codes',
+    'grade_code': 'grade_codes',
+    'topography': 'topography_codes',
+    'histology': 'morphology_codes',
+    'basis_of_diagnosis': None,
+}
+
+# Stored id of a lookup value that is not a known code; no row carries it, so
+# filtering on an unknown code matches nothing.
+UNKNOWN_CODE_ID = -1
+
+
+def _code_model():
+    return apps.get_model('api', 'DimensionCode')
+
+
+def _as_code(value):
+    return value if isinstance(value, str) else str(value)
+
+
+class DimensionCodec:
+    """
+    Process-wide two-way cache of DimensionCode: (dimension, code) -> id and
+    id -> code.
+
+    Only committed codes are cached, so a code created in a transaction that
+    later rolls back never hands out an id that does not exist.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def _remember(self, rows):
+        with self._lock:
+            for row_id, dimension, code in rows:
+                self._ids[(dimension, code)] = row_id
+                self._codes[row_id] = code
+
+    def _fetch(self, **filters):
+        return list(_code_model().objects.filter(**filters).values_list('id', 'dimension', 'code'))
+
+    def _remember_on_commit(self, rows):
+        transaction.on_commit(lambda: self._remember(rows))
+
+    def decode(self, code_id):
+        """
+        Returns the code stored under an id, reloading the table once for ids
+        created by another process.
+        """
+        code = self._codes.get(code_id)
+        if code is None:
+            rows = self._fetch(id=code_id)
+            self._remember_on_commit(rows)
+            if not rows:
+                logger.warning(f"Unknown dimension code id {code_id}")
+                return None
+            code = rows[0][2]
+        return code
+
+    def encode(self, dimension, value, create=False):
+        """
+        Returns the id of a code. Unknown codes are created when create is set,
+        otherwise they map to UNKNOWN_CODE_ID.
+        """
+        code = _as_code(value)
+        code_id = self._ids.get((dimension, code))
+        if code_id is not None:
+            return code_id
+        if create:
+            return self.register(dimension, [code])[code]
+        rows = self._fetch(dimension=dimension, code=code)
+        self._remember_on_commit(rows)
+        return rows[0][0] if rows else UNKNOWN_CODE_ID
+
+    def register(self, dimension, values, descriptions=None):
+        """
+        Makes sure every value is a code of the dimension, creating the missing
+        ones in one query.
+
+        Returns:
+            dict: Code -> id for every value.
+        """
+        codes = {_as_code(value) for value in values if value is not None}
+        ids = {code: self._ids[(dimension, code)] for code in codes if (dimension, code) in self._ids}
+        missing = codes - ids.keys()
+        if not missing:
+            return ids
+
+        DimensionCode = _code_model()
+        DimensionCode.objects.bulk_create(
+            [
+                DimensionCode(dimension=dimension, code=code, description=(descriptions or {}).get(code, ''))
+                for code in sorted(missing)
+            ],
+            ignore_conflicts=True,
+        )
+        rows = self._fetch(dimension=dimension, code__in=missing)
+        self._remember_on_commit(rows)
+        ids.update({code: row_id for row_id, _, code in rows})
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._codes.clear()
+
+
+codec = DimensionCodec()
+
+
+def register_instance_codes(instances):
+    """
+    Registers the dimension codes of unsaved MasterData rows up front, one query
+    per dimension, so saving them needs no code lookups.
+    """
+    for dimension in DIMENSION_FILES:
+        codec.register(dimension, {getattr(instance, dimension) for instance in instances})
+
+
+def file_codes(dimension):
+    """
+    Returns code -> description for a dimension's file in api/data_files
+    (the first description of codes that have several).
+    """
+    name = DIMENSION_FILES[dimension]
+    if name is None:
+        return {}
+    index = get_code_table(name).index
+    return {code: descriptions[0] for code, descriptions in index.code_to_descriptions.items()}
+
+
+def load_dimension_codes():
+    """
+    Adds the codes of every api/data_files code file to DimensionCode.
+
+    Returns:
+        int: Number of codes known afterwards.
+    """
+    for dimension in DIMENSION_FILES:
+        descriptions = file_codes(dimension)
+        codec.register(dimension, descriptions, descriptions)
+    return _code_model().objects.count()
@@ -0,0 +1,72 @@
+# api/fields.py
+from django import forms
+from django.core.exceptions import FieldError
+from django.db import models
+from django.utils.functional import cached_property
+from .dimensions import codec
+
+
+# Lookups that compare whole codes. Any other lookup (contains, startswith, gt,
+# ...) would silently run against the ids, so it is rejected.
+CODE_LOOKUPS = ('exact', 'in', 'isnull')
+
+
+class CodeField(models.IntegerField):
+    """
+    A code column stored as an integer id into DimensionCode.
+
+    In Python the value is always the code string: rows, values() and
+    values_list() decode it, and exact/in/isnull filters and saves encode it.
+    Grouping and comparisons therefore run on integers, and callers never see
+    the ids. order_by() on a code column follows the ids (the order in which
+    codes were first seen), not the codes.
+    """
+
+    description = "Dictionary-encoded code"
+
+    def __init__(self, *args, dimension=None, **kwargs):
+        self.dimension = dimension
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['dimension'] = self.dimension
+        return name, path, args, kwargs
+
+    def get_lookup(self, lookup_name):
+        if lookup_name not in CODE_LOOKUPS:
+            raise FieldError(
+                f"Unsupported lookup '{lookup_name}' on code field '{self.name}': "
+                f"only {', '.join(CODE_LOOKUPS)} compare codes rather than their ids."
+            )
+        return super().get_lookup(lookup_name)
+
+    @cached_property
+    def validators(self):
+        # Values are codes, not integers, so the integer range validators do not apply
+        return [*self.default_validators, *self._validators]
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return codec.decode(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return codec.encode(self.dimension, value)
+
+    def get_db_prep_save(self, value, connection):
+        # Expressions (e.g. the CASE bulk_update builds) compile their own values
+        if value is None or hasattr(value, 'as_sql'):
+            return value
+        return codec.encode(self.dimension, value, create=True)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{'form_class': forms.CharField, 'max_length': 255, **kwargs})
@@ -0,0 +1,117 @@
+# api/fuzzy.py
+import logging
+import numpy as np
+from rapidfuzz import process, fuzz
+from .code_tables import normalize_search_key
+
+logger = logging.getLogger(__name__)
+
+# Number of query strings scored per cdist() call. Bounds the score matrix to
+# CDIST_CHUNK_SIZE x len(choices) float64 cells (~19 MB for the morphology table).
+CDIST_CHUNK_SIZE = 1024
+
+
+def batch_closest_matches(queries, choices, threshold=0.85, workers=-1, chunk_size=CDIST_CHUNK_SIZE):
+    """
+    Scores many strings against a vocabulary in one vectorized pass.
+
+    Equivalent to calling rapidfuzz.process.extractOne for each query: same
+    scorer (WRatio), same tie-breaking (first best choice wins), and a score
+    below threshold counts as no match.
+
+    Args:
+        queries (iterable): Input strings. Duplicates are scored only once.
+        choices (sequence): Vocabulary to match against.
+        threshold (float): Minimum similarity (0-1) for a match to be kept.
+        workers (int): Threads used by cdist; -1 uses every core.
+        chunk_size (int): Number of distinct queries scored per cdist() call.
+
+    Returns:
+        dict: Maps each distinct query to (closest_match, score) or (None, 0).
+    """
+    distinct = list(dict.fromkeys(q for q in queries if isinstance(q, str) and q))
+    results = {}
+    if not distinct or not choices:
+        return results
+
+    choices = list(choices)
+    cutoff = threshold * 100
+
+    for start in range(0, len(distinct), chunk_size):
+        chunk = distinct[start:start + chunk_size]
+        scores = process.cdist(
+            chunk, choices, scorer=fuzz.WRatio, score_cutoff=cutoff, dtype=np.float64, workers=workers,
+        )
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(chunk)), best]
+
+        for query, choice_idx, score in zip(chunk, best, best_scores):
+            if score >= cutoff:
+                results[query] = (choices[choice_idx], float(score) / 100.0)
+            else:
+                results[query] = (None, 0)
+
+    matched = sum(1 for match, _ in results.values() if match is not None)
+    logger.info(f"Batch fuzzy matching: {len(distinct)} distinct inputs, {matched} matched at threshold {threshold}")
+    return results
+
+
+def batch_correct(values, table, field, threshold=0.85, split_words=False, workers=-1, cache=None):
+    """
+    Resolves distinct free-text values to codes using a CodeTable's index.
+
+    Values are normalized (see normalize_search_key) and matched against the
+    table's normalized descriptions, so differences in case and spacing neither
+    lower the score nor split the cache.
+
+    Args:
+        values (iterable): Raw column values; duplicates and blanks are ignored.
+        table (CodeTable): Code table to correct against.
+        field (str): Field name used to namespace cache entries ('histology').
+        threshold (float): Minimum similarity (0-1) for a correction.
+        split_words (bool): When a whole value has no match, retry with each of its
+            words and keep the best-scoring one (used for topography).
+        workers (int): Threads used by cdist.
+        cache (CorrectionCache): Optional memo cache consulted before scoring.
+
+    Returns:
+        dict: Maps each distinct raw value that could be corrected to (code, score).
+    """
+    index = table.index
+    normalized = {value: normalize_search_key(value) for value in dict.fromkeys(values) if value}
+    wanted = set(normalized.values())
+    wanted.discard('')
+
+    resolved = cache.get_many(field, wanted, threshold, table.version) if cache is not None else {}
+    to_score = [value for value in wanted if value not in resolved]
+
+    matches = batch_closest_matches(to_score, index.search_descriptions, threshold, workers)
+
+    if split_words:
+        unmatched = [value for value, (match, _) in matches.items() if match is None]
+        word_matches = batch_closest_matches(
+            (word for value in unmatched for word in value.split()),
+            index.search_descriptions, threshold, workers,
+        )
+        for value in unmatched:
+            best_match, best_score = None, 0
+            for word in value.split():
+                match, word_score = word_matches.get(word, (None, 0))
+                if word_score > best_score:
+                    best_match, best_score = match, word_score
+            matches[value] = (best_match, best_score)
+
+    scored = {
+        value: (index.search_to_codes[match][0], score) if match is not None else (None, 0)
+        for value, (match, score) in matches.items()
+    }
+    if cache is not None:
+        cache.set_many(field, scored, threshold, table.version)
+    resolved.update(scored)
+
+    corrections = {}
+    for value, normalized_value in normalized.items():
+        code, score = resolved.get(normalized_value, (None, 0))
+        if code is not None:
+            corrections[value] = (code, score)
+    return corrections
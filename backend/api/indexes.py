@@ -0,0 +1,115 @@
+# api/indexes.py
+import uuid
+import logging
+from datetime import date
+from django.db import connections
+from django.db.models import Count
+from .models import MasterData
+from .stratification import DIMENSION_FIELDS, with_age_at_incidence
+
+logger = logging.getLogger(__name__)
+
+# Plan fragments meaning a query reads the whole table.
+FULL_SCAN_MARKERS = {
+    'postgresql': ('Seq Scan',),
+    'sqlite': ('SCAN api_masterdata',),
+}
+
+# LIKE pattern of this app's tables.
+API_TABLES = 'api\\_%'
+
+
+# Filter values used when the sample row has none (empty table, missing values);
+# the plans only depend on which columns are filtered.
+PLACEHOLDER_VALUES = {
+    'upload_id': uuid.UUID(int=0),
+    'topography': '',
+    'histology': '',
+    'date_of_incidence': date(2000, 1, 1),
+}
+
+
+def access_paths(sample=None):
+    """
+    Returns the MasterData queries the API runs most, keyed by a short label.
+
+    Args:
+        sample (MasterData): Row whose values fill in the filters (default: the newest row).
+    """
+    sample = sample or MasterData.objects.order_by('-created_at', '-id').first() or MasterData()
+    values = {
+        field: placeholder if getattr(sample, field) is None else getattr(sample, field)
+        for field, placeholder in PLACEHOLDER_VALUES.items()
+    }
+    strata = sorted(DIMENSION_FIELDS + ('age',))
+    upload_rows = MasterData.objects.filter(upload_id=values['upload_id'])
+    paths = {
+        'stratify (upload)': with_age_at_incidence(upload_rows).values(*strata).annotate(rows=Count('id')).order_by(),
+        'rollback (upload)': upload_rows.values('id'),
+        'query page': MasterData.objects.order_by('-created_at', '-id')[:100],
+        'query page (upload)': upload_rows.order_by('-created_at', '-id')[:100],
+        'query page (topography)': MasterData.objects.filter(topography=values['topography']).order_by('-created_at', '-id')[:100],
+        'query page (histology)': MasterData.objects.filter(histology=values['histology']).order_by('-created_at', '-id')[:100],
+        'incidence range': MasterData.objects.filter(date_of_incidence__gte=values['date_of_incidence']).values('id'),
+    }
+    for field in DIMENSION_FIELDS:
+        paths[f"group by {field}"] = MasterData.objects.values(field).annotate(rows=Count('id')).order_by()
+    return paths
+
+
+def explain_access_paths(using='default'):
+    """
+    Explains each access path and flags those planned as full table scans.
+
+    Returns:
+        list: One dict per path with 'path', 'plan' and 'full_scan'.
+    """
+    markers = FULL_SCAN_MARKERS.get(connections[using].vendor, ())
+    report = []
+    for label, queryset in access_paths().items():
+        plan = queryset.using(using).explain()
+        report.append({
+            'path': label,
+            'plan': plan,
+            # SQLite reports an index-only scan as 'SCAN ... USING COVERING INDEX'
+            'full_scan': any(marker in line and 'INDEX' not in line for marker in markers for line in plan.splitlines()),
+        })
+    return report
+
+
+def index_usage(using='default'):
+    """
+    Reads how often each api_* index has been scanned since the statistics were
+    last reset (PostgreSQL only; other databases keep no such counters).
+
+    Returns:
+        list: One dict per index with table, index, scans, tuples_read and size.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        raise NotImplementedError(f"Index usage statistics are not available on {connection.vendor}")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname, indexrelname, idx_scan, idx_tup_read, pg_size_pretty(pg_relation_size(indexrelid)) "
+            "FROM pg_stat_user_indexes WHERE relname LIKE %s ORDER BY relname, idx_scan",
+            [API_TABLES],
+        )
+        columns = ('table', 'index', 'scans', 'tuples_read', 'size')
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def table_scans(using='default'):
+    """
+    Returns sequential vs index scans per api_* table (PostgreSQL only).
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        raise NotImplementedError(f"Table scan statistics are not available on {connection.vendor}")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname, seq_scan, seq_tup_read, idx_scan FROM pg_stat_user_tables "
+            "WHERE relname LIKE %s ORDER BY seq_tup_read DESC",
+            [API_TABLES],
+        )
+        columns = ('table', 'seq_scans', 'seq_tuples_read', 'index_scans')
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,368 @@
+# api/ingestion.py
+import os
+import csv
+import json
+import mmap
+import codecs
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+import chardet
+import pandas as pd
+
+try:
+    from charset_normalizer import from_bytes as _normalizer_from_bytes
+except ImportError:  # chardet is used when charset-normalizer is not installed
+    _normalizer_from_bytes = None
+
+logger = logging.getLogger(__name__)
+
+# Records per batch handed to validation/consolidation.
+DEFAULT_BATCH_SIZE = 5000
+
+# Characters read from disk at a time when streaming a JSON array.
+JSON_READ_SIZE = 1 << 16
+
+# Bytes hashed / decoded per step of the sniffing pre-pass.
+SNIFF_BLOCK_SIZE = 1 << 20
+
+# Bytes handed to the fallback detector: the start of the file plus a window
+# around the first byte that is not valid UTF-8.
+DETECTOR_SAMPLE_SIZE = 1 << 18
+
+# Text given to csv.Sniffer for delimiter and header detection.
+DIALECT_SAMPLE_SIZE = 1 << 16
+
+CSV_DELIMITERS = ',;\t|'
+
+# Record fields in upload column order; a CSV without a header row is read
+# with these names, further columns are named column_<index>.
+RECORD_COLUMNS = (
+    'registration_number', 'sex', 'birth_date', 'date_of_incidence', 'topography',
+    'histology', 'behavior', 'grade_code', 'basis_of_diagnosis',
+)
+
+# Sniffed profiles kept per file hash, so re-uploads of the same file skip detection.
+PROFILE_CACHE_SIZE = 256
+
+FileProfile = namedtuple('FileProfile', ['digest', 'encoding', 'delimiter', 'has_header'])
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def _file_digest(view):
+    digest = hashlib.sha256()
+    for start in range(0, len(view), SNIFF_BLOCK_SIZE):
+        digest.update(view[start:start + SNIFF_BLOCK_SIZE])
+    return digest.hexdigest()
+
+
+def _first_invalid_utf8(view, start):
+    """
+    Decodes the mapped file as strict UTF-8 block by block.
+
+    Returns:
+        int or None: Offset of the first undecodable byte, None if the whole file is UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')('strict')
+    for offset in range(start, len(view), SNIFF_BLOCK_SIZE):
+        try:
+            decoder.decode(view[offset:offset + SNIFF_BLOCK_SIZE], final=offset + SNIFF_BLOCK_SIZE >= len(view))
+        except UnicodeDecodeError as e:
+            return offset + e.start
+    return None
+
+
+def _detect_with_sample(sample):
+    if _normalizer_from_bytes is not None:
+        best = _normalizer_from_bytes(sample).best()
+        if best is not None:
+            return best.encoding
+    detector = chardet.UniversalDetector()
+    for start in range(0, len(sample), 1 << 14):
+        detector.feed(sample[start:start + (1 << 14)])
+        if detector.done:
+            break
+    detector.close()
+    return detector.result['encoding']
+
+
+def _detect_encoding(view):
+    if view[:3] == codecs.BOM_UTF8:
+        return 'utf-8-sig'
+    if view[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return 'utf-16'
+
+    invalid_at = _first_invalid_utf8(view, 0)
+    if invalid_at is None:
+        return 'utf-8'
+
+    half = DETECTOR_SAMPLE_SIZE // 2
+    window = max(half, invalid_at - half // 2)
+    sample = view[:half] + view[window:window + half]
+    encoding = _detect_with_sample(sample) or 'latin-1'
+    logger.info(f"File is not UTF-8 (first invalid byte at {invalid_at}); detected {encoding}")
+    return encoding
+
+
+def _sniff_dialect(view, encoding):
+    text = bytes(view[:DIALECT_SAMPLE_SIZE]).decode(encoding, errors='replace')
+    if len(view) > DIALECT_SAMPLE_SIZE and '\n' in text:
+        text = text[:text.rindex('\n')]  # drop the partial last line
+    try:
+        sniffer = csv.Sniffer()
+        delimiter = sniffer.sniff(text, delimiters=CSV_DELIMITERS).delimiter
+        has_header = sniffer.has_header(text)
+    except csv.Error:
+        delimiter, has_header = ',', True
+    # The sniffer guesses from column types, which all-text registry rows defeat;
+    # a first row naming a known column is a header whatever it guessed
+    first_row = next(csv.reader([text.split('\n', 1)[0]], delimiter=delimiter), [])
+    if {name.strip().lower() for name in first_row} & set(RECORD_COLUMNS):
+        has_header = True
+    return delimiter, has_header
+
+
+def sniff_file(file_path):
+    """
+    Profiles an uploaded delimited file in one pre-pass over a memory map.
+
+    The file is hashed, checked as strict UTF-8 (falling back to a detector on
+    a sample that includes the first non-UTF-8 byte) and its delimiter and header
+    row are sniffed. Profiles are cached by content hash.
+
+    Returns:
+        FileProfile: digest, encoding, delimiter and has_header.
+    """
+    if os.path.getsize(file_path) == 0:
+        return FileProfile(None, 'utf-8', ',', False)
+
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        digest = _file_digest(view)
+        with _profiles_lock:
+            cached = _profiles.get(digest)
+            if cached is not None:
+                _profiles.move_to_end(digest)
+                return cached
+
+        encoding = _detect_encoding(view)
+        delimiter, has_header = _sniff_dialect(view, encoding)
+
+    profile = FileProfile(digest, encoding, delimiter, has_header)
+    with _profiles_lock:
+        _profiles[digest] = profile
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return profile
+
+
+def _frame_to_records(df):
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def _headerless_names(count):
+    return [RECORD_COLUMNS[index] if index < len(RECORD_COLUMNS) else f"column_{index}" for index in range(count)]
+
+
+def _csv_batches(file_path, batch_size):
+    profile = sniff_file(file_path)
+    logger.info(f"Detected encoding: {profile.encoding}, delimiter: {profile.delimiter!r}")
+    if not profile.has_header:
+        logger.warning(f"No header row detected in {file_path}; columns are read as {', '.join(RECORD_COLUMNS)}")
+    # dtype=str keeps codes such as '1' or '8140/3' as the strings the code tables hold,
+    # and keeps column types identical from one chunk to the next.
+    chunks = pd.read_csv(
+        file_path, encoding=profile.encoding, sep=profile.delimiter, dtype=str, chunksize=batch_size,
+        header=0 if profile.has_header else None,
+    )
+    for chunk in chunks:
+        if not profile.has_header:
+            chunk.columns = _headerless_names(len(chunk.columns))
+        yield _frame_to_records(chunk)
+
+
+def _cell_value(value):
+    if isinstance(value, bool) or value is None or isinstance(value, (date, datetime)):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def _excel_batches(file_path, batch_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(name) if name is not None else f"column_{index}" for index, name in enumerate(header)]
+
+        batch = []
+        for row in rows:
+            if row is None or all(cell is None for cell in row):
+                continue
+            batch.append({name: _cell_value(cell) for name, cell in zip(header, row)})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        workbook.close()
+
+
+def _json_array_items(file):
+    """
+    Yields the elements of a top-level JSON array one at a time, holding at most
+    one element plus one read buffer in memory. Items are decoded in place at an
+    offset into the buffer; it is only trimmed when the next chunk is read.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Expected a JSON array of records")
+    position = 1
+    eof = False
+
+    def refill():
+        nonlocal buffer, position, eof
+        chunk = file.read(JSON_READ_SIZE)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+    while True:
+        # Skip whitespace and separators, refilling the buffer as needed
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            refill()
+
+        if position >= len(buffer):
+            raise ValueError("Unterminated JSON array")
+        if buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            refill()
+            continue
+
+        if end == len(buffer) and not eof:
+            # A number running to the end of the buffer may continue in the next chunk
+            refill()
+            continue
+
+        yield item
+        position = end
+
+
+def _json_value(value):
+    # Same strings CSV yields with dtype=str, so {"sex": 1} validates like a CSV '1'
+    if value is None or isinstance(value, (str, dict, list)):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _json_record(item):
+    if not isinstance(item, dict):
+        return item
+    return {name: _json_value(value) for name, value in item.items()}
+
+
+def _is_ndjson(file):
+    """
+    Tells newline-delimited JSON from column-oriented JSON: the first line of
+    NDJSON is a complete record object, while pretty-printed JSON opens with a
+    bare '{' and single-line column JSON maps every column to a dict.
+    """
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            first = json.loads(line)
+        except json.JSONDecodeError:
+            return False
+        return isinstance(first, dict) and not all(isinstance(value, dict) for value in first.values())
+    return False
+
+
+def _json_batches(file_path, batch_size):
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        head = file.read(1024).lstrip()
+        file.seek(0)
+        if head.startswith('['):
+            items = _json_array_items(file)
+        elif _is_ndjson(file):
+            # Newline-delimited JSON: one record per line
+            file.seek(0)
+            items = (json.loads(line) for line in file if line.strip())
+        else:
+            items = None
+
+        if items is not None:
+            batch = []
+            for item in items:
+                batch.append(_json_record(item))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            return
+
+    # Column-oriented JSON cannot be streamed; read it whole as before
+    df = pd.read_json(file_path, dtype=False)
+    for start in range(0, len(df), batch_size):
+        yield [_json_record(record) for record in _frame_to_records(df.iloc[start:start + batch_size])]
+
+
+def iter_record_batches(file_path, file_format, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams an uploaded file as lists of record dicts.
+
+    CSV is read with pandas chunks, XLSX with openpyxl read-only row iteration and
+    JSON arrays with an incremental decoder, so memory stays bounded by the batch
+    size rather than the file size. Missing values are None.
+
+    Args:
+        file_path (str): Path of the uploaded file.
+        file_format (str): 'csv', 'xlsx', 'xls' or 'json'.
+        batch_size (int): Maximum records per batch.
+
+    Yields:
+        list: Up to batch_size record dicts.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    logger.info(f"Streaming file: {file_path} with format: {file_format} in batches of {batch_size}")
+    if file_format == 'csv':
+        batches = _csv_batches(file_path, batch_size)
+    elif file_format in ['xlsx', 'xls']:
+        batches = _excel_batches(file_path, batch_size)
+    elif file_format == 'json':
+        batches = _json_batches(file_path, batch_size)
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+    total = 0
+    for batch in batches:
+        total += len(batch)
+        yield batch
+    logger.info(f"Finished streaming {total} records from {file_path}")
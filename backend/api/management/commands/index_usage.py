@@ -0,0 +1,47 @@
+# api/management/commands/index_usage.py
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api.indexes import explain_access_paths, index_usage, table_scans
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports which indexes the MasterData access paths use and flags full table scans. "
+        "On PostgreSQL it also lists per-index scan counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database alias to inspect.")
+        parser.add_argument('--plans', action='store_true', help="Print the full query plan of every access path.")
+
+    def handle(self, *args, **options):
+        using = options['database']
+        full_scans = 0
+        for path in explain_access_paths(using):
+            if path['full_scan']:
+                full_scans += 1
+                self.stdout.write(self.style.WARNING(f"FULL SCAN  {path['path']}"))
+            else:
+                self.stdout.write(f"index      {path['path']}")
+            if options['plans'] or path['full_scan']:
+                for line in path['plan'].splitlines():
+                    self.stdout.write(f"    {line}")
+
+        if connections[using].vendor == 'postgresql':
+            self.stdout.write("\nTable scans:")
+            for row in table_scans(using):
+                self.stdout.write(
+                    f"  {row['table']}: {row['seq_scans']} sequential ({row['seq_tuples_read']} rows), "
+                    f"{row['index_scans']} index"
+                )
+            self.stdout.write("\nIndex usage:")
+            for row in index_usage(using):
+                style = self.style.WARNING if not row['scans'] else str
+                self.stdout.write(style(
+                    f"  {row['table']}.{row['index']}: {row['scans']} scans, {row['tuples_read']} rows, {row['size']}"
+                ))
+
+        if full_scans:
+            self.stdout.write(self.style.WARNING(f"{full_scans} access path(s) scan the whole table."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every access path uses an index."))
@@ -0,0 +1,11 @@
+# api/management/commands/load_dimension_codes.py
+from django.core.management.base import BaseCommand
+from api.dimensions import load_dimension_codes
+
+
+class Command(BaseCommand):
+    help = "Adds the codes of the api/data_files code files to the DimensionCode table."
+
+    def handle(self, *args, **options):
+        codes = load_dimension_codes()
+        self.stdout.write(self.style.SUCCESS(f"{codes} dimension codes loaded."))
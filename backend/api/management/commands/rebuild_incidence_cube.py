@@ -0,0 +1,14 @@
+# api/management/commands/rebuild_incidence_cube.py
+from django.core.management.base import BaseCommand
+from api.strata import rebuild_incidence_cube
+
+
+class Command(BaseCommand):
+    help = "Recomputes IncidenceCube rows from MasterData, for one upload or all of them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--upload-id', help="Only rebuild the cube rows of this upload.")
+
+    def handle(self, *args, **options):
+        rows = rebuild_incidence_cube(options['upload_id'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} incidence cube rows."))
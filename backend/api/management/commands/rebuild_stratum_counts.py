@@ -0,0 +1,11 @@
+# api/management/commands/rebuild_stratum_counts.py
+from django.core.management.base import BaseCommand
+from api.strata import rebuild_stratum_counts
+
+
+class Command(BaseCommand):
+    help = "Recomputes the StratumCount summary table from MasterData."
+
+    def handle(self, *args, **options):
+        rows = rebuild_stratum_counts()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} stratum counts."))
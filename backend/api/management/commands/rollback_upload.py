@@ -0,0 +1,16 @@
+# api/management/commands/rollback_upload.py
+from django.core.management.base import BaseCommand
+from api.uploads import rollback_upload
+
+
+class Command(BaseCommand):
+    help = "Deletes the MasterData rows an upload inserted, restores the rows it overwrote and adjusts the summary tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('upload_id', help="Upload to roll back.")
+
+    def handle(self, *args, **options):
+        summary = rollback_upload(options['upload_id'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {summary['deleted']} MasterData rows and restored {summary['restored']}."
+        ))
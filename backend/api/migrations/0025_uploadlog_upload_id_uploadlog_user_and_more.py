@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0024_logentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadlog',
+            name='upload_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadlog',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upload_logs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='validentries',
+            name='upload_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='uploadlog',
+            name='upload',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='validentries',
+            name='upload',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_uploadlog_upload_id_uploadlog_user_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['created_at', 'id'], name='masterdata_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['upload_id', 'created_at', 'id'], name='masterdata_upload_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='masterdata_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['sex', 'created_at', 'id'], name='masterdata_sex_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['topography', 'created_at', 'id'], name='masterdata_topo_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['histology', 'created_at', 'id'], name='masterdata_hist_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['date_of_incidence', 'id'], name='masterdata_incidence_idx'),
+        ),
+    ]
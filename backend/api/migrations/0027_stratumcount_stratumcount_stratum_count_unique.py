@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:00
+
+from collections import Counter
+from django.db import migrations, models
+
+STRATUM_FIELDS = ('sex', 'grade_code', 'topography', 'histology', 'behavior', 'basis_of_diagnosis')
+
+
+def age_band(birth, incidence):
+    if birth is None or incidence is None:
+        return None
+    age = incidence.year - birth.year - ((incidence.month, incidence.day) < (birth.month, birth.day))
+    if age < 0:
+        return None
+    if age >= 85:
+        return '85+'
+    low = age // 5 * 5
+    return f"{low}-{low + 4}"
+
+
+def populate_stratum_counts(apps, schema_editor):
+    # Seed the counts from the rows already in MasterData; consolidation keeps them up to date afterwards
+    MasterData = apps.get_model('api', 'MasterData')
+    StratumCount = apps.get_model('api', 'StratumCount')
+    totals = Counter()
+    rows = MasterData.objects.values_list(*STRATUM_FIELDS, 'birth_date', 'date_of_incidence').iterator(chunk_size=5000)
+    for row in rows:
+        for dimension, value in zip(STRATUM_FIELDS + ('age_group',), row[:len(STRATUM_FIELDS)] + (age_band(*row[-2:]),)):
+            totals[(dimension, '' if value is None else str(value), value is None)] += 1
+    StratumCount.objects.bulk_create(
+        StratumCount(dimension=dimension, value=value, missing=missing, count=count)
+        for (dimension, value, missing), count in totals.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_masterdata_masterdata_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StratumCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=50)),
+                ('value', models.CharField(blank=True, default='', max_length=255)),
+                ('missing', models.BooleanField(default=False)),
+                ('count', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stratumcount',
+            constraint=models.UniqueConstraint(fields=('dimension', 'value', 'missing'), name='stratum_count_unique'),
+        ),
+        migrations.RunPython(populate_stratum_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:01
+
+from collections import Counter
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def age_band(age):
+    if age is None or age < 0:
+        return None
+    if age >= 85:
+        return '85+'
+    low = age // 5 * 5
+    return f"{low}-{low + 4}"
+
+
+def backfill_ages_and_cube(apps, schema_editor):
+    # Store the age of existing rows and seed the incidence cube from them
+    MasterData = apps.get_model('api', 'MasterData')
+    IncidenceCube = apps.get_model('api', 'IncidenceCube')
+    cells = Counter()
+    batch = []
+    for row in MasterData.objects.only('id', 'upload_id', 'sex', 'topography', 'birth_date', 'date_of_incidence').iterator(chunk_size=BATCH_SIZE):
+        birth, incidence = row.birth_date, row.date_of_incidence
+        if birth is not None and incidence is not None:
+            row.age_at_incidence = incidence.year - birth.year - ((incidence.month, incidence.day) < (birth.month, birth.day))
+            batch.append(row)
+        cells[(row.upload_id, age_band(row.age_at_incidence), row.sex, row.topography, incidence.year if incidence else None)] += 1
+        if len(batch) >= BATCH_SIZE:
+            MasterData.objects.bulk_update(batch, ['age_at_incidence'])
+            batch = []
+    MasterData.objects.bulk_update(batch, ['age_at_incidence'])
+    IncidenceCube.objects.bulk_create(
+        IncidenceCube(upload_id=upload_id, age_group=age_group, sex=sex, topography=topography, incidence_year=year, count=count)
+        for (upload_id, age_group, sex, topography, year), count in cells.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_stratumcount_stratumcount_stratum_count_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masterdata',
+            name='age_at_incidence',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='IncidenceCube',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.UUIDField(db_index=True)),
+                ('age_group', models.CharField(blank=True, max_length=10, null=True)),
+                ('sex', models.CharField(blank=True, max_length=10, null=True)),
+                ('topography', models.CharField(blank=True, max_length=255, null=True)),
+                ('incidence_year', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['incidence_year', 'sex', 'topography'], name='incidence_cube_year_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ages_and_cube, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:06
+
+from django.db import migrations, models
+
+STRATA_COLUMNS = (
+    'sex, grade_code, topography, histology, behavior, basis_of_diagnosis, '
+    'age_at_incidence, birth_date, date_of_incidence'
+)
+
+# PostgreSQL only: index-only scans for stratifications filtered by upload or by
+# incidence date. The date index skips NULL dates, which a range filter never matches.
+POSTGRES_INDEXES = {
+    'masterdata_upload_strata_idx': f"ON api_masterdata (upload_id) INCLUDE ({STRATA_COLUMNS})",
+    'masterdata_dated_strata_idx': (
+        f"ON api_masterdata (date_of_incidence) INCLUDE ({STRATA_COLUMNS}) WHERE date_of_incidence IS NOT NULL"
+    ),
+}
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in POSTGRES_INDEXES.items():
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} {definition}")
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in POSTGRES_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_masterdata_age_at_incidence_incidencecube'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['grade_code'], name='masterdata_grade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['behavior'], name='masterdata_behavior_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='masterdata',
+            index=models.Index(fields=['basis_of_diagnosis'], name='masterdata_basis_idx'),
+        ),
+        migrations.RunPython(create_postgres_indexes, drop_postgres_indexes),
+    ]
@@ -0,0 +1,135 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:40
+
+import json
+import os
+import api.fields
+from django.conf import settings
+from django.db import migrations, models
+
+# MasterData dimension -> code file in api/data_files, and whether the file is
+# keyed by description (value = code) rather than by code.
+DIMENSION_FILES = {
+    'sex': ('sex', True),
+    'behavior': ('behavior_codes', True),
+    'grade_code': ('grade_codes', True),
+    'topography': ('topography_codes', False),
+    'histology': ('morphology_codes', True),
+    'basis_of_diagnosis': (None, False),
+}
+DIMENSIONS = tuple(DIMENSION_FILES)
+
+# Indexes on the dimension columns, dropped while the columns are rebuilt.
+DIMENSION_INDEXES = (
+    models.Index(fields=['sex', 'created_at', 'id'], name='masterdata_sex_created_idx'),
+    models.Index(fields=['topography', 'created_at', 'id'], name='masterdata_topo_created_idx'),
+    models.Index(fields=['histology', 'created_at', 'id'], name='masterdata_hist_created_idx'),
+    models.Index(fields=['grade_code'], name='masterdata_grade_idx'),
+    models.Index(fields=['behavior'], name='masterdata_behavior_idx'),
+    models.Index(fields=['basis_of_diagnosis'], name='masterdata_basis_idx'),
+)
+
+# Same PostgreSQL covering indexes as 0029; dropping the old columns drops them.
+STRATA_COLUMNS = (
+    'sex, grade_code, topography, histology, behavior, basis_of_diagnosis, '
+    'age_at_incidence, birth_date, date_of_incidence'
+)
+POSTGRES_INDEXES = {
+    'masterdata_upload_strata_idx': f"ON api_masterdata (upload_id) INCLUDE ({STRATA_COLUMNS})",
+    'masterdata_dated_strata_idx': (
+        f"ON api_masterdata (date_of_incidence) INCLUDE ({STRATA_COLUMNS}) WHERE date_of_incidence IS NOT NULL"
+    ),
+}
+
+
+def file_codes(dimension):
+    name, description_keyed = DIMENSION_FILES[dimension]
+    if name is None:
+        return {}
+    with open(os.path.join(settings.BASE_DIR, 'api', 'data_files', f"{name}.json"), encoding='utf-8-sig') as f:
+        content = json.load(f)
+    pairs = ((code, description) for description, code in content.items()) if description_keyed else content.items()
+    codes = {}
+    for code, description in pairs:
+        codes.setdefault(code, description)
+    return codes
+
+
+def encode_dimensions(apps, schema_editor):
+    # Seed the dictionary from api/data_files and the values already stored, then
+    # fill each coded column with one UPDATE per distinct value
+    MasterData = apps.get_model('api', 'MasterData')
+    DimensionCode = apps.get_model('api', 'DimensionCode')
+    for dimension in DIMENSIONS:
+        codes = file_codes(dimension)
+        stored = MasterData.objects.exclude(**{f"{dimension}__isnull": True}).values_list(dimension, flat=True).distinct()
+        for value in stored:
+            codes.setdefault(value, '')
+        DimensionCode.objects.bulk_create(
+            [DimensionCode(dimension=dimension, code=code, description=description) for code, description in codes.items()],
+            ignore_conflicts=True,
+        )
+        ids = dict(DimensionCode.objects.filter(dimension=dimension).values_list('code', 'id'))
+        for value in stored:
+            MasterData.objects.filter(**{dimension: value}).update(**{f"{dimension}_coded": ids[value]})
+
+
+def decode_dimensions(apps, schema_editor):
+    MasterData = apps.get_model('api', 'MasterData')
+    DimensionCode = apps.get_model('api', 'DimensionCode')
+    for code_id, dimension, code in DimensionCode.objects.values_list('id', 'dimension', 'code'):
+        MasterData.objects.filter(**{f"{dimension}_coded": code_id}).update(**{dimension: code})
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in POSTGRES_INDEXES.items():
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} {definition}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_masterdata_masterdata_grade_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DimensionCode',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('dimension', models.CharField(max_length=50)),
+                ('code', models.CharField(max_length=255)),
+                ('description', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dimensioncode',
+            constraint=models.UniqueConstraint(fields=('dimension', 'code'), name='dimension_code_unique'),
+        ),
+        *[migrations.RemoveIndex(model_name='masterdata', name=index.name) for index in DIMENSION_INDEXES],
+        *[
+            migrations.AddField(
+                model_name='masterdata',
+                name=f"{dimension}_coded",
+                field=models.SmallIntegerField(null=True, blank=True),
+            )
+            for dimension in DIMENSIONS
+        ],
+        migrations.RunPython(encode_dimensions, decode_dimensions),
+        *[migrations.RemoveField(model_name='masterdata', name=dimension) for dimension in DIMENSIONS],
+        *[
+            migrations.RenameField(model_name='masterdata', old_name=f"{dimension}_coded", new_name=dimension)
+            for dimension in DIMENSIONS
+        ],
+        *[
+            migrations.AlterField(
+                model_name='masterdata',
+                name=dimension,
+                field=api.fields.CodeField(blank=True, dimension=dimension, null=True),
+            )
+            for dimension in DIMENSIONS
+        ],
+        *[migrations.AddIndex(model_name='masterdata', index=index.clone()) for index in DIMENSION_INDEXES],
+        migrations.RunPython(create_postgres_indexes, migrations.RunPython.noop),
+    ]
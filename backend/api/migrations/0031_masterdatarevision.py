@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:24
+
+import api.fields
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0030_dimensioncode_alter_masterdata_basis_of_diagnosis_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MasterDataRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.UUIDField(db_index=True)),
+                ('sex', api.fields.CodeField(blank=True, dimension='sex', null=True)),
+                ('birth_date', models.DateField(blank=True, null=True)),
+                ('topography', api.fields.CodeField(blank=True, dimension='topography', null=True)),
+                ('histology', api.fields.CodeField(blank=True, dimension='histology', null=True)),
+                ('behavior', api.fields.CodeField(blank=True, dimension='behavior', null=True)),
+                ('grade_code', api.fields.CodeField(blank=True, dimension='grade_code', null=True)),
+                ('basis_of_diagnosis', api.fields.CodeField(blank=True, dimension='basis_of_diagnosis', null=True)),
+                ('age_at_incidence', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('row', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='api.masterdata')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:31
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+CELL_FIELDS = ('upload_id', 'age_group', 'sex', 'topography', 'incidence_year')
+
+
+def merge_duplicate_cells(apps, schema_editor):
+    # Concurrent consolidations could create the same cell twice; fold them into one row
+    IncidenceCube = apps.get_model('api', 'IncidenceCube')
+    kept = {}
+    for row in IncidenceCube.objects.order_by('id'):
+        cell = tuple(getattr(row, field) for field in CELL_FIELDS)
+        first = kept.get(cell)
+        if first is None:
+            kept[cell] = row
+            continue
+        first.count += row.count
+        first.save(update_fields=['count'])
+        row.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_masterdatarevision'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cells, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='incidencecube',
+            constraint=models.UniqueConstraint(models.F('upload_id'), django.db.models.functions.comparison.Coalesce('age_group', models.Value('')), django.db.models.functions.comparison.Coalesce('sex', models.Value('')), django.db.models.functions.comparison.Coalesce('topography', models.Value('')), django.db.models.functions.comparison.Coalesce('incidence_year', models.Value(-1)), name='incidence_cube_cell_unique'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:35
+
+from django.db import migrations, models
+
+# Code columns holding DimensionCode ids. CodeField is now an IntegerField; the
+# migration state cannot see the change (the field class is the same), so the
+# PostgreSQL columns are widened from smallint here. SQLite stores both alike.
+CODE_COLUMNS = {
+    'api_masterdata': ('sex', 'topography', 'histology', 'behavior', 'grade_code', 'basis_of_diagnosis'),
+    'api_masterdatarevision': ('sex', 'topography', 'histology', 'behavior', 'grade_code', 'basis_of_diagnosis'),
+}
+
+
+def alter_code_columns(column_type):
+    def alter(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        quote = schema_editor.quote_name
+        for table, columns in CODE_COLUMNS.items():
+            changes = ', '.join(f"ALTER COLUMN {quote(column)} TYPE {column_type}" for column in columns)
+            schema_editor.execute(f"ALTER TABLE {quote(table)} {changes}")
+    return alter
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_incidencecube_cell_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dimensioncode',
+            name='id',
+            field=models.AutoField(primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(alter_code_columns('integer'), alter_code_columns('smallint')),
+    ]
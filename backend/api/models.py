@@ -1,10 +1,13 @@
 # your_app/models.py
 
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from uuid import uuid4
 import logging
 from django.contrib.auth.models import AbstractUser
+from .fields import CodeField
 
 
 logger = logging.getLogger(__name__)
@@ -22,12 +25,13 @@ logger = logging.getLogger(__name__)
 #         return f"{self.user.username if self.user else 'Anonymous'} - {self.upload_id}"
 
 class ValidEntries(models.Model):
-    upload = models.JSONField()
+    upload_id = models.UUIDField(null=True, blank=True, db_index=True)
+    upload = models.JSONField(default=dict, blank=True)
     data = models.JSONField()  # Store each valid entry as JSON
     created_at = models.DateTimeField(auto_now_add=True, null=False, blank=False)  # Added field
     
     def __str__(self):
-        return f"ValidEntry for {self.upload.upload_id}"
+        return f"ValidEntry for {self.upload_id}"
 
 class StratifiedData(models.Model):
     upload_id = models.UUIDField(unique=True, editable=False, blank=False, null=False, default=uuid4)
@@ -45,35 +49,144 @@ class StratifiedData(models.Model):
     
         
 
+class StratumCount(models.Model):
+    # Running number of MasterData rows per value of one stratification dimension
+    # (sex, topography, age_group, ...), updated by delta in api.strata.
+    dimension = models.CharField(max_length=50)
+    value = models.CharField(max_length=255, blank=True, default='')
+    missing = models.BooleanField(default=False)  # Rows where the field is empty
+    count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'value', 'missing'], name='stratum_count_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}={'<missing>' if self.missing else self.value}: {self.count}"
+
+
+class IncidenceCube(models.Model):
+    # MasterData rows per upload by age band x sex x topography x year of incidence,
+    # updated by delta in api.strata. Incidence reports sum these rows instead of
+    # scanning MasterData.
+    upload_id = models.UUIDField(db_index=True)
+    age_group = models.CharField(max_length=10, null=True, blank=True)
+    sex = models.CharField(max_length=10, null=True, blank=True)
+    topography = models.CharField(max_length=255, null=True, blank=True)
+    incidence_year = models.PositiveSmallIntegerField(null=True, blank=True)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['incidence_year', 'sex', 'topography'], name='incidence_cube_year_idx'),
+        ]
+        # One row per cell. NULLs are coalesced so that cells with a missing value
+        # collide too; api.strata upserts against exactly these expressions.
+        constraints = [
+            models.UniqueConstraint(
+                F('upload_id'),
+                Coalesce('age_group', Value('')),
+                Coalesce('sex', Value('')),
+                Coalesce('topography', Value('')),
+                Coalesce('incidence_year', Value(-1)),
+                name='incidence_cube_cell_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.incidence_year} {self.sex} {self.topography} {self.age_group}: {self.count}"
+
+
+class DimensionCode(models.Model):
+    # Dictionary of MasterData code values, seeded from api/data_files and extended
+    # as new codes are consolidated. MasterData stores these ids (api.fields.CodeField).
+    id = models.AutoField(primary_key=True)
+    dimension = models.CharField(max_length=50)
+    code = models.CharField(max_length=255)
+    description = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'code'], name='dimension_code_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension} {self.code}"
+
+
 class UploadLog(models.Model):
-    upload = models.JSONField()
+    upload_id = models.UUIDField(null=True, blank=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_logs')
+    upload = models.JSONField(default=dict, blank=True)  # Summary of the step (row counts, corrections, ...)
     step = models.CharField(max_length=50)
     details = models.TextField()  # Log details for the step performed
     created_at = models.DateTimeField(auto_now_add=True,  null=False, blank=False)  # Added field  # Added field
     
     def __str__(self):
-        return f"Log: {self.step} for {self.upload.upload_id}"
+        return f"Log: {self.step} for {self.upload_id}"
     
 class MasterData(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     upload_id = models.UUIDField()
     registration_number = models.CharField(max_length=100, null=True, blank=True)
-    sex = models.CharField(max_length=10, null=True, blank=True)
+    # Codes are stored as integer DimensionCode ids and read back as code strings
+    sex = CodeField(dimension='sex', null=True, blank=True)
     birth_date = models.DateField(null=True, blank=True)
     date_of_incidence = models.DateField(null=True, blank=True)
-    topography = models.CharField(max_length=255, null=True, blank=True)
-    histology = models.CharField(max_length=255, null=True, blank=True)
-    behavior = models.CharField(max_length=50, null=True, blank=True)
-    grade_code = models.CharField(max_length=50, null=True, blank=True)
-    basis_of_diagnosis = models.CharField(max_length=255, null=True, blank=True)    
+    topography = CodeField(dimension='topography', null=True, blank=True)
+    histology = CodeField(dimension='histology', null=True, blank=True)
+    behavior = CodeField(dimension='behavior', null=True, blank=True)
+    grade_code = CodeField(dimension='grade_code', null=True, blank=True)
+    basis_of_diagnosis = CodeField(dimension='basis_of_diagnosis', null=True, blank=True)
+    age_at_incidence = models.IntegerField(null=True, blank=True)  # Completed years, set at consolidation
     created_at = models.DateTimeField(auto_now_add=True, null=False, blank=False)
     
     class Meta:
         unique_together = ('registration_number', 'date_of_incidence')
+        # Each filter of the MasterData query API is followed by the (created_at, id)
+        # keyset, so a filtered page is one index range scan.
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='masterdata_created_idx'),
+            models.Index(fields=['upload_id', 'created_at', 'id'], name='masterdata_upload_created_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='masterdata_user_created_idx'),
+            models.Index(fields=['sex', 'created_at', 'id'], name='masterdata_sex_created_idx'),
+            models.Index(fields=['topography', 'created_at', 'id'], name='masterdata_topo_created_idx'),
+            models.Index(fields=['histology', 'created_at', 'id'], name='masterdata_hist_created_idx'),
+            models.Index(fields=['date_of_incidence', 'id'], name='masterdata_incidence_idx'),
+            # The remaining stratification dimensions, so grouping or filtering on
+            # one of them reads its index instead of the table.
+            models.Index(fields=['grade_code'], name='masterdata_grade_idx'),
+            models.Index(fields=['behavior'], name='masterdata_behavior_idx'),
+            models.Index(fields=['basis_of_diagnosis'], name='masterdata_basis_idx'),
+        ]
+        # PostgreSQL also gets covering and partial indexes (migration 0029).
     
     def __str__(self):
         return f"MasterData {self.upload_id} by {self.user.username}"
 
+
+class MasterDataRevision(models.Model):
+    # A MasterData row as it was before an upload overwrote it (the fields of
+    # api.consolidation.UPDATE_FIELDS), kept so that rolling the upload back
+    # restores the row instead of leaving the upload's values in place.
+    upload_id = models.UUIDField(db_index=True)  # The overwriting upload
+    user = models.ForeignKey(User, on_delete=models.CASCADE)  # Who overwrote the row
+    row = models.ForeignKey(MasterData, on_delete=models.CASCADE, related_name='revisions')
+    sex = CodeField(dimension='sex', null=True, blank=True)
+    birth_date = models.DateField(null=True, blank=True)
+    topography = CodeField(dimension='topography', null=True, blank=True)
+    histology = CodeField(dimension='histology', null=True, blank=True)
+    behavior = CodeField(dimension='behavior', null=True, blank=True)
+    grade_code = CodeField(dimension='grade_code', null=True, blank=True)
+    basis_of_diagnosis = CodeField(dimension='basis_of_diagnosis', null=True, blank=True)
+    age_at_incidence = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Revision of MasterData {self.row_id} by upload {self.upload_id}"
+
 class Registry(AbstractUser):
     ROLE_CHOICES = [
         ('user', 'User'),
@@ -0,0 +1,111 @@
+# api/queries.py
+import base64
+import uuid
+import logging
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import MasterData
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Query parameter -> MasterData lookup for exact-match filters.
+EXACT_FILTERS = {
+    'upload_id': 'upload_id',
+    'user': 'user_id',
+    'sex': 'sex',
+    'topography': 'topography',
+    'histology': 'histology',
+}
+
+# Query parameter -> lookup for the incidence date range (inclusive).
+DATE_FILTERS = {
+    'incidence_from': 'date_of_incidence__gte',
+    'incidence_to': 'date_of_incidence__lte',
+}
+
+
+class QueryError(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id):
+    """
+    Encodes the (created_at, id) keyset position of a row as an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        parsed = parse_datetime(created_at)
+        if parsed is None:
+            raise ValueError(created_at)
+        return parsed, int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise QueryError(f"Invalid cursor: {cursor}") from e
+
+
+def filter_master_data(params):
+    """
+    Applies the query API filters to MasterData.
+
+    Args:
+        params (QueryDict): Query parameters; multiple values of an exact filter
+            are OR-ed (e.g. ?sex=1&sex=2).
+
+    Returns:
+        QuerySet: The filtered rows, unordered.
+    """
+    queryset = MasterData.objects.all()
+    for param, lookup in EXACT_FILTERS.items():
+        values = [value for value in params.getlist(param) if value != '']
+        if not values:
+            continue
+        if param == 'upload_id':
+            try:
+                values = [uuid.UUID(value) for value in values]
+            except ValueError as e:
+                raise QueryError(f"Invalid upload_id: {e}") from e
+        if param == 'user' and not all(value.isdigit() for value in values):
+            raise QueryError("user must be a numeric id")
+        queryset = queryset.filter(**{lookup: values[0]} if len(values) == 1 else {f"{lookup}__in": values})
+
+    for param, lookup in DATE_FILTERS.items():
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise QueryError(f"{param} must be a YYYY-MM-DD date")
+        queryset = queryset.filter(**{lookup: day})
+    return queryset
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE, fields=()):
+    """
+    Returns one page of rows, newest first, using keyset pagination on
+    (created_at, id): the next page starts strictly after the last row returned,
+    so every page costs the same however deep the client has paged.
+
+    Returns:
+        tuple: (list of row dicts, cursor of the next page or None).
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=row_id))
+
+    columns = list(dict.fromkeys([*fields, 'id', 'created_at'])) if fields else []
+    rows = list(queryset.values(*columns)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
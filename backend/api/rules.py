@@ -0,0 +1,343 @@
+# api/rules.py
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from .code_tables import FileBackedRegistry
+
+logger = logging.getLogger(__name__)
+
+RULE_FILES_DIR = os.path.join(settings.BASE_DIR, 'api', 'rule_files')
+
+# Rule attribute -> record field it is read from.
+RULE_FIELDS = {
+    'histology': 'histology',
+    'site': 'topography',
+    'sex': 'sex',
+    'behavior': 'behavior',
+    'grade': 'grade_code',
+    'basis_of_diagnosis': 'basis_of_diagnosis',
+    'age': 'age_at_incidence',
+}
+
+# Exact-match conditions, in the order they are preferred as hash-index keys.
+# 'histology_family' is the first two digits of the histology code.
+MEMBERSHIP_CONDITIONS = ('histology', 'site', 'histology_family', 'sex', 'behavior', 'grade', 'basis_of_diagnosis')
+
+# Prefix conditions and the column they test.
+PREFIX_CONDITIONS = {'histology_prefix': 'histology', 'site_prefix': 'site'}
+
+# Uploads with at least this many rows are evaluated as DataFrame masks
+# instead of record by record.
+VECTORIZE_MIN_ROWS = 2000
+
+
+def histology_key(code):
+    """
+    Strips the '/#' behaviour suffix so rules can match on the 4-digit histology.
+    """
+    if isinstance(code, str):
+        return code.split('/')[0]
+    return code
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool) and not pd.isna(value)
+
+
+def _row_values(record):
+    histology = histology_key(record.get('histology'))
+    values = {name: record.get(field) for name, field in RULE_FIELDS.items()}
+    values['histology'] = histology
+    values['histology_family'] = histology[:2] if isinstance(histology, str) and len(histology) >= 2 else None
+    return values
+
+
+class Rule:
+    """
+    One compiled rule. It reports an error when every condition holds.
+    """
+
+    __slots__ = ('position', 'id', 'field', 'message', 'conditions')
+
+    def __init__(self, position, spec):
+        self.position = position
+        self.id = spec['id']
+        self.field = spec.get('field', 'combination')
+        self.message = spec['message']
+
+        conditions = []
+        for name, arg in spec['when'].items():
+            if name in MEMBERSHIP_CONDITIONS:
+                conditions.append((name, name, frozenset(arg)))
+            elif name in PREFIX_CONDITIONS:
+                conditions.append((name, PREFIX_CONDITIONS[name], arg))
+            elif name == 'histology_not_prefix':
+                conditions.append((name, 'histology', arg))
+            elif name == 'histology_max':
+                conditions.append((name, 'histology', int(arg)))
+            elif name in ('age_min', 'age_max'):
+                conditions.append((name, 'age', arg))
+            elif name == 'age_outside':
+                conditions.append((name, 'age', tuple(arg)))
+            else:
+                raise ValueError(f"Rule {self.id}: unknown condition '{name}'")
+        self.conditions = tuple(conditions)
+
+    def matches(self, values):
+        for name, column, arg in self.conditions:
+            value = values[column]
+            if name in MEMBERSHIP_CONDITIONS:
+                ok = value in arg
+            elif name in PREFIX_CONDITIONS:
+                ok = isinstance(value, str) and value.startswith(arg)
+            elif name == 'histology_not_prefix':
+                ok = not (isinstance(value, str) and value.startswith(arg))
+            elif name == 'histology_max':
+                ok = isinstance(value, str) and value.isascii() and value.isdigit() and int(value) <= arg
+            elif name == 'age_min':
+                ok = _is_number(value) and value >= arg
+            elif name == 'age_max':
+                ok = _is_number(value) and value <= arg
+            else:  # age_outside
+                ok = _is_number(value) and not (arg[0] <= value <= arg[1])
+            if not ok:
+                return False
+        return True
+
+    def mask(self, frame):
+        mask = np.ones(len(frame), dtype=bool)
+        for name, column, arg in self.conditions:
+            series = frame[column]
+            if name in MEMBERSHIP_CONDITIONS:
+                mask &= series.isin(arg).to_numpy()
+            elif name in PREFIX_CONDITIONS:
+                mask &= series.str.startswith(arg, na=False).to_numpy(dtype=bool)
+            elif name == 'histology_not_prefix':
+                mask &= ~series.str.startswith(arg, na=False).to_numpy(dtype=bool)
+            elif name == 'histology_max':
+                digits = series.str.fullmatch(r'[0-9]+', na=False).to_numpy(dtype=bool)
+                numbers = pd.to_numeric(series.where(digits), errors='coerce').to_numpy()
+                mask &= digits & (np.nan_to_num(numbers, nan=np.inf) <= arg)
+            else:
+                ages = frame['age_numeric'].to_numpy()
+                known = ~np.isnan(ages)
+                if name == 'age_min':
+                    mask &= known & (np.nan_to_num(ages) >= arg)
+                elif name == 'age_max':
+                    mask &= known & (np.nan_to_num(ages) <= arg)
+                else:
+                    mask &= known & ~((ages >= arg[0]) & (ages <= arg[1]))
+            if not mask.any():
+                break
+        return mask
+
+
+class RuleSet:
+    """
+    A rule file compiled into hash-indexed lookups.
+
+    Every rule is filed under one exact-match condition (histology, site, sex,
+    behavior, grade, ...) or, failing that, under a fixed-length prefix. A record
+    only evaluates the rules reachable from its own values, so the cost per record
+    no longer grows with the number of rules. Large uploads are evaluated as one
+    boolean mask per rule instead.
+    """
+
+    def __init__(self, name, specs, version):
+        self.name = name
+        self.version = version
+        self.rules = tuple(Rule(position, spec) for position, spec in enumerate(specs))
+        self.exact_index = {}
+        self.prefix_index = {}
+        self.unindexed = []
+
+        for rule in self.rules:
+            by_name = {name: (column, arg) for name, column, arg in rule.conditions}
+            key = next((name for name in MEMBERSHIP_CONDITIONS if name in by_name), None)
+            if key is not None:
+                table = self.exact_index.setdefault(key, {})
+                for value in by_name[key][1]:
+                    table.setdefault(value, []).append(rule)
+                continue
+            key = next((name for name in PREFIX_CONDITIONS if name in by_name), None)
+            if key is not None:
+                column, prefix = by_name[key]
+                self.prefix_index.setdefault((column, len(prefix)), {}).setdefault(prefix, []).append(rule)
+                continue
+            self.unindexed.append(rule)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def candidates(self, values):
+        """
+        Returns the rules that can apply to a record, in rule-file order.
+        """
+        found = {rule.position: rule for rule in self.unindexed}
+        for column, table in self.exact_index.items():
+            value = values[column]
+            try:
+                rules = table.get(value)
+            except TypeError:  # unhashable value
+                rules = None
+            for rule in rules or ():
+                found[rule.position] = rule
+        for (column, length), table in self.prefix_index.items():
+            value = values[column]
+            if isinstance(value, str):
+                for rule in table.get(value[:length], ()):
+                    found[rule.position] = rule
+        return [found[position] for position in sorted(found)]
+
+    def evaluate(self, dataset):
+        """
+        Runs every rule against a list of records.
+
+        Returns:
+            dict: Maps row position to a list of "<field>: <message>" strings, in
+            rule order. Rows without errors are left out.
+        """
+        if len(dataset) >= VECTORIZE_MIN_ROWS:
+            return self.evaluate_frame(dataset)
+
+        errors = {}
+        for row, record in enumerate(dataset):
+            values = _row_values(record)
+            for rule in self.candidates(values):
+                if rule.matches(values):
+                    errors.setdefault(row, []).append(f"{rule.field}: {rule.message.format(**values)}")
+        return errors
+
+    def evaluate_frame(self, dataset):
+        """
+        Vectorized form of evaluate(): one boolean mask per rule over a DataFrame.
+        """
+        raw = pd.DataFrame.from_records(dataset, columns=list(RULE_FIELDS.values()))
+        frame = pd.DataFrame(index=raw.index)
+        for name, field in RULE_FIELDS.items():
+            column = raw[field].astype(object)
+            frame[name] = column.where(column.map(lambda v: isinstance(v, str)), None)
+        frame['histology'] = frame['histology'].str.split('/').str[0]
+        frame['histology_family'] = frame['histology'].where(frame['histology'].str.len() >= 2).str[:2]
+        frame['age_numeric'] = raw[RULE_FIELDS['age']].map(lambda v: float(v) if _is_number(v) else np.nan).astype(float)
+
+        errors = {}
+        for rule in self.rules:
+            rows = np.flatnonzero(rule.mask(frame))
+            for row in rows.tolist():
+                values = _row_values(dataset[row])
+                errors.setdefault(row, []).append(f"{rule.field}: {rule.message.format(**values)}")
+        return errors
+
+
+def expand_sites(entry):
+    """
+    Expands a site entry from a rule file into the topography codes it covers.
+
+    'C76.1' -> {'C76.1'}; 'C76.x' -> {'C76', 'C76.0', ..., 'C76.9'};
+    'C76.0-C76.3' -> {'C76.0', 'C76.1', 'C76.2', 'C76.3'}.
+    """
+    if entry.endswith('.x'):
+        category = entry[:-2]
+        return {category} | {f"{category}.{digit}" for digit in range(10)}
+    if '-' in entry:
+        start, end = entry.split('-', 1)
+        category, first = start.split('.')
+        end_category, last = end.split('.')
+        if category != end_category:
+            raise ValueError(f"Site range '{entry}' must stay within one category")
+        return {f"{category}.{digit}" for digit in range(int(first), int(last) + 1)}
+    return {entry}
+
+
+class SiteMorphologyIndex:
+    """
+    Site -> allowed morphology index compiled from the site-morphology groups.
+
+    A site listed in several groups must satisfy all of them, so its allowed set
+    is the intersection of those groups' morphologies. Sites that no group
+    mentions are unconstrained.
+    """
+
+    def __init__(self, name, groups, version):
+        self.name = name
+        self.version = version
+        allowed = {}
+        for group in groups:
+            morphologies = frozenset(group['morphologies'])
+            for entry in group['sites']:
+                for site in expand_sites(entry):
+                    allowed[site] = allowed[site] & morphologies if site in allowed else morphologies
+        self.allowed = allowed
+        self.pairs = pd.DataFrame(
+            [(site, morphology) for site, morphologies in allowed.items() for morphology in morphologies],
+            columns=['site', 'histology'],
+        )
+
+    def __len__(self):
+        return len(self.allowed)
+
+    def is_valid(self, site, histology):
+        allowed = self.allowed.get(site) if isinstance(site, str) else None
+        return allowed is None or histology in allowed
+
+    def invalid_rows(self, dataset):
+        """
+        Returns the positions of records whose histology is not allowed for their site.
+        """
+        if len(dataset) < VECTORIZE_MIN_ROWS:
+            return [
+                row for row, record in enumerate(dataset)
+                if not self.is_valid(record.get('topography'), histology_key(record.get('histology')))
+            ]
+
+        frame = pd.DataFrame.from_records(dataset, columns=['topography', 'histology'])
+        frame = pd.DataFrame({
+            'site': frame['topography'].where(frame['topography'].map(lambda v: isinstance(v, str)), None),
+            'histology': frame['histology'].map(histology_key),
+        })
+        constrained = frame['site'].isin(self.allowed.keys()).to_numpy()
+        merged = frame.merge(self.pairs, on=['site', 'histology'], how='left', indicator=True)
+        allowed = (merged['_merge'] == 'both').to_numpy()
+        return np.flatnonzero(constrained & ~allowed).tolist()
+
+
+def _build_rule_set(path, raw, digest):
+    name = os.path.splitext(os.path.basename(path))[0]
+    content = json.loads(raw.decode('utf-8-sig'))
+    rule_set = RuleSet(name, content['rules'], digest)
+    logger.info(f"Compiled {len(rule_set)} rules from {name}")
+    return rule_set
+
+
+_rule_sets = FileBackedRegistry(_build_rule_set)
+
+
+def _build_site_morphology_index(path, raw, digest):
+    name = os.path.splitext(os.path.basename(path))[0]
+    content = json.loads(raw.decode('utf-8-sig'))
+    index = SiteMorphologyIndex(name, content['groups'], digest)
+    logger.info(f"Compiled {len(index)} constrained sites from {name}")
+    return index
+
+
+_site_morphology_indexes = FileBackedRegistry(_build_site_morphology_index)
+
+
+def get_rule_set(name):
+    """
+    Returns the compiled RuleSet for a file in api/rule_files, recompiling it
+    when the file changes.
+    """
+    return _rule_sets.get(os.path.join(RULE_FILES_DIR, f"{name}.json"))
+
+
+def get_site_morphology_index(name='site_morphology_rules'):
+    """
+    Returns the compiled SiteMorphologyIndex for a file in api/rule_files,
+    recompiling it when the file changes.
+    """
+    return _site_morphology_indexes.get(os.path.join(RULE_FILES_DIR, f"{name}.json"))
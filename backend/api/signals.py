@@ -1,17 +1,37 @@
 # api/signals.py
 
+from datetime import date
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
-from .models import MasterData, StratifiedData
+from .models import MasterData
+from .dates import completed_years
+from .strata import record_row_changes
 
 @receiver(post_save, sender=User)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
 
-@receiver([post_save, post_delete], sender=MasterData)
-def regenerate_stratified_data(sender, instance, **kwargs):
-    StratifiedData.generate_from_master()
\ No newline at end of file
+# Bulk consolidation updates the stratum counts itself (api.consolidation); these
+# keep them right when single MasterData rows are saved or deleted elsewhere.
+@receiver(pre_save, sender=MasterData)
+def remember_previous_row(sender, instance, raw=False, **kwargs):
+    if isinstance(instance.birth_date, date) and isinstance(instance.date_of_incidence, date):
+        instance.age_at_incidence = completed_years(instance.birth_date, instance.date_of_incidence)
+    instance._previous_row = None
+    if instance.pk and not raw:
+        instance._previous_row = MasterData.objects.filter(pk=instance.pk).first()
+
+@receiver(post_save, sender=MasterData)
+def update_stratum_counts_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_row', None)
+    record_row_changes(added=[instance], removed=[previous] if previous is not None else [])
+
+@receiver(post_delete, sender=MasterData)
+def update_stratum_counts_on_delete(sender, instance, **kwargs):
+    record_row_changes(removed=[instance])
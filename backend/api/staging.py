@@ -0,0 +1,206 @@
+# api/staging.py
+import os
+import uuid
+import logging
+from datetime import date, datetime
+import pyarrow as pa
+from django.conf import settings
+from .ingestion import DEFAULT_BATCH_SIZE, RECORD_COLUMNS, iter_record_batches
+
+logger = logging.getLogger(__name__)
+
+# Columns each pipeline step reads from a staged upload.
+AUTO_CORRECT_COLUMNS = ('registration_number', 'topography', 'histology', 'sex', 'behavior', 'grade_code')
+VALIDATION_COLUMNS = RECORD_COLUMNS
+
+# File formats stage_file accepts.
+STAGEABLE_FORMATS = ('csv', 'xlsx', 'xls', 'json')
+
+
+class StagedUploadNotFound(LookupError):
+    pass
+
+
+def staging_path(upload_id):
+    """
+    Returns the Arrow IPC file holding a staged upload.
+
+    Raises:
+        StagedUploadNotFound: If upload_id is not a UUID, so no file can exist for it.
+    """
+    try:
+        upload_uuid = uuid.UUID(str(upload_id))
+    except ValueError:
+        raise StagedUploadNotFound(f"Invalid upload id: {upload_id}")
+    return os.path.join(settings.UPLOAD_STAGING_DIR, f"{upload_uuid}.arrow")
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float) and value != value:  # NaN
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _record_batch(records, schema):
+    columns = [pa.array([_text(record.get(name)) for record in records], type=pa.string()) for name in schema.names]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def stage_batches(upload_id, batches):
+    """
+    Writes record batches to the staging file of an upload.
+
+    Every column is stored as nullable text, which is how the validation and
+    correction code reads codes and dates. The column set is taken from the first
+    batch; keys that only appear later are dropped with a warning.
+
+    Args:
+        upload_id (str or UUID): Upload the data is staged under.
+        batches (iterable): Lists of record dicts.
+
+    Returns:
+        dict: upload_id, row count and column names.
+    """
+    path = staging_path(upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.tmp"
+
+    schema = None
+    writer = None
+    rows = 0
+    try:
+        for records in batches:
+            if not records:
+                continue
+            if schema is None:
+                names = list(dict.fromkeys(key for record in records for key in record))
+                schema = pa.schema([(name, pa.string()) for name in names])
+                writer = pa.ipc.new_file(temporary_path, schema)
+            else:
+                extra = {key for record in records for key in record} - set(schema.names)
+                if extra:
+                    logger.warning(f"Upload {upload_id}: ignoring columns missing from the first batch: {sorted(extra)}")
+            writer.write_batch(_record_batch(records, schema))
+            rows += len(records)
+
+        if writer is None:
+            schema = pa.schema([])
+            writer = pa.ipc.new_file(temporary_path, schema)
+        writer.close()
+        os.replace(temporary_path, path)
+    except Exception:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    logger.info(f"Staged {rows} records with {len(schema.names)} columns for upload {upload_id}")
+    return {"upload_id": str(upload_id), "rows": rows, "columns": schema.names}
+
+
+def stage_records(upload_id, records, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stages a list of record dicts, e.g. a dataset posted as JSON.
+    """
+    return stage_batches(upload_id, (records[start:start + batch_size] for start in range(0, len(records), batch_size)))
+
+
+def stage_file(upload_id, file_path, file_format, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams an uploaded file straight into the staging format.
+    """
+    return stage_batches(upload_id, iter_record_batches(file_path, file_format, batch_size))
+
+
+def open_staged(upload_id, columns=None):
+    """
+    Opens a staged upload as an Arrow table backed by a memory map, so only the
+    pages of the requested columns are ever read from disk.
+
+    Args:
+        upload_id (str or UUID): The staged upload.
+        columns (iterable): Columns to keep; names missing from the upload are skipped.
+
+    Returns:
+        pa.Table: The staged data.
+    """
+    path = staging_path(upload_id)
+    if not os.path.exists(path):
+        raise StagedUploadNotFound(f"No staged data for upload {upload_id}")
+
+    # The table's buffers keep the mapping alive after the handle is closed
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select([name for name in columns if name in table.column_names])
+    return table
+
+
+def staged_row_count(upload_id):
+    """
+    Returns the number of rows in a staged upload without reading any column data.
+    """
+    path = staging_path(upload_id)
+    if not os.path.exists(path):
+        raise StagedUploadNotFound(f"No staged data for upload {upload_id}")
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        return sum(reader.get_batch(index).num_rows for index in range(reader.num_record_batches))
+
+
+def read_staged_records(upload_id, columns=None, offset=0, limit=None):
+    """
+    Returns a staged upload (or some of its columns and rows) as a list of record dicts.
+    """
+    table = open_staged(upload_id, columns)
+    if offset or limit is not None:
+        table = table.slice(offset, limit)
+    return table.to_pylist()
+
+
+def replace_staged_columns(upload_id, columns):
+    """
+    Rewrites a staged upload with some columns replaced (or added), e.g. after
+    auto-correction. The new file is swapped in atomically.
+
+    Args:
+        upload_id (str or UUID): The staged upload.
+        columns (dict): Column name -> list of values, one per row.
+    """
+    table = open_staged(upload_id)
+    for name, values in columns.items():
+        array = pa.array([_text(value) for value in values], type=pa.string())
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, array)
+        else:
+            table = table.append_column(name, array)
+
+    path = staging_path(upload_id)
+    temporary_path = f"{path}.tmp"
+    try:
+        with pa.ipc.new_file(temporary_path, table.schema) as writer:
+            writer.write_table(table, max_chunksize=DEFAULT_BATCH_SIZE)
+        os.replace(temporary_path, path)
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    logger.info(f"Replaced columns {sorted(columns)} of staged upload {upload_id}")
+
+
+def delete_staged(upload_id):
+    """
+    Removes the staging file of an upload. Returns True if a file was removed.
+    """
+    path = staging_path(upload_id)
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
@@ -0,0 +1,324 @@
+# api/strata.py
+import logging
+from collections import Counter
+from django.db import connections, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+from .models import IncidenceCube, MasterData, StratumCount
+from .dates import completed_years
+from .stratification import (
+    DIMENSIONS, DIMENSION_FIELDS, age_band, age_group_rows, grouped_counts, with_age_at_incidence,
+)
+
+logger = logging.getLogger(__name__)
+
+# Dimensions kept in StratumCount: every MasterData stratification field plus age_group.
+STRATUM_DIMENSIONS = DIMENSION_FIELDS + ('age_group',)
+
+
+# IncidenceCube dimensions, after upload_id.
+CUBE_FIELDS = ('age_group', 'sex', 'topography', 'incidence_year')
+
+
+def instance_age(instance):
+    """
+    Returns the stored age at incidence of a MasterData row, computing it from
+    the dates when it has not been stored yet.
+    """
+    if instance.age_at_incidence is not None:
+        return instance.age_at_incidence
+    return completed_years(instance.birth_date, instance.date_of_incidence)
+
+
+def instance_strata(instance):
+    """
+    Returns the dimension -> value pairs a MasterData row is counted under.
+    """
+    values = {field: getattr(instance, field) for field in DIMENSION_FIELDS}
+    values['age_group'] = age_band(instance_age(instance))
+    return values
+
+
+def instance_cube_key(instance):
+    """
+    Returns the IncidenceCube cell (upload_id, age_group, sex, topography, year) of a MasterData row.
+    """
+    incidence = instance.date_of_incidence
+    return (
+        instance.upload_id,
+        age_band(instance_age(instance)),
+        instance.sex,
+        instance.topography,
+        incidence.year if incidence is not None else None,
+    )
+
+
+def count_deltas(instances, sign=1):
+    """
+    Tallies how many rows each (dimension, value) gains (sign=1) or loses (sign=-1).
+    """
+    deltas = Counter()
+    for instance in instances:
+        for dimension, value in instance_strata(instance).items():
+            deltas[(dimension, value)] += sign
+    return deltas
+
+
+def _key(value):
+    # NULLs are stored as missing=True with value ''
+    if value is None:
+        return '', True
+    return str(value), False
+
+
+# Rows per INSERT ... ON CONFLICT statement, well below every database's bound-parameter limit.
+UPSERT_BATCH_SIZE = 500
+
+
+def _cell_sort_key(item):
+    # Same order in every transaction, so concurrent upserts lock rows without deadlocking
+    return tuple('' if value is None else str(value) for value in item[0])
+
+
+def _upsert_counts(model, rows, conflict_target):
+    """
+    Adds each row's count to the row with the same conflict key, inserting the
+    rows that do not exist yet, with INSERT ... ON CONFLICT DO UPDATE. The
+    database serialises concurrent upserts of one key, so two consolidations
+    creating the same key both land in it.
+
+    Args:
+        model: StratumCount or IncidenceCube.
+        rows (list): Dicts of field -> value, all with the same fields including 'count'.
+        conflict_target (str): SQL of the columns/expressions of the model's unique constraint.
+
+    Returns:
+        list: The counts after the update, one per row.
+    """
+    connection = connections[model.objects.db]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in rows[0]]
+    columns = ', '.join(quote(field.column) for field in fields)
+    placeholders = f"({', '.join(['%s'] * len(fields))})"
+    updates = [f"{quote('count')} = {table}.{quote('count')} + EXCLUDED.{quote('count')}"]
+    updates += [
+        f"{quote(field.column)} = EXCLUDED.{quote(field.column)}" for field in fields if getattr(field, 'auto_now', False)
+    ]
+
+    counts = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            params = [field.get_db_prep_save(row[field.name], connection) for row in batch for field in fields]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([placeholders] * len(batch))} "
+                f"ON CONFLICT ({conflict_target}) DO UPDATE SET {', '.join(updates)} RETURNING {quote('count')}",
+                params,
+            )
+            counts.extend(count for count, in cursor.fetchall())
+    return counts
+
+
+def apply_deltas(deltas):
+    """
+    Adds count deltas to StratumCount. Must run in the transaction that changed
+    MasterData, so counts and rows commit (or roll back) together. Costs
+    O(distinct values touched), not O(rows).
+    """
+    keyed = Counter()
+    for (dimension, value), delta in deltas.items():
+        if delta:
+            keyed[(dimension, *_key(value))] += delta
+    if not keyed:
+        return
+
+    now = timezone.now()
+    rows = [
+        {'dimension': dimension, 'value': value, 'missing': missing, 'count': delta, 'updated_at': now}
+        for (dimension, value, missing), delta in sorted(keyed.items(), key=_cell_sort_key)
+    ]
+    quote = connections[StratumCount.objects.db].ops.quote_name
+    counts = _upsert_counts(StratumCount, rows, ', '.join(quote(name) for name in ('dimension', 'value', 'missing')))
+    if any(count < 0 for count in counts):
+        logger.warning("StratumCount went negative; run 'manage.py rebuild_stratum_counts' to resynchronize.")
+
+
+def cube_deltas(instances, sign=1):
+    """
+    Tallies how many rows each IncidenceCube cell gains (sign=1) or loses (sign=-1).
+    """
+    deltas = Counter()
+    for instance in instances:
+        deltas[instance_cube_key(instance)] += sign
+    return deltas
+
+
+def _cube_conflict_target(connection):
+    # The expressions of IncidenceCube's incidence_cube_cell_unique constraint
+    quote = connection.ops.quote_name
+    coalesced = (('age_group', "''"), ('sex', "''"), ('topography', "''"), ('incidence_year', '-1'))
+    return ', '.join([quote('upload_id')] + [f"COALESCE({quote(field)}, {empty})" for field, empty in coalesced])
+
+
+def apply_cube_deltas(deltas):
+    """
+    Adds cell deltas to IncidenceCube, removing cells that drop to zero. Only
+    the cube rows of the uploads touched are written.
+    """
+    deltas = Counter({cell: delta for cell, delta in deltas.items() if delta})
+    if not deltas:
+        return
+
+    rows = [
+        {'upload_id': cell[0], **dict(zip(CUBE_FIELDS, cell[1:])), 'count': delta}
+        for cell, delta in sorted(deltas.items(), key=_cell_sort_key)
+    ]
+    with transaction.atomic():
+        _upsert_counts(IncidenceCube, rows, _cube_conflict_target(connections[IncidenceCube.objects.db]))
+        IncidenceCube.objects.filter(upload_id__in={cell[0] for cell in deltas}, count__lte=0).delete()
+
+
+def record_row_changes(added=(), removed=()):
+    """
+    Brings StratumCount and IncidenceCube up to date with MasterData rows that
+    were inserted (added) or deleted (removed). An edited row is both.
+    """
+    deltas = count_deltas(added)
+    deltas.update(count_deltas(removed, sign=-1))
+    apply_deltas(deltas)
+
+    cells = cube_deltas(added)
+    cells.update(cube_deltas(removed, sign=-1))
+    apply_cube_deltas(cells)
+
+
+def forget_upload(upload_id):
+    """
+    Takes every MasterData row of an upload out of StratumCount and
+    IncidenceCube. The deltas come from one aggregation over the upload's rows
+    (upload_id index), not one per row, and the upload's cube rows are simply
+    dropped. Call it before deleting the rows, in the same transaction.
+
+    Returns:
+        int: Number of rows the upload had.
+    """
+    sets = [(field,) for field in DIMENSION_FIELDS] + [('age',)]
+    counts = grouped_counts(MasterData.objects.filter(upload_id=upload_id), sets)
+
+    deltas = Counter()
+    for field in DIMENSION_FIELDS:
+        for (value,), rows in counts[(field,)].items():
+            deltas[(field, value)] -= rows
+    for (age,), rows in counts[('age',)].items():
+        deltas[('age_group', age_band(age))] -= rows
+
+    with transaction.atomic():
+        apply_deltas(deltas)
+        IncidenceCube.objects.filter(upload_id=upload_id).delete()
+    return sum(counts[('age',)].values())
+
+
+def rebuild_incidence_cube(upload_id=None):
+    """
+    Recomputes the IncidenceCube rows of one upload (or of every upload) from
+    MasterData. Uses the upload_id index, so one upload costs a scan of its own rows.
+
+    Returns:
+        int: Number of cube rows written.
+    """
+    queryset = MasterData.objects.all()
+    cubes = IncidenceCube.objects.all()
+    if upload_id is not None:
+        queryset = queryset.filter(upload_id=upload_id)
+        cubes = cubes.filter(upload_id=upload_id)
+
+    cells = Counter()
+    grouped = (
+        with_age_at_incidence(queryset).annotate(incidence_year=ExtractYear('date_of_incidence'))
+        .values('upload_id', 'age', 'sex', 'topography', 'incidence_year')
+        .annotate(rows=Count('id'))
+        .order_by()
+    )
+    for row in grouped:
+        cells[(row['upload_id'], age_band(row['age']), row['sex'], row['topography'], row['incidence_year'])] += row['rows']
+
+    with transaction.atomic():
+        cubes.delete()
+        IncidenceCube.objects.bulk_create(
+            IncidenceCube(upload_id=cell[0], count=rows, **dict(zip(CUBE_FIELDS, cell[1:])))
+            for cell, rows in cells.items()
+        )
+    logger.info(f"Rebuilt {len(cells)} incidence cube rows for {upload_id or 'all uploads'}")
+    return len(cells)
+
+
+def incidence_report(group_by, filters=None):
+    """
+    Sums IncidenceCube rows into an incidence report.
+
+    Args:
+        group_by (list): Any of CUBE_FIELDS.
+        filters (dict): Lookups on IncidenceCube, e.g. {'incidence_year__gte': 2020}.
+
+    Returns:
+        list: One dict per group with its fields and 'count'.
+    """
+    rows = (
+        IncidenceCube.objects.filter(**(filters or {}))
+        .values(*group_by)
+        .annotate(count=Sum('count'))
+        .order_by(*group_by)
+    )
+    return list(rows)
+
+
+def rebuild_stratum_counts():
+    """
+    Recomputes StratumCount from MasterData in one aggregation query.
+
+    Returns:
+        int: Number of StratumCount rows written.
+    """
+    sets = [(field,) for field in DIMENSION_FIELDS] + [('age',)]
+    counts = grouped_counts(MasterData.objects.all(), sets)
+
+    totals = Counter()
+    for field in DIMENSION_FIELDS:
+        for (value,), rows in counts[(field,)].items():
+            totals[(field, *_key(value))] += rows
+    for (age,), rows in counts[('age',)].items():
+        totals[('age_group', *_key(age_band(age)))] += rows
+
+    with transaction.atomic():
+        StratumCount.objects.all().delete()
+        StratumCount.objects.bulk_create(
+            StratumCount(dimension=dimension, value=value, missing=missing, count=rows)
+            for (dimension, value, missing), rows in totals.items()
+        )
+    logger.info(f"Rebuilt {len(totals)} stratum counts from MasterData")
+    return len(totals)
+
+
+def stratum_summary():
+    """
+    Builds the stratify_data_view response from StratumCount, reading
+    O(distinct values) rows instead of scanning MasterData.
+    """
+    by_dimension = {dimension: [] for dimension in STRATUM_DIMENSIONS}
+    for row in StratumCount.objects.filter(count__gt=0).order_by('dimension', 'missing', 'value'):
+        if row.dimension in by_dimension:
+            by_dimension[row.dimension].append(row)
+
+    result = {}
+    for key, field in DIMENSIONS:
+        # Same counting as the aggregation path: missing values report 0
+        result[key] = [
+            {field: None if row.missing else row.value, 'count': 0 if row.missing else row.count}
+            for row in by_dimension[field]
+        ]
+    result['by_age_group'] = age_group_rows(Counter({
+        None if row.missing else row.value: row.count for row in by_dimension['age_group']
+    }))
+    return result
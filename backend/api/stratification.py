@@ -0,0 +1,222 @@
+# api/stratification.py
+import logging
+from collections import Counter
+from django.db import connections
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce, ExtractDay, ExtractMonth, ExtractYear
+from .models import MasterData
+
+logger = logging.getLogger(__name__)
+
+# Response key -> MasterData field, in the order stratify_data_view has always returned them.
+DIMENSIONS = (
+    ('by_sex', 'sex'),
+    ('by_grade', 'grade_code'),
+    ('by_topography', 'topography'),
+    ('by_histology', 'histology'),
+    ('by_behavior', 'behavior'),
+    ('by_basis_of_diagnosis', 'basis_of_diagnosis'),
+)
+DIMENSION_FIELDS = tuple(field for _, field in DIMENSIONS)
+
+# Fields that can be combined into cross-tabs.
+CROSSTAB_FIELDS = DIMENSION_FIELDS + ('age_group',)
+
+# Five-year age bands, with everyone from OLDEST_AGE_BAND up in one open band.
+AGE_BAND_WIDTH = 5
+OLDEST_AGE_BAND = 85
+AGE_BANDS = tuple(
+    f"{low}-{low + AGE_BAND_WIDTH - 1}" for low in range(0, OLDEST_AGE_BAND, AGE_BAND_WIDTH)
+) + (f"{OLDEST_AGE_BAND}+",)
+
+
+def age_band(age):
+    """
+    Returns the age band label of an age in completed years, None when unknown.
+    """
+    if age is None or age < 0:
+        return None
+    if age >= OLDEST_AGE_BAND:
+        return AGE_BANDS[-1]
+    return AGE_BANDS[int(age) // AGE_BAND_WIDTH]
+
+
+def with_age_at_incidence(queryset):
+    """
+    Annotates the age at incidence in completed years as 'age': the stored
+    age_at_incidence, or for rows without one, computed by the database from the
+    dates (NULL when either date is missing).
+    """
+    return queryset.annotate(
+        _birth_month=ExtractMonth('birth_date'),
+        _birth_day=ExtractDay('birth_date'),
+        _incidence_month=ExtractMonth('date_of_incidence'),
+        _incidence_day=ExtractDay('date_of_incidence'),
+    ).annotate(
+        age=Coalesce(
+            F('age_at_incidence'),
+            ExtractYear('date_of_incidence') - ExtractYear('birth_date') - Case(
+                When(
+                    Q(_incidence_month__lt=F('_birth_month'))
+                    | Q(_incidence_month=F('_birth_month'), _incidence_day__lt=F('_birth_day')),
+                    then=Value(1),
+                ),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+        )
+    )
+
+
+def parse_crosstabs(specs):
+    """
+    Parses cross-tab specs such as 'sex,topography' into field tuples.
+
+    Raises:
+        ValueError: If a spec names an unknown field or fewer than two fields.
+    """
+    crosstabs = []
+    for spec in specs:
+        fields = tuple(name.strip() for name in spec.split(',') if name.strip())
+        unknown = [name for name in fields if name not in CROSSTAB_FIELDS]
+        if unknown or len(fields) < 2:
+            raise ValueError(f"Invalid crosstab '{spec}'. Use two or more of: {', '.join(CROSSTAB_FIELDS)}")
+        crosstabs.append(fields)
+    return crosstabs
+
+
+def _source_field(field):
+    return 'age' if field == 'age_group' else field
+
+
+def _grouping_sets(queryset, sets):
+    """
+    PostgreSQL: every grouping set in one scan with GROUP BY GROUPING SETS.
+    """
+    columns = sorted({column for grouping in sets for column in grouping})
+    source = with_age_at_incidence(queryset).values(*columns).order_by()
+    inner_sql, params = source.query.sql_with_params()
+
+    connection = connections[queryset.db]
+    quoted = [connection.ops.quote_name(column) for column in columns]
+    flags = ', '.join(f"GROUPING({name})" for name in quoted)
+    sets_sql = ', '.join(
+        '(' + ', '.join(connection.ops.quote_name(column) for column in grouping) + ')' for grouping in sets
+    )
+    sql = (
+        f"SELECT {', '.join(quoted)}, {flags}, COUNT(*) FROM ({inner_sql}) AS source "
+        f"GROUP BY GROUPING SETS ({sets_sql})"
+    )
+
+    # Raw rows hold the stored column values, so coded dimensions are decoded here
+    decoders = {}
+    for column in columns:
+        if column != 'age':
+            field = MasterData._meta.get_field(column)
+            decoders[column] = getattr(field, 'from_db_value', None)
+
+    counts = {grouping: Counter() for grouping in sets}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            values = dict(zip(columns, row[:len(columns)]))
+            for column, decode in decoders.items():
+                if decode is not None:
+                    values[column] = decode(values[column], None, connection)
+            grouped = frozenset(column for column, flag in zip(columns, row[len(columns):-1]) if flag == 0)
+            for grouping in sets:
+                if frozenset(grouping) == grouped:
+                    counts[grouping][tuple(values[column] for column in grouping)] += row[-1]
+    return counts
+
+
+def _rolled_up(queryset, sets):
+    """
+    Other databases: one GROUP BY over every column involved, then each grouping
+    set is summed from those cells. The table is still scanned once; the roll-up
+    costs O(distinct combinations).
+    """
+    columns = sorted({column for grouping in sets for column in grouping})
+    cells = with_age_at_incidence(queryset).values(*columns).annotate(rows=Count('id')).order_by()
+
+    counts = {grouping: Counter() for grouping in sets}
+    for cell in cells:
+        for grouping in sets:
+            counts[grouping][tuple(cell[column] for column in grouping)] += cell['rows']
+    return counts
+
+
+def age_group_rows(age_groups):
+    """
+    Formats a Counter of age band -> records as by_age_group rows, youngest band
+    first and unknown ages last.
+    """
+    order = {band: position for position, band in enumerate(AGE_BANDS)}
+    return [
+        {'age_group': band, 'count': age_groups[band]}
+        for band in sorted(age_groups, key=lambda band: order.get(band, len(order)))
+    ]
+
+
+def grouped_counts(queryset, sets):
+    """
+    Counts records per value combination of each grouping set in one query.
+    'age' in a set stands for the age at incidence in completed years.
+
+    Returns:
+        dict: Grouping set -> Counter of value tuples.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        return _grouping_sets(queryset, sets)
+    return _rolled_up(queryset, sets)
+
+
+def stratify(queryset=None, crosstabs=()):
+    """
+    Computes every stratification, the age-group distribution and any requested
+    cross-tabs in a single aggregation query.
+
+    The by_<dimension> lists keep their original shape and counting: the count is
+    the number of non-null values, so the group of missing values reports 0.
+    Age groups and cross-tabs count records.
+
+    Args:
+        queryset (QuerySet): MasterData rows to stratify (default: all).
+        crosstabs (list): Field tuples from parse_crosstabs.
+
+    Returns:
+        dict: by_<dimension> lists, by_age_group and, if requested, crosstabs.
+    """
+    queryset = MasterData.objects.all() if queryset is None else queryset
+    sets = [(field,) for field in DIMENSION_FIELDS] + [('age',)]
+    for crosstab in crosstabs:
+        grouping = tuple(_source_field(field) for field in crosstab)
+        if grouping not in sets:
+            sets.append(grouping)
+
+    counts = grouped_counts(queryset, sets)
+
+    result = {}
+    for key, field in DIMENSIONS:
+        result[key] = [
+            {field: value, 'count': rows if value is not None else 0}
+            for (value,), rows in counts[(field,)].items()
+        ]
+
+    age_groups = Counter()
+    for (age,), rows in counts[('age',)].items():
+        age_groups[age_band(age)] += rows
+    result['by_age_group'] = age_group_rows(age_groups)
+
+    if crosstabs:
+        result['crosstabs'] = {}
+        for crosstab in crosstabs:
+            grouping = tuple(_source_field(field) for field in crosstab)
+            cells = Counter()
+            for values, rows in counts[grouping].items():
+                values = tuple(age_band(value) if field == 'age_group' else value for field, value in zip(crosstab, values))
+                cells[values] += rows
+            result['crosstabs']['_x_'.join(crosstab)] = [
+                {**dict(zip(crosstab, values)), 'count': rows} for values, rows in cells.items()
+            ]
+    return result
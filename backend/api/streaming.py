@@ -0,0 +1,54 @@
+# api/streaming.py
+import json
+import logging
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# Rows serialized per chunk written to a streaming response.
+STREAM_WRITE_ROWS = 500
+
+
+def _dumps(row):
+    return json.dumps(row, cls=DjangoJSONEncoder)
+
+
+def iter_json_array(rows, write_rows=STREAM_WRITE_ROWS):
+    """
+    Serializes rows as one JSON array, yielding it piece by piece so the
+    response starts before the last row has been read.
+    """
+    yield '['
+    pending = []
+    first = True
+    try:
+        for row in rows:
+            pending.append(_dumps(row))
+            if len(pending) >= write_rows:
+                yield ('' if first else ',') + ','.join(pending)
+                pending, first = [], False
+        if pending:
+            yield ('' if first else ',') + ','.join(pending)
+    except Exception as e:
+        # Headers are already sent, so the error can only be logged
+        logger.error(f"Streaming JSON response aborted: {str(e)}", exc_info=True)
+        raise
+    yield ']'
+
+
+def iter_ndjson(rows, write_rows=STREAM_WRITE_ROWS):
+    """
+    Serializes rows as newline-delimited JSON, one object per line.
+    """
+    pending = []
+    try:
+        for row in rows:
+            pending.append(_dumps(row))
+            if len(pending) >= write_rows:
+                yield '\n'.join(pending) + '\n'
+                pending = []
+        if pending:
+            yield '\n'.join(pending) + '\n'
+    except Exception as e:
+        logger.error(f"Streaming NDJSON response aborted: {str(e)}", exc_info=True)
+        raise
@@ -1,8 +1,13 @@
 # api/tasks.py
+import os
 import uuid
 import logging
-from celery import shared_task
-from .utils import run_validations, send_progress, run_data_combination_edits, run_site_morphology_edits
+from celery import Task, shared_task, chord
+from django.conf import settings
+from .utils import run_all_validations, send_progress
+from .ingestion import iter_record_batches
+from .staging import VALIDATION_COLUMNS, read_staged_records, staged_row_count
+from .uploads import record_validation
 # Import your actual auto-correction logic/module
 # from .auto_correction_module import perform_auto_correction
 import time  # For simulating long-running tasks
@@ -51,25 +56,67 @@ def auto_correct_codes(upload_id, dataset):
         send_progress(upload_id, f"Auto-correction failed: {str(e)}")
         raise
 
-def run_all_validations_task(validation_id, dataset):
+class CompletionReportingTask(Task):
     """
-    Function to run all validations on the provided dataset.
+    Base of the tasks whose result ValidationResultsAPIView serves.
+
+    The 'complete' progress message is sent from on_success, which Celery calls
+    only after the result is stored. A client that fetches results_url as soon as
+    it sees 'complete' therefore always gets the result, never a 202.
+    """
+
+    completion_label = 'Validation'
+
+    def on_success(self, retval, task_id, args, kwargs):
+        if 'total_records' in retval:
+            valid, total = retval['valid_records'], retval['total_records']
+        else:
+            valid, total = len(retval['valid_entries']), len(retval['validation_results'])
+        send_progress(
+            retval['validation_id'], f"{self.completion_label} completed: {valid}/{total} records valid.",
+            msg_type='complete',
+        )
+
+
+@shared_task(base=CompletionReportingTask)
+def run_all_validations_task(validation_id, dataset=None, upload_id=None):
+    """
+    Celery task that runs every validation stage on the provided dataset.
+
+    Stage progress is streamed to ws/validations/<validation_id>/ by
+    run_all_validations. The return value is kept in the Celery result backend
+    and served by ValidationResultsAPIView.
+
+    Args:
+        validation_id (str): Tracking id; also used as the Celery task id.
+        dataset (list): Records to validate.
+        upload_id (str): Staged upload to validate instead of dataset. Its valid
+            entries are then stored server-side and only the invalid ones returned.
+
+    Returns:
+        dict: validation_id, every record with its validation status, and the valid records.
     """
     try:
         logging.info(f"Validation task {validation_id} started.")
+        dataset_was_staged = dataset is None
+        if dataset_was_staged:
+            dataset = read_staged_records(upload_id, VALIDATION_COLUMNS)
 
-        # Run all validations, filtering out invalid entries for stratification
-        individual_results = run_validations(dataset)
+        _, results = run_all_validations(dataset, validation_id)
 
-        # Filter valid entries from individual results
-        valid_entries = [entry for entry in individual_results if entry.get("is_valid")]
+        if dataset_was_staged:
+            summary = record_validation(upload_id, results)
+            logging.info(f"Validation task {validation_id} completed successfully.")
+            return {"validation_id": validation_id, "upload_id": str(upload_id), **summary}
 
-        logging.info(f"Validation task {validation_id} completed successfully.")
+        # Filter valid entries for consolidation and stratification
+        valid_entries = [entry for entry in results if entry.get("is_valid")]
 
+        logging.info(f"Validation task {validation_id} completed successfully.")
         return {
             "validation_id": validation_id,
-            "validation_results": individual_results,  # All entries with validation statuses
-            "valid_entries": valid_entries,            # Only valid entries for stratification
+            "validation_results": results,  # All entries with validation statuses
+            "valid_entries": valid_entries,  # Only valid entries for stratification
         }
 
     except Exception as e:
@@ -77,5 +124,174 @@ def run_all_validations_task(validation_id, dataset):
         raise
 
 
+@shared_task
+def validate_chunk_task(validation_id, chunk_index, total_chunks, chunk=None, upload_id=None, offset=0, limit=None):
+    """
+    Celery task that validates one slice of a large dataset. The slice is either
+    passed in as chunk or read as rows offset..offset+limit of a staged upload.
+
+    Returns:
+        dict: chunk_index and the validated records of this chunk.
+    """
+    if chunk is None:
+        chunk = read_staged_records(upload_id, VALIDATION_COLUMNS, offset, limit)
+    _, results = run_all_validations(chunk, validation_id, report_progress=False)
+
+    completed = _count_completed_chunk(validation_id, total_chunks)
+    send_progress(
+        validation_id,
+        f"Validated chunk {completed or chunk_index + 1}/{total_chunks}.",
+        msg_type='info',
+    )
+    return {"chunk_index": chunk_index, "validation_results": results}
+
+
+@shared_task(base=CompletionReportingTask)
+def merge_validation_results_task(chunk_results, validation_id, upload_id=None):
+    """
+    Chord callback that stitches chunk results back together in dataset order.
+
+    Returns:
+        dict: Same shape as run_all_validations_task.
+    """
+    results = []
+    for chunk in sorted(chunk_results, key=lambda chunk: chunk["chunk_index"]):
+        results.extend(chunk["validation_results"])
+
+    if upload_id is not None:
+        summary = record_validation(upload_id, results)
+        return {"validation_id": validation_id, "upload_id": str(upload_id), **summary}
+    valid_entries = [entry for entry in results if entry.get("is_valid")]
+
+    logging.info(f"Validation {validation_id}: merged {len(chunk_results)} chunks, {len(valid_entries)}/{len(results)} valid.")
+    return {
+        "validation_id": validation_id,
+        "validation_results": results,
+        "valid_entries": valid_entries,
+    }
+
+
+# Invalid records kept in an ingestion result for review; the rest are only counted.
+MAX_INVALID_SAMPLES = 1000
+
 
+@shared_task(base=CompletionReportingTask, completion_label='Ingestion')
+def ingest_file_task(validation_id, file_path, file_format, user_id, upload_id):
+    """
+    Celery task that streams an uploaded file through validation and consolidation.
+
+    The file is read in INGESTION_BATCH_SIZE record batches; each batch is
+    validated and its valid entries are saved to MasterData before the next batch
+    is read, so memory use does not grow with the file.
+
+    Args:
+        validation_id (str): Tracking id for progress messages.
+        file_path (str): Path of the uploaded file.
+        file_format (str): 'csv', 'xlsx', 'xls' or 'json'.
+        user_id (int): Id of the uploading user.
+        upload_id (str): Upload the consolidated entries belong to.
+
+    Returns:
+        dict: Record counts and up to MAX_INVALID_SAMPLES invalid records.
+    """
+    from django.contrib.auth.models import User
+    from .consolidation import ConsolidationReport, consolidate_entries
+
+    try:
+        user = User.objects.get(pk=user_id)
+        send_progress(validation_id, f"Ingesting {file_path}.", msg_type='info')
+
+        total = valid = 0
+        invalid_entries = []
+        consolidated = ConsolidationReport()
+        for number, batch in enumerate(iter_record_batches(file_path, file_format, settings.INGESTION_BATCH_SIZE), start=1):
+            _, results = run_all_validations(batch, validation_id, report_progress=False)
+            valid_entries = [entry for entry in results if entry.get("is_valid")]
+            if valid_entries:
+                report = consolidate_entries(user, upload_id, valid_entries)
+                consolidated.inserted += report.inserted
+                consolidated.updated += report.updated
+                consolidated.skipped += report.skipped
+
+            total += len(results)
+            valid += len(valid_entries)
+            room = MAX_INVALID_SAMPLES - len(invalid_entries)
+            if room > 0:
+                invalid_entries.extend([entry for entry in results if not entry.get("is_valid")][:room])
+            send_progress(validation_id, f"Batch {number}: {valid}/{total} records valid so far.", msg_type='info')
+
+        logging.info(f"Ingestion {validation_id} completed: {valid}/{total} records valid.")
+        return {
+            "validation_id": validation_id,
+            "upload_id": str(upload_id),
+            "total_records": total,
+            "valid_records": valid,
+            "invalid_records": total - valid,
+            "inserted": consolidated.inserted,
+            "updated": consolidated.updated,
+            "skipped": consolidated.skipped,
+            "invalid_entries": invalid_entries,
+        }
+
+    except Exception as e:
+        logging.error(f"Error in ingestion task {validation_id}: {str(e)}", exc_info=True)
+        send_progress(validation_id, f"Ingestion failed: {str(e)}", msg_type='error')
+        raise
+    finally:
+        # The uploaded file was only kept for this task
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def _count_completed_chunk(validation_id, total_chunks):
+    """
+    Increments the shared count of finished chunks in the result backend's Redis.
+    Returns None if the count is unavailable.
+    """
+    try:
+        import redis
+        client = redis.Redis.from_url(settings.CELERY_RESULT_BACKEND)
+        key = f"zeda:validation:{validation_id}:chunks_done"
+        completed = client.incr(key)
+        client.expire(key, 60 * 60 * 24)
+        return min(completed, total_chunks)
+    except Exception as e:
+        logging.warning(f"Could not update chunk count for validation {validation_id}: {str(e)}")
+        return None
+
+
+def submit_validation(validation_id, dataset=None, upload_id=None):
+    """
+    Queues a validation and returns immediately.
+
+    Datasets up to VALIDATION_CHUNK_SIZE records run as one task. Larger ones are
+    split into chunks fanned out as a Celery chord across the worker pool; the
+    chord callback carries the validation_id as its task id, so the results
+    endpoint reads the merged result exactly as it reads a single task's result.
+
+    A staged upload is referenced by upload_id instead of a dataset; tasks then
+    read their rows from the staging file rather than from the message.
+    """
+    chunk_size = settings.VALIDATION_CHUNK_SIZE
+    total = len(dataset) if dataset is not None else staged_row_count(upload_id)
+    if total <= chunk_size:
+        run_all_validations_task.apply_async(
+            args=[validation_id], kwargs={"dataset": dataset, "upload_id": upload_id}, task_id=validation_id,
+        )
+        return 1
 
+    starts = range(0, total, chunk_size)
+    send_progress(validation_id, f"Validating {total} records in {len(starts)} chunks.", msg_type='info')
+    if dataset is not None:
+        header = [
+            validate_chunk_task.s(validation_id, index, len(starts), dataset[start:start + chunk_size])
+            for index, start in enumerate(starts)
+        ]
+    else:
+        header = [
+            validate_chunk_task.s(validation_id, index, len(starts), upload_id=upload_id, offset=start, limit=chunk_size)
+            for index, start in enumerate(starts)
+        ]
+    callback = merge_validation_results_task.s(validation_id, upload_id if dataset is None else None)
+    chord(header)(callback.set(task_id=validation_id))
+    return len(starts)
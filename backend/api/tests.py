@@ -1,3 +1,935 @@
-from django.test import TestCase
+import json
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from datetime import date
+from unittest import mock
+from collections import Counter
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldError
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rapidfuzz import process
+from rest_framework.test import APIClient
+from .code_tables import get_code_table
+from .consolidation import consolidate_entries
+from .correction_cache import REDIS_RETRY_SECONDS, CorrectionCache
+from .dates import ParsedDates, ages_at_incidence, completed_years, parse_date_column
+from .fuzzy import batch_closest_matches, batch_correct
+from .indexes import explain_access_paths, index_usage, table_scans
+from .ingestion import iter_record_batches
+from .models import DimensionCode, IncidenceCube, MasterData, MasterDataRevision, StratumCount
+from .rules import RuleSet, SiteMorphologyIndex, expand_sites, get_rule_set
+from .strata import apply_cube_deltas, apply_deltas, incidence_report, rebuild_incidence_cube, rebuild_stratum_counts
+from .staging import (
+    StagedUploadNotFound, read_staged_records, replace_staged_columns, stage_records, staged_row_count, staging_path,
+)
+from .stratification import DIMENSIONS, age_band, age_group_rows, parse_crosstabs, stratify
+from .streaming import iter_json_array, iter_ndjson
+from .tasks import merge_validation_results_task, run_all_validations_task, submit_validation
+from .uploads import UploadNotOwned, consolidate_upload, log_step, rollback_upload, store_valid_entries
+from .utils import run_validations
+from .validation_engine import ERROR_BITS, FIELD_CHECKS, field_error_mask, records_to_frame
 
-# Create your tests here.
+
+def entry(registration_number, topography='C50.9', sex='1', birth_date='1950-03-01', date_of_incidence='2020-06-15',
+          histology='8500/3', behavior='3', grade_code='9', basis_of_diagnosis='7'):
+    return {
+        'registration_number': registration_number,
+        'sex': sex,
+        'birth_date': birth_date,
+        'date_of_incidence': date_of_incidence,
+        'topography': topography,
+        'histology': histology,
+        'behavior': behavior,
+        'grade_code': grade_code,
+        'basis_of_diagnosis': basis_of_diagnosis,
+    }
+
+
+class SummaryTablesTests(TestCase):
+    """
+    StratumCount and IncidenceCube are kept up to date by delta; after every
+    kind of change they must equal a rebuild from MasterData.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+
+    def summaries(self):
+        counts = {
+            (row.dimension, row.value, row.missing): row.count
+            for row in StratumCount.objects.all() if row.count
+        }
+        cube = {
+            (row.upload_id, row.age_group, row.sex, row.topography, row.incidence_year): row.count
+            for row in IncidenceCube.objects.all()
+        }
+        return counts, cube
+
+    def assertSummariesRebuilt(self):
+        maintained = self.summaries()
+        rebuild_stratum_counts()
+        rebuild_incidence_cube()
+        self.assertEqual(maintained, self.summaries())
+
+    def test_insert(self):
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1'), entry('R2', sex='2'), entry('R3', birth_date=None)])
+        self.assertEqual(StratumCount.objects.get(dimension='sex', value='1').count, 2)
+        self.assertSummariesRebuilt()
+
+    def test_upsert(self):
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1'), entry('R2')])
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1', topography='C18.0', sex='2'), entry('R4')])
+        self.assertEqual(StratumCount.objects.get(dimension='topography', value='C18.0').count, 1)
+        self.assertSummariesRebuilt()
+
+    def test_single_row_edit(self):
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1'), entry('R2')])
+        row = MasterData.objects.get(registration_number='R1')
+        row.topography = 'C61.9'
+        row.save()
+        self.assertSummariesRebuilt()
+
+    def test_delete(self):
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1'), entry('R2')])
+        MasterData.objects.get(registration_number='R2').delete()
+        self.assertEqual(StratumCount.objects.get(dimension='sex', value='1').count, 1)
+        self.assertSummariesRebuilt()
+
+    def test_rollback(self):
+        first, second = uuid.uuid4(), uuid.uuid4()
+        consolidate_entries(self.user, first, [entry('R1'), entry('R2')])
+        consolidate_entries(self.user, second, [entry('R1', topography='C18.0'), entry('R3')])
+
+        self.assertEqual(rollback_upload(second, self.user), {'deleted': 1, 'restored': 1})
+        row = MasterData.objects.get(registration_number='R1')
+        self.assertEqual((row.topography, row.upload_id), ('C50.9', first))
+        self.assertFalse(MasterData.objects.filter(registration_number='R3').exists())
+        self.assertFalse(MasterDataRevision.objects.exists())
+        self.assertSummariesRebuilt()
+
+    def test_rollback_under_later_update(self):
+        first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        consolidate_entries(self.user, first, [entry('R1')])
+        consolidate_entries(self.user, second, [entry('R1', topography='C18.0')])
+        consolidate_entries(self.user, third, [entry('R1', topography='C61.9')])
+
+        # The later value stays; rolling back the later upload then ends at the original row
+        rollback_upload(second, self.user)
+        self.assertEqual(MasterData.objects.get(registration_number='R1').topography, 'C61.9')
+        self.assertSummariesRebuilt()
+        rollback_upload(third, self.user)
+        self.assertEqual(MasterData.objects.get(registration_number='R1').topography, 'C50.9')
+        self.assertSummariesRebuilt()
+
+    def test_upsert_of_new_keys(self):
+        # Two writers adding the same new stratum or cell end up in one row
+        upload_id = uuid.uuid4()
+        cell = (upload_id, None, '1', None, None)
+        for _ in range(2):
+            apply_deltas(Counter({('sex', '9'): 1}))
+            apply_cube_deltas(Counter({cell: 2}))
+        self.assertEqual(StratumCount.objects.get(dimension='sex', value='9').count, 2)
+        self.assertEqual(list(IncidenceCube.objects.values_list('sex', 'count')), [('1', 4)])
+        apply_cube_deltas(Counter({cell: -4}))
+        self.assertFalse(IncidenceCube.objects.exists())
+
+    def test_rollback_refuses_rows_of_other_users(self):
+        other = User.objects.create(username='other')
+        upload_id = uuid.uuid4()
+        consolidate_entries(self.user, upload_id, [entry('R1')])
+        consolidate_entries(other, upload_id, [entry('R2')])
+        with self.assertRaises(UploadNotOwned):
+            rollback_upload(upload_id, self.user)
+        self.assertEqual(MasterData.objects.filter(upload_id=upload_id).count(), 2)
+
+
+class ConsolidateEntriesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+
+    def test_counts(self):
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1'), entry('R2')])
+        report = consolidate_entries(
+            self.user, uuid.uuid4(),
+            [
+                entry('R1', topography='C18.0'),  # updates R1
+                entry('R2'),  # identical to the stored row
+                entry('R3'),
+                entry('R3', sex='2'),  # same key twice: the last one wins
+            ],
+            batch_size=10,
+        )
+        self.assertEqual((report.inserted, report.updated, report.skipped), (1, 1, 2))
+        self.assertEqual(report.conflict_count, 3)
+        self.assertEqual(MasterData.objects.count(), 3)
+        self.assertEqual(MasterData.objects.get(registration_number='R3').sex, '2')
+
+    def test_skip_on_conflict(self):
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1')])
+        report = consolidate_entries(self.user, uuid.uuid4(), [entry('R1', topography='C18.0')], on_conflict='skip')
+        self.assertEqual((report.inserted, report.updated, report.skipped), (0, 0, 1))
+        self.assertEqual(MasterData.objects.get(registration_number='R1').topography, 'C50.9')
+        self.assertFalse(MasterDataRevision.objects.exists())
+
+    def test_batches(self):
+        report = consolidate_entries(self.user, uuid.uuid4(), (entry(f"R{number}") for number in range(25)), batch_size=10)
+        self.assertEqual(report.inserted, 25)
+        self.assertEqual(MasterData.objects.count(), 25)
+        self.assertEqual(MasterData.objects.filter(age_at_incidence=70).count(), 25)
+
+    def rows(self):
+        return list(MasterData.objects.order_by('registration_number').values(
+            'id', 'registration_number', 'upload_id', 'topography', 'sex', 'age_at_incidence',
+        ))
+
+    def test_sqlite_upsert(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite write path')
+        first, second = uuid.uuid4(), uuid.uuid4()
+        consolidate_entries(self.user, first, [entry('R1'), entry('R2')])
+        with CaptureQueriesContext(connection) as queries:
+            consolidate_entries(self.user, second, [entry('R1', topography='C18.0', birth_date='1960-03-01'), entry('R3')])
+        upserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "api_masterdata"')]
+        self.assertEqual(len(upserts), 1)
+        self.assertIn('ON CONFLICT', upserts[0])
+        upserted = self.rows()
+        # Updated in place: same id and upload, values of the later upload
+        self.assertEqual(upserted[0]['id'], MasterDataRevision.objects.get().row_id)
+        self.assertEqual(
+            [(row['registration_number'], row['upload_id'], row['topography'], row['age_at_incidence']) for row in upserted],
+            [('R1', first, 'C18.0', 60), ('R2', first, 'C50.9', 70), ('R3', second, 'C50.9', 70)],
+        )
+
+        # Without upsert support the insert + bulk_update fallback gives the same rows
+        MasterData.objects.all().delete()
+        MasterDataRevision.objects.all().delete()
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            consolidate_entries(self.user, first, [entry('R1'), entry('R2')])
+            consolidate_entries(self.user, second, [entry('R1', topography='C18.0', birth_date='1960-03-01'), entry('R3')])
+        strip = lambda rows: [{key: value for key, value in row.items() if key != 'id'} for row in rows]
+        self.assertEqual(strip(self.rows()), strip(upserted))
+
+    def test_unknown_on_conflict(self):
+        with self.assertRaises(ValueError):
+            consolidate_entries(self.user, uuid.uuid4(), [entry('R1')], on_conflict='replace')
+
+
+class CodeFieldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+        consolidate_entries(self.user, uuid.uuid4(), [entry('R1'), entry('R2', topography='C99.9', sex='2')])
+
+    def test_stored_as_code_id(self):
+        row = MasterData.objects.get(registration_number='R2')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT topography FROM api_masterdata WHERE id = %s", [row.pk])
+            stored = cursor.fetchone()[0]
+        self.assertEqual(stored, DimensionCode.objects.get(dimension='topography', code='C99.9').pk)
+
+    def test_decoded(self):
+        row = MasterData.objects.get(registration_number='R2')
+        self.assertEqual((row.topography, row.sex), ('C99.9', '2'))
+        self.assertEqual(
+            sorted(MasterData.objects.values_list('topography', flat=True)), ['C50.9', 'C99.9'],
+        )
+
+    def test_filter(self):
+        self.assertEqual(MasterData.objects.get(topography='C99.9').registration_number, 'R2')
+        self.assertEqual(MasterData.objects.filter(topography__in=['C50.9', 'C99.9']).count(), 2)
+        codes = DimensionCode.objects.count()
+        self.assertFalse(MasterData.objects.filter(topography='C00.0-not-a-code').exists())
+        self.assertEqual(DimensionCode.objects.count(), codes)
+
+    def test_non_exact_lookups_rejected(self):
+        for lookup in ('topography__startswith', 'topography__contains', 'sex__gt'):
+            with self.assertRaises(FieldError):
+                MasterData.objects.filter(**{lookup: 'C5'}).count()
+        self.assertEqual(MasterData.objects.filter(topography__isnull=False).count(), 2)
+
+    def test_bulk_update(self):
+        rows = list(MasterData.objects.order_by('registration_number'))
+        rows[0].topography, rows[1].topography = 'C18.0', 'C34.9'
+        MasterData.objects.bulk_update(rows, ['topography'])
+        self.assertEqual(
+            list(MasterData.objects.order_by('registration_number').values_list('topography', flat=True)),
+            ['C18.0', 'C34.9'],
+        )
+
+
+class RuleSetTests(TestCase):
+    def assertSameErrors(self, rule_set, dataset):
+        errors = rule_set.evaluate(dataset)
+        self.assertEqual(errors, rule_set.evaluate_frame(dataset))
+        return errors
+
+    def test_conditions(self):
+        rule_set = RuleSet('test', [
+            {'id': 'a', 'field': 'histology', 'when': {'histology': ['9650'], 'age_outside': [0, 2]},
+             'message': "Histology {histology} at age {age}"},
+            {'id': 'b', 'field': 'sex', 'when': {'sex': ['1'], 'site_prefix': 'C5'}, 'message': "Sex {sex} at {site}"},
+            {'id': 'c', 'when': {'histology_prefix': '80', 'age_min': 90}, 'message': "Old {age}"},
+            {'id': 'd', 'when': {'histology_max': 8000, 'histology_not_prefix': '79'}, 'message': "Low {histology}"},
+            {'id': 'e', 'when': {'histology_family': ['81'], 'behavior': ['2']}, 'message': "In situ {histology}"},
+        ], version=1)
+        dataset = [
+            {'histology': '9650/3', 'age_at_incidence': 40, 'sex': '1', 'topography': 'C50.9'},
+            {'histology': '9650/3', 'age_at_incidence': 1, 'sex': '2', 'topography': 'C18.0'},
+            {'histology': '8010/3', 'age_at_incidence': 95, 'sex': None, 'topography': None},
+            {'histology': '7500', 'age_at_incidence': None, 'behavior': '2'},
+            {'histology': '8140/2', 'age_at_incidence': '95', 'behavior': '2'},
+            {'histology': None, 'age_at_incidence': 50},
+        ]
+        errors = self.assertSameErrors(rule_set, dataset)
+        self.assertEqual(errors[0], ["histology: Histology 9650 at age 40", "sex: Sex 1 at C50.9"])
+        self.assertEqual(sorted(errors), [0, 2, 3, 4])
+
+    def test_combination_rules(self):
+        rule_set = get_rule_set('combination_rules')
+        histologies = sorted({
+            value for rule in rule_set.rules for name, _, arg in rule.conditions if name == 'histology' for value in arg
+        })
+        generator = random.Random(18)
+        dataset = [
+            {
+                'histology': f"{generator.choice(histologies)}/{generator.choice('0123')}",
+                'topography': generator.choice(['C50.9', 'C61.9', 'C53.9', 'C71.0', 'C22.0', None]),
+                'sex': generator.choice(['1', '2', None]),
+                'behavior': generator.choice(['0', '2', '3']),
+                'grade_code': generator.choice(['1', '9']),
+                'basis_of_diagnosis': generator.choice(['1', '7']),
+                'age_at_incidence': generator.choice([None, generator.randint(0, 100)]),
+            }
+            for _ in range(500)
+        ]
+        self.assertTrue(self.assertSameErrors(rule_set, dataset))
+
+
+class IngestionTests(TestCase):
+    """
+    Every upload format yields the same record dicts of strings.
+    """
+
+    columns = ('registration_number', 'sex', 'birth_date', 'date_of_incidence', 'topography',
+               'histology', 'behavior', 'grade_code', 'basis_of_diagnosis')
+    rows = (
+        ('R1', 1, '1950-03-01', '2020-06-15', 'C50.9', '8500/3', 3, 9, 7),
+        ('R2', 2, '1961-11-30', '2021-01-02', 'C18.0', '8140/3', 3, 2, None),
+    )
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.expected = [
+            {column: None if value is None else str(value) for column, value in zip(self.columns, row)}
+            for row in self.rows
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def records(self, path, file_format):
+        return [record for batch in iter_record_batches(path, file_format, batch_size=1) for record in batch]
+
+    def delimited(self, delimiter, header=True):
+        lines = [delimiter.join(self.columns)] if header else []
+        lines += [delimiter.join('' if value is None else str(value) for value in row) for row in self.rows]
+        return '\n'.join(lines) + '\n'
+
+    def test_csv(self):
+        self.assertEqual(self.records(self.write('upload.csv', self.delimited(',')), 'csv'), self.expected)
+
+    def test_csv_semicolons(self):
+        self.assertEqual(self.records(self.write('upload.csv', self.delimited(';')), 'csv'), self.expected)
+
+    def test_csv_without_header(self):
+        self.assertEqual(self.records(self.write('upload.csv', self.delimited(',', header=False)), 'csv'), self.expected)
+
+    def test_xlsx(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(self.columns)
+        for row in self.rows:
+            workbook.active.append(row)
+        path = os.path.join(self.directory, 'upload.xlsx')
+        workbook.save(path)
+        self.assertEqual(self.records(path, 'xlsx'), self.expected)
+
+    def test_json_array(self):
+        content = json.dumps([dict(zip(self.columns, row)) for row in self.rows])
+        self.assertEqual(self.records(self.write('upload.json', content), 'json'), self.expected)
+
+    def test_json_array_across_reads(self):
+        # Items and numbers split between reads of the file
+        content = json.dumps([dict(zip(self.columns, row)) for row in self.rows])
+        with mock.patch('api.ingestion.JSON_READ_SIZE', 7):
+            self.assertEqual(self.records(self.write('upload.json', content), 'json'), self.expected)
+
+    def test_ndjson(self):
+        content = '\n'.join(json.dumps(dict(zip(self.columns, row))) for row in self.rows)
+        self.assertEqual(self.records(self.write('upload.json', content), 'json'), self.expected)
+
+    def test_column_json(self):
+        content = json.dumps(
+            {column: {str(index): row[position] for index, row in enumerate(self.rows)}
+             for position, column in enumerate(self.columns)},
+            indent=2,
+        )
+        self.assertEqual(self.records(self.write('upload.json', content), 'json'), self.expected)
+
+
+class StagingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(UPLOAD_STAGING_DIR=self.directory)
+        self.settings.enable()
+        self.user = User.objects.create(username='registrar')
+        self.upload_id = str(uuid.uuid4())
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        records = [
+            {'registration_number': 'R1', 'sex': 1, 'birth_date': date(1950, 3, 1), 'histology': 8500.0},
+            {'registration_number': 'R2', 'sex': None, 'birth_date': '1961-11-30', 'histology': float('nan')},
+        ]
+        self.assertEqual(stage_records(self.upload_id, records, batch_size=1)['rows'], 2)
+        self.assertEqual(staged_row_count(self.upload_id), 2)
+        self.assertEqual(read_staged_records(self.upload_id), [
+            {'registration_number': 'R1', 'sex': '1', 'birth_date': '1950-03-01', 'histology': '8500.0'},
+            {'registration_number': 'R2', 'sex': None, 'birth_date': '1961-11-30', 'histology': None},
+        ])
+        self.assertEqual(read_staged_records(self.upload_id, ['sex', 'unknown'], offset=1, limit=1), [{'sex': None}])
+
+        replace_staged_columns(self.upload_id, {'sex': ['2', '1'], 'grade_code': [9, None]})
+        self.assertEqual(
+            read_staged_records(self.upload_id, ['sex', 'grade_code']),
+            [{'sex': '2', 'grade_code': '9'}, {'sex': '1', 'grade_code': None}],
+        )
+
+    def test_unknown_upload(self):
+        with self.assertRaises(StagedUploadNotFound):
+            staged_row_count(self.upload_id)
+        with self.assertRaises(StagedUploadNotFound):
+            read_staged_records('not-a-uuid')
+
+    def test_removed_after_consolidation_and_rollback(self):
+        stage_records(self.upload_id, [entry('R1')])
+        store_valid_entries(self.upload_id, [entry('R1')])
+        consolidate_upload(self.user, self.upload_id)
+        self.assertFalse(os.path.exists(staging_path(self.upload_id)))
+
+        stage_records(self.upload_id, [entry('R1')])
+        rollback_upload(self.upload_id, self.user)
+        self.assertFalse(os.path.exists(staging_path(self.upload_id)))
+
+
+class AccessPathTests(TestCase):
+    def test_empty_table(self):
+        self.assertTrue(all(path['plan'] for path in explain_access_paths()))
+
+    def test_sample_without_values(self):
+        user = User.objects.create(username='registrar')
+        MasterData.objects.create(user=user, upload_id=uuid.uuid4(), registration_number='R1')
+        self.assertTrue(all(path['plan'] for path in explain_access_paths()))
+
+    def test_postgresql_only_statistics(self):
+        if connection.vendor != 'postgresql':
+            with self.assertRaises(NotImplementedError):
+                table_scans()
+            with self.assertRaises(NotImplementedError):
+                index_usage()
+
+
+@mock.patch('api.utils.send_progress')
+@mock.patch('api.tasks.send_progress')
+class ValidationTaskTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.validation_id = str(uuid.uuid4())
+        log_step(None, 'validation_queued', 'queued', {'validation_id': self.validation_id}, self.user)
+
+    def completions(self, send_progress):
+        return [call for call in send_progress.call_args_list if call.kwargs.get('msg_type') == 'complete']
+
+    def test_complete_sent_after_task_returns(self, send_progress, _):
+        result = run_all_validations_task.run(self.validation_id, dataset=[entry('R1')])
+        self.assertEqual(len(result['validation_results']), 1)
+        self.assertEqual(self.completions(send_progress), [])
+
+        run_all_validations_task.apply(args=[self.validation_id], kwargs={'dataset': [entry('R1')]})
+        (complete,) = self.completions(send_progress)
+        self.assertEqual(complete.args[0], self.validation_id)
+        self.assertRegex(complete.args[1], r'^Validation completed: \d/1 records valid\.$')
+
+    def test_results_endpoint(self, *_):
+        url = reverse('validation-results', args=[self.validation_id])
+        with mock.patch('api.views.AsyncResult') as async_result:
+            async_result.return_value.state = 'STARTED'
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json(), {'validation_id': self.validation_id, 'status': 'STARTED'})
+
+            async_result.return_value.state = 'SUCCESS'
+            async_result.return_value.result = {
+                'validation_id': self.validation_id, 'validation_results': [], 'valid_entries': [],
+            }
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['valid_entries'], [])
+
+    def test_results_of_other_users_hidden(self, *_):
+        self.client.force_authenticate(User.objects.create(username='other'))
+        response = self.client.get(reverse('validation-results', args=[self.validation_id]))
+        self.assertEqual(response.status_code, 404)
+
+
+@mock.patch('api.tasks.send_progress')
+class ChunkedValidationTests(TestCase):
+    def test_merge_restores_dataset_order(self, _):
+        chunks = [
+            {'chunk_index': 1, 'validation_results': [{'id': 3, 'is_valid': False}]},
+            {'chunk_index': 0, 'validation_results': [{'id': 1, 'is_valid': True}, {'id': 2, 'is_valid': False}]},
+            {'chunk_index': 2, 'validation_results': [{'id': 4, 'is_valid': True}]},
+        ]
+        result = merge_validation_results_task.run(chunks, 'validation')
+        self.assertEqual([record['id'] for record in result['validation_results']], [1, 2, 3, 4])
+        self.assertEqual([record['id'] for record in result['valid_entries']], [1, 4])
+
+    @override_settings(VALIDATION_CHUNK_SIZE=2)
+    def test_large_dataset_fanned_out_as_chord(self, _):
+        dataset = [entry(f'R{number}') for number in range(5)]
+        with mock.patch('api.tasks.chord') as chord:
+            self.assertEqual(submit_validation('validation', dataset), 3)
+        (header,), _ = chord.call_args
+        self.assertEqual([len(signature.args[3]) for signature in header], [2, 2, 1])
+        (callback,), _ = chord.return_value.call_args
+        self.assertEqual(callback.options['task_id'], 'validation')
+
+    def test_small_dataset_runs_as_one_task(self, _):
+        with mock.patch('api.tasks.run_all_validations_task.apply_async') as apply_async:
+            self.assertEqual(submit_validation('validation', [entry('R1')]), 1)
+        self.assertEqual(apply_async.call_args.kwargs['task_id'], 'validation')
+
+
+class FuzzyMatchingTests(TestCase):
+    def queries(self, choices):
+        generator = random.Random(3)
+        queries = ['', 'zzzz', 'carcinoma', 'lip']
+        for description in generator.sample(choices, 60):
+            position = generator.randrange(len(description))
+            queries.append(description[:position] + description[position + 1:])
+            queries.append(description.upper())
+        return queries
+
+    def test_batch_matches_extract_one(self):
+        choices = list(get_code_table('morphology_codes').index.search_descriptions)
+        queries = self.queries(choices)
+        matches = batch_closest_matches(queries, choices, threshold=0.85, chunk_size=7)
+        for query in filter(None, queries):
+            match, score, _ = process.extractOne(query, choices)
+            expected = (match, score / 100.0) if score / 100.0 >= 0.85 else (None, 0)
+            self.assertEqual(matches[query], expected, query)
+
+    def test_batch_correct_returns_codes(self):
+        table = get_code_table('topography_codes')
+        description = table.index.search_descriptions[1]
+        corrections = batch_correct(
+            [description.upper(), f'  {description} ', 'zzzz', None, ''], table, 'topography', threshold=0.85,
+        )
+        self.assertEqual(set(corrections), {description.upper(), f'  {description} '})
+        code, score = corrections[description.upper()]
+        self.assertEqual(code, table.index.code_for(description))
+        self.assertEqual(score, 1.0)
+
+
+class CorrectionCacheTests(TestCase):
+    def test_local_hits_misses_and_eviction(self):
+        cache = CorrectionCache(max_entries=2)
+        cache.set_many('histology', {'a': ('8000/3', 0.9), 'b': (None, 0)}, 0.85, 'v1')
+        self.assertEqual(cache.get_many('histology', ['a', 'b', 'c'], 0.85, 'v1'), {'a': ('8000/3', 0.9), 'b': (None, 0)})
+        # Another threshold or vocabulary version is a different key
+        self.assertEqual(cache.get_many('histology', ['a'], 0.7, 'v1'), {})
+        self.assertEqual(cache.get_many('histology', ['a'], 0.85, 'v2'), {})
+
+        cache.get_many('histology', ['a'], 0.85, 'v1')
+        cache.set_many('histology', {'c': ('8500/3', 1.0)}, 0.85, 'v1')
+        self.assertEqual(set(cache.get_many('histology', ['a', 'b', 'c'], 0.85, 'v1')), {'a', 'c'})
+        stats = cache.stats()
+        self.assertEqual((stats['local_hits'], stats['misses'], stats['evictions'], stats['size']), (5, 4, 1, 2))
+
+    def test_redis_tier(self):
+        cache = CorrectionCache(redis_url='redis://cache')
+        cache._redis = mock.Mock()
+        cache._redis.mget.return_value = [json.dumps(['C50.9', 0.95]).encode(), None]
+        self.assertEqual(cache.get_many('topography', ['breast', 'lung'], 0.85, 'v1'), {'breast': ('C50.9', 0.95)})
+        self.assertEqual(cache.stats()['redis_hits'], 1)
+        # Redis hits are copied into the local tier
+        cache._redis.mget.reset_mock()
+        cache.get_many('topography', ['breast'], 0.85, 'v1')
+        cache._redis.mget.assert_not_called()
+
+    def test_redis_back_off(self):
+        cache = CorrectionCache(redis_url='redis://cache')
+        cache._redis = mock.Mock()
+        cache._redis.mget.side_effect = ConnectionError('refused')
+        with mock.patch('api.correction_cache.time.monotonic', return_value=1000):
+            self.assertEqual(cache.get_many('topography', ['breast'], 0.85, 'v1'), {})
+            self.assertIsNone(cache._get_redis())
+            cache.set_many('topography', {'breast': ('C50.9', 1.0)}, 0.85, 'v1')
+        self.assertEqual(cache.get_many('topography', ['breast'], 0.85, 'v1'), {'breast': ('C50.9', 1.0)})
+        with mock.patch('api.correction_cache.time.monotonic', return_value=1000 + REDIS_RETRY_SECONDS):
+            self.assertIsNotNone(cache._get_redis())
+
+
+class IndividualItemValidationTests(TestCase):
+    def reference(self, record):
+        # Per-record checks the bitmask engine replaced
+        errors = []
+        for label, field, table_name, attribute in FIELD_CHECKS:
+            value = record.get(field)
+            if value not in getattr(get_code_table(table_name), attribute):
+                errors.append(f"{label}: Invalid {label} code: {value}")
+        return errors
+
+    def test_matches_per_record_checks(self):
+        generator = random.Random(5)
+        choices = {
+            field: sorted(getattr(get_code_table(table_name), attribute))[:20] + ['bad', None]
+            for _, field, table_name, attribute in FIELD_CHECKS
+        }
+        dataset = []
+        for number in range(300):
+            record = {field: generator.choice(values) for field, values in choices.items()}
+            if number % 7 == 0:
+                del record['grade_code']
+            dataset.append(record)
+        expected = [self.reference(record) for record in dataset]
+
+        results = run_validations([dict(record) for record in dataset])
+        self.assertEqual([record['validation_results'] for record in results], expected)
+        self.assertEqual([record['is_valid'] for record in results], [not errors for errors in expected])
+
+    def test_error_bits(self):
+        df = records_to_frame([{'sex': 'x', 'histology': 'y'}], columns=[field for _, field, _, _ in FIELD_CHECKS])
+        self.assertEqual(field_error_mask(df)[0], sum(ERROR_BITS.values()))
+
+
+class SiteMorphologyIndexTests(TestCase):
+    groups = [
+        {'sites': ['C76.x'], 'morphologies': ['8000', '8010']},
+        {'sites': ['C76.0-C76.3', 'C80.9'], 'morphologies': ['8010', '8140']},
+    ]
+
+    def test_expand_sites(self):
+        self.assertEqual(expand_sites('C76.1'), {'C76.1'})
+        self.assertEqual(expand_sites('C76.x'), {'C76'} | {f'C76.{digit}' for digit in range(10)})
+        self.assertEqual(expand_sites('C76.0-C76.3'), {'C76.0', 'C76.1', 'C76.2', 'C76.3'})
+        with self.assertRaises(ValueError):
+            expand_sites('C76.8-C77.1')
+
+    def test_overlapping_groups_intersect(self):
+        index = SiteMorphologyIndex('test', self.groups, 'v1')
+        self.assertEqual(index.allowed['C76.2'], {'8010'})
+        self.assertEqual(index.allowed['C76.5'], {'8000', '8010'})
+        self.assertEqual(index.allowed['C80.9'], {'8010', '8140'})
+        self.assertTrue(index.is_valid('C50.9', '9999'))
+
+    def test_vectorized_rows_match_per_record(self):
+        index = SiteMorphologyIndex('test', self.groups, 'v1')
+        dataset = [
+            {'topography': 'C76.2', 'histology': '8010/3'},
+            {'topography': 'C76.2', 'histology': '8000/3'},
+            {'topography': 'C76', 'histology': '8000/3'},
+            {'topography': 'C76.9', 'histology': None},
+            {'topography': None, 'histology': '8000/3'},
+            {'topography': 'C50.9', 'histology': '8000/3'},
+            {'histology': '8140/3'},
+        ]
+        self.assertEqual(index.invalid_rows(dataset), [1, 3])
+        with mock.patch('api.rules.VECTORIZE_MIN_ROWS', 0):
+            self.assertEqual(index.invalid_rows(dataset), [1, 3])
+
+
+class DateParsingTests(TestCase):
+    def test_day_first_and_other_layouts(self):
+        parsed = parse_date_column(
+            ['01/02/2020', '2020-02-01', ' 01-02-2020 ', '01.02.2020', '2020/02/01', '2020-02-01T08:30:00',
+             date(2020, 2, 1), '02/13/2020', 'unknown', '', None],
+        )
+        self.assertEqual([str(value)[:10] for value in parsed[:7]], ['2020-02-01'] * 7)
+        self.assertTrue(np.isnat(parsed[7:]).all())
+
+    def test_day_first_after_iso_columns(self):
+        parse_date_column(['2020-02-01'] * 3, field='test_date')
+        self.assertEqual(str(parse_date_column(['01/02/2020'], field='test_date')[0])[:10], '2020-02-01')
+
+    def test_ages_match_completed_years(self):
+        births = [date(1950, 3, 1), date(1960, 2, 29), date(1960, 2, 29), date(1970, 12, 31), date(2000, 6, 15)]
+        incidences = [date(2020, 2, 29), date(2021, 2, 28), date(2021, 3, 1), date(2020, 12, 31), date(2000, 6, 14)]
+        ages = ages_at_incidence(parse_date_column(births), parse_date_column(incidences))
+        self.assertEqual(ages.tolist(), [completed_years(b, i) for b, i in zip(births, incidences)])
+        self.assertEqual(ages.tolist(), [69, 60, 61, 50, -1])
+
+    def test_parsed_dates(self):
+        dates = ParsedDates([
+            {'birth_date': '15/06/1950', 'date_of_incidence': '2020-06-14'},
+            {'birth_date': 'unknown', 'date_of_incidence': '2020-06-14'},
+            {'birth_date': '2020-06-14', 'date_of_incidence': None},
+            {'birth_date': '2020-06-14', 'date_of_incidence': '2020-06-14'},
+        ])
+        self.assertEqual(dates.age_list(), [69, None, None, 0])
+        self.assertEqual(dates.present.tolist(), [True, True, False, True])
+        self.assertEqual(dates.incidence_not_after_birth().tolist(), [False, False, False, True])
+
+
+class UploadSessionTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(UPLOAD_STAGING_DIR=self.directory)
+        self.settings.enable()
+        self.owner = User.objects.create(username='registrar')
+        self.other = User.objects.create(username='other')
+        self.upload_id = str(uuid.uuid4())
+        stage_records(self.upload_id, [entry('R1')])
+        log_step(self.upload_id, 'staged', 'Staged 1 row.', {'rows': 1}, self.owner)
+        self.client = APIClient()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_session_visible_to_owner_and_staff_only(self):
+        url = reverse('upload-session', args=[self.upload_id])
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rows'], 1)
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_pipeline_steps_refuse_other_users(self):
+        self.client.force_authenticate(self.other)
+        response = self.client.post(reverse('auto_correct_codes'), {'upload_id': self.upload_id}, format='json')
+        self.assertEqual(response.status_code, 404)
+        with mock.patch('api.views.submit_validation') as submit_validation:
+            response = self.client.post(reverse('run-all-validations'), {'upload_id': self.upload_id}, format='json')
+        self.assertEqual(response.status_code, 404)
+        submit_validation.assert_not_called()
+
+        store_valid_entries(self.upload_id, [entry('R1')])
+        response = self.client.post(reverse('consolidate_data'), {'upload_id': self.upload_id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MasterData.objects.exists())
+
+    def test_non_uuid_upload_id(self):
+        self.client.force_authenticate(self.owner)
+        for name in ('auto_correct_codes', 'run-all-validations', 'consolidate_data'):
+            response = self.client.post(reverse(name), {'upload_id': 'not-a-uuid'}, format='json')
+            self.assertEqual(response.status_code, 400, name)
+
+
+class MasterDataStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+        consolidate_entries(self.user, uuid.uuid4(), [entry(f'R{number}') for number in range(5)])
+
+    def get(self, **params):
+        response = self.client.get(reverse('masterdata'), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_serializers_across_chunks(self):
+        for rows in ([], [{'id': 1}], [{'id': number} for number in range(5)]):
+            self.assertEqual(json.loads(''.join(iter_json_array(rows, write_rows=2))), rows)
+            lines = ''.join(iter_ndjson(rows, write_rows=2)).splitlines()
+            self.assertEqual([json.loads(line) for line in lines], rows)
+
+    def test_json_and_ndjson(self):
+        response, body = self.get(fields='registration_number,sex')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        expected = [{'registration_number': f'R{number}', 'sex': '1'} for number in range(5)]
+        self.assertEqual(json.loads(body), expected)
+
+        response, body = self.get(format='ndjson', fields='registration_number,sex')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in body.splitlines()], expected)
+
+    def test_cursor_pages(self):
+        seen, after_id = [], None
+        while True:
+            params = {'fields': 'registration_number', 'limit': 2}
+            if after_id is not None:
+                params['after_id'] = after_id
+            response, body = self.get(**params)
+            seen.extend(row['registration_number'] for row in json.loads(body))
+            after_id = response.get('X-Next-After-Id')
+            if after_id is None:
+                break
+        self.assertEqual(seen, [f'R{number}' for number in range(5)])
+
+    def test_invalid_parameters(self):
+        for params in ({'format': 'xml'}, {'fields': 'password'}, {'limit': 0}, {'after_id': 'x'}):
+            self.assertEqual(self.client.get(reverse('masterdata'), params).status_code, 400, params)
+
+
+class MasterDataQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.upload_id = uuid.uuid4()
+        consolidate_entries(self.user, self.upload_id, [
+            entry(f'R{number}', sex='1' if number % 2 else '2', date_of_incidence=f'2020-06-{number + 10}')
+            for number in range(7)
+        ])
+        # Rows consolidated in one batch can share created_at; paging must still visit each once
+        first = MasterData.objects.order_by('id').first()
+        MasterData.objects.filter(id__lte=first.id + 3).update(created_at=first.created_at)
+
+    def pages(self, **params):
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(reverse('masterdata-query'), {**params, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['registration_number'] for row in response.json()['results']])
+            cursor = response.json()['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_keyset_pages_newest_first(self):
+        expected = list(
+            MasterData.objects.order_by('-created_at', '-id').values_list('registration_number', flat=True)
+        )
+        pages = self.pages(limit=3, fields='registration_number')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([number for page in pages for number in page], expected)
+
+    def test_filters(self):
+        pages = self.pages(
+            limit=2, fields='registration_number', sex='1', incidence_from='2020-06-12', incidence_to='2020-06-15',
+            upload_id=str(self.upload_id),
+        )
+        self.assertEqual(sorted(number for page in pages for number in page), ['R3', 'R5'])
+
+    def test_invalid_parameters(self):
+        for params in ({'cursor': 'junk'}, {'upload_id': 'x'}, {'user': 'me'}, {'incidence_from': '15/06/2020'},
+                       {'fields': 'secret'}, {'limit': 'ten'}):
+            response = self.client.get(reverse('masterdata-query'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class StratifyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+        generator = random.Random(7)
+        entries = []
+        for number in range(40):
+            entries.append(entry(
+                f'R{number}', sex=generator.choice(['1', '2']), topography=generator.choice(['C50.9', 'C18.0', 'C61.9']),
+                grade_code=generator.choice(['1', '9', None]), birth_date=f'19{generator.randrange(20, 99)}-03-01',
+                date_of_incidence=generator.choice(['2020-02-28', '2020-03-01', None]),
+            ))
+        consolidate_entries(self.user, uuid.uuid4(), entries)
+
+    def test_dimensions_match_group_by(self):
+        result = stratify()
+        for key, field in DIMENSIONS:
+            expected = MasterData.objects.values(field).annotate(count=Count(field)).order_by()
+            self.assertCountEqual(result[key], list(expected), key)
+
+    def test_age_groups_and_crosstabs(self):
+        ages = [
+            (row.sex, age_band(completed_years(row.birth_date, row.date_of_incidence)))
+            for row in MasterData.objects.all()
+        ]
+        result = stratify(crosstabs=parse_crosstabs(['sex,age_group']))
+        self.assertEqual(result['by_age_group'], age_group_rows(Counter(band for _, band in ages)))
+        self.assertCountEqual(
+            result['crosstabs']['sex_x_age_group'],
+            [{'sex': sex, 'age_group': band, 'count': rows} for (sex, band), rows in Counter(ages).items()],
+        )
+
+    def test_invalid_crosstab(self):
+        with self.assertRaises(ValueError):
+            parse_crosstabs(['sex'])
+        with self.assertRaises(ValueError):
+            parse_crosstabs(['sex,password'])
+
+
+class IncidenceCubeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='registrar')
+        self.uploads = [uuid.uuid4(), uuid.uuid4()]
+        generator = random.Random(11)
+        for upload_id in self.uploads:
+            consolidate_entries(self.user, upload_id, [
+                entry(
+                    f'{upload_id.hex[:6]}-{number}', sex=generator.choice(['1', '2']),
+                    topography=generator.choice(['C50.9', 'C18.0']), birth_date=f'19{generator.randrange(30, 90)}-07-01',
+                    date_of_incidence=generator.choice(['2019-06-30', '2020-07-01', '2021-01-15', None]),
+                )
+                for number in range(25)
+            ])
+
+    def expected_report(self, group_by, rows):
+        cells = Counter()
+        for row in rows:
+            values = {
+                'age_group': age_band(row.age_at_incidence),
+                'sex': row.sex,
+                'topography': row.topography,
+                'incidence_year': row.date_of_incidence.year if row.date_of_incidence else None,
+            }
+            cells[tuple(values[field] for field in group_by)] += 1
+        return [{**dict(zip(group_by, values)), 'count': count} for values, count in cells.items()]
+
+    def test_ages_persisted(self):
+        for row in MasterData.objects.all():
+            self.assertEqual(row.age_at_incidence, completed_years(row.birth_date, row.date_of_incidence))
+
+    def test_report_matches_master_data(self):
+        for group_by in (['incidence_year', 'sex'], ['age_group'], ['topography', 'age_group', 'sex']):
+            self.assertCountEqual(incidence_report(group_by), self.expected_report(group_by, MasterData.objects.all()))
+        rows = MasterData.objects.filter(upload_id=self.uploads[0], sex='2')
+        self.assertCountEqual(
+            incidence_report(['incidence_year'], {'upload_id__in': [self.uploads[0]], 'sex__in': ['2']}),
+            self.expected_report(['incidence_year'], rows),
+        )
+
+    def test_rebuild_of_one_upload(self):
+        columns = ('upload_id', 'age_group', 'sex', 'topography', 'incidence_year', 'count')
+        maintained = list(IncidenceCube.objects.values(*columns))
+        IncidenceCube.objects.filter(upload_id=self.uploads[1]).update(count=0)
+        rebuild_incidence_cube(self.uploads[1])
+        self.assertCountEqual(list(IncidenceCube.objects.values(*columns)), maintained)
+
+    def test_report_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('incidence-report'), {'group_by': 'sex', 'upload_id': str(self.uploads[0])})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(row['count'] for row in response.json()['results']), 25)
+        self.assertEqual(client.get(reverse('incidence-report'), {'group_by': 'histology'}).status_code, 400)
+        self.assertEqual(client.get(reverse('incidence-report'), {'year_from': 'last'}).status_code, 400)
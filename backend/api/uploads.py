@@ -0,0 +1,220 @@
+# api/uploads.py
+import uuid
+import logging
+from django.db import connections, transaction
+from .models import MasterData, MasterDataRevision, UploadLog, ValidEntries
+from .consolidation import consolidate_entries, revert_upload_updates
+from .staging import AUTO_CORRECT_COLUMNS, delete_staged, read_staged_records, replace_staged_columns
+from .strata import forget_upload
+
+logger = logging.getLogger(__name__)
+
+# Staged columns rewritten after auto-correction.
+CORRECTED_FIELDS = ('topography', 'histology', 'sex', 'behavior', 'grade_code')
+
+# Rows written to / read from ValidEntries per batch.
+VALID_ENTRY_BATCH_SIZE = 5000
+
+
+class UploadNotOwned(PermissionError):
+    pass
+
+
+def log_step(upload_id, step, details, summary=None, user=None):
+    """
+    Records a pipeline step of an upload session in UploadLog.
+    """
+    return UploadLog.objects.create(
+        upload_id=upload_id, user=user, step=step, details=details, upload=summary or {},
+    )
+
+
+def upload_steps(upload_id):
+    """
+    Returns the logged steps of an upload session, oldest first.
+    """
+    return list(
+        UploadLog.objects.filter(upload_id=upload_id)
+        .order_by('created_at', 'id')
+        .values('step', 'details', 'upload', 'created_at')
+    )
+
+
+def parse_upload_id(upload_id):
+    """
+    Returns an upload id from a request as a UUID string.
+
+    Raises:
+        ValueError: If upload_id is not a UUID.
+    """
+    return str(uuid.UUID(str(upload_id)))
+
+
+def user_can_access(user, upload_id):
+    """
+    An upload session belongs to the user who staged it; admins can access any session.
+    Ids that are not UUIDs match no session.
+    """
+    try:
+        upload_id = parse_upload_id(upload_id)
+    except ValueError:
+        return False
+    logs = UploadLog.objects.filter(upload_id=upload_id)
+    if user.is_staff:
+        return logs.exists()
+    return logs.filter(user=user).exists()
+
+
+def user_owns_validation(user, validation_id):
+    """
+    A validation's results belong to the user who submitted it; admins can read any.
+    """
+    logs = UploadLog.objects.filter(step='validation_queued', upload__validation_id=str(validation_id))
+    if user.is_staff:
+        return logs.exists()
+    return logs.filter(user=user).exists()
+
+
+def auto_correct_upload(upload_id, user=None):
+    """
+    Auto-corrects a staged upload in place.
+
+    Only the code columns are read from the staging file, and the corrected
+    columns are written back to it, so later steps see the corrected values.
+
+    Returns:
+        dict: The corrections made, by field.
+    """
+    from .utils import auto_correct_codes
+
+    dataset = read_staged_records(upload_id, AUTO_CORRECT_COLUMNS)
+    corrected_data, corrections = auto_correct_codes(dataset)
+    if corrected_data is None:
+        raise RuntimeError(corrections)
+
+    changed = {field for field in CORRECTED_FIELDS if corrections.get('grade' if field == 'grade_code' else field)}
+    if changed:
+        replace_staged_columns(upload_id, {field: [record.get(field) for record in corrected_data] for field in changed})
+
+    counts = {field: len(items) for field, items in corrections.items()}
+    log_step(upload_id, 'auto_corrected', f"Auto-corrected {sum(counts.values())} values.", counts, user)
+    return corrections
+
+
+def store_valid_entries(upload_id, entries):
+    """
+    Replaces the stored valid entries of an upload with the given ones.
+    """
+    with transaction.atomic():
+        ValidEntries.objects.filter(upload_id=upload_id).delete()
+        ValidEntries.objects.bulk_create(
+            (ValidEntries(upload_id=upload_id, data=entry) for entry in entries),
+            batch_size=VALID_ENTRY_BATCH_SIZE,
+        )
+
+
+def record_validation(upload_id, results):
+    """
+    Stores the valid entries of a validated upload and logs the step.
+
+    Returns:
+        dict: Record counts and the invalid records, which is all the client needs back.
+    """
+    valid_entries = [entry for entry in results if entry.get("is_valid")]
+    invalid_entries = [entry for entry in results if not entry.get("is_valid")]
+    store_valid_entries(upload_id, valid_entries)
+
+    summary = {
+        "total_records": len(results),
+        "valid_records": len(valid_entries),
+        "invalid_records": len(invalid_entries),
+    }
+    log_step(upload_id, 'validated', f"{len(valid_entries)}/{len(results)} records valid.", summary)
+    return {**summary, "validation_results": invalid_entries}
+
+
+def consolidate_upload(user, upload_id, on_conflict='update'):
+    """
+    Saves the stored valid entries of an upload into MasterData, streaming them
+    through the consolidation engine batch by batch. The staged file is no
+    longer needed afterwards and is removed.
+
+    Returns:
+        ConsolidationReport: Inserted, updated and skipped counts and the conflicting keys.
+    """
+    entries = (
+        ValidEntries.objects.filter(upload_id=upload_id)
+        .order_by('id')
+        .values_list('data', flat=True)
+        .iterator(chunk_size=VALID_ENTRY_BATCH_SIZE)
+    )
+    report = consolidate_entries(user, upload_id, entries, on_conflict=on_conflict)
+
+    summary = report.to_dict()
+    del summary['conflicts']
+    log_step(
+        upload_id, 'consolidated',
+        f"{report.inserted} inserted, {report.updated} updated, {report.skipped} skipped.", summary, user,
+    )
+    delete_staged(upload_id)
+    return report
+
+
+def _delete_upload_rows(upload_id):
+    # One DELETE on the upload_id index, without loading the rows or sending a
+    # post_delete signal per row
+    connection = connections[MasterData.objects.db]
+    field = MasterData._meta.get_field('upload_id')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {connection.ops.quote_name(MasterData._meta.db_table)} "
+            f"WHERE {connection.ops.quote_name(field.column)} = %s",
+            [field.get_db_prep_value(upload_id, connection)],
+        )
+        return cursor.rowcount
+
+
+def rollback_upload(upload_id, user=None):
+    """
+    Undoes everything an upload consolidated into MasterData.
+
+    Rows the upload inserted go in a single DELETE; rows it overwrote get back
+    the values kept in its MasterDataRevision rows. The summary tables are
+    adjusted in the same transaction. ValidEntries are kept, so the upload can
+    be consolidated again; the staged file, if still there, is removed.
+
+    Args:
+        upload_id (str or UUID): The upload to roll back.
+        user: The user asking. Unless staff, they must have written every row the
+            rollback touches.
+
+    Returns:
+        dict: Number of MasterData rows deleted and restored.
+
+    Raises:
+        UploadNotOwned: If a non-staff user asks to roll back rows written by someone else.
+    """
+    upload_id = uuid.UUID(parse_upload_id(upload_id))
+    with transaction.atomic():
+        if user is not None and not user.is_staff:
+            foreign = (
+                MasterData.objects.filter(upload_id=upload_id).exclude(user=user).exists()
+                or MasterDataRevision.objects.filter(upload_id=upload_id).exclude(user=user).exists()
+            )
+            if foreign:
+                raise UploadNotOwned(f"Upload {upload_id} contains rows consolidated by another user.")
+
+        restored = revert_upload_updates(upload_id)
+        forget_upload(upload_id)
+        # Later uploads' revisions of the rows being deleted go with them
+        MasterDataRevision.objects.filter(row__upload_id=upload_id).delete()
+        deleted = _delete_upload_rows(upload_id)
+
+    delete_staged(upload_id)
+
+    summary = {"deleted": deleted, "restored": restored}
+    log_step(
+        upload_id, 'rolled_back', f"Removed {deleted} rows from MasterData and restored {restored}.", summary, user,
+    )
+    logger.info(f"Rolled back upload {upload_id}: {deleted} MasterData rows deleted, {restored} restored.")
+    return summary
@@ -0,0 +1,68 @@
+# api/validation_engine.py
+import logging
+import numpy as np
+import pandas as pd
+from .code_tables import get_code_table
+
+logger = logging.getLogger(__name__)
+
+# Individual item checks: (error label, record field, code table, table attribute
+# holding the allowed codes). The position in this tuple is the error bit.
+FIELD_CHECKS = (
+    ('sex', 'sex', 'sex', 'values'),
+    ('behavior', 'behavior', 'behavior_codes', 'values'),
+    ('grade', 'grade_code', 'grade_codes', 'values'),
+    ('topography', 'topography', 'topography_codes', 'keys'),
+    ('histology', 'histology', 'morphology_codes', 'values'),
+)
+
+ERROR_BITS = {label: 1 << bit for bit, (label, _, _, _) in enumerate(FIELD_CHECKS)}
+
+
+def records_to_frame(dataset, columns=None):
+    """
+    Builds a DataFrame from a list of record dicts. Columns that are missing
+    from every record are added as all-None so checks can rely on them.
+    """
+    df = pd.DataFrame.from_records(dataset) if dataset else pd.DataFrame()
+    for column in columns or ():
+        if column not in df.columns:
+            df[column] = None
+    return df
+
+
+def field_error_mask(df):
+    """
+    Checks every individual item field of a DataFrame against its code table.
+
+    Returns:
+        np.ndarray: One uint8 per row; bit ERROR_BITS[label] is set when that
+        field holds a value outside the code table (missing values included).
+    """
+    mask = np.zeros(len(df), dtype=np.uint8)
+    for bit, (label, field, table_name, attribute) in enumerate(FIELD_CHECKS):
+        allowed = getattr(get_code_table(table_name), attribute)
+        valid = df[field].isin(allowed).to_numpy()
+        mask |= (~valid).astype(np.uint8) << bit
+    return mask
+
+
+def field_error_messages(df, mask):
+    """
+    Builds the human-readable messages for failing rows only.
+
+    Returns:
+        dict: Maps row position to its list of messages.
+    """
+    messages = {}
+    failing = np.flatnonzero(mask)
+    for bit, (label, field, _, _) in enumerate(FIELD_CHECKS):
+        rows = failing[(mask[failing] >> bit) & 1 == 1]
+        if not len(rows):
+            continue
+        values = df[field].to_numpy()[rows]
+        for row, value in zip(rows.tolist(), values):
+            if value is not None and pd.isna(value):
+                value = None
+            messages.setdefault(row, []).append(f"{label}: Invalid {label} code: {value}")
+    return messages
@@ -1,19 +1,33 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 from rest_framework import status
+import os
 import logging
 import json
-from rest_framework.parsers import JSONParser
+from rest_framework.parsers import JSONParser, MultiPartParser
 from django.db.models import Count
 from django.contrib.auth import authenticate
 from django.conf import settings
-from .models import MasterData, StratifiedData, Registry
+from .models import MasterData, MasterDataRevision, StratifiedData, Registry, ValidEntries
 from .utils import auto_correct_codes # Import only the needed functions
-from .tasks import run_all_validations_task 
+from .correction_cache import correction_cache
+from .tasks import ingest_file_task, submit_validation
+from .consolidation import ON_CONFLICT_CHOICES, consolidate_entries
+from .staging import STAGEABLE_FORMATS, StagedUploadNotFound, stage_file, stage_records, staged_row_count
+from .queries import DATE_FILTERS, EXACT_FILTERS, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, QueryError, filter_master_data, keyset_page
+from .stratification import parse_crosstabs, stratify
+from .strata import CUBE_FIELDS, incidence_report, stratum_summary
+from .streaming import iter_json_array, iter_ndjson
+from .uploads import (
+    UploadNotOwned, auto_correct_upload, consolidate_upload, log_step, parse_upload_id, rollback_upload,
+    upload_steps, user_can_access, user_owns_validation,
+)
+from celery.result import AsyncResult
+from django.urls import reverse
 import uuid
 from django.contrib.auth import logout
 from rest_framework.permissions import IsAdminUser
@@ -38,6 +52,9 @@ logging.basicConfig(level=logging.DEBUG)
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+# Rows fetched from the database per round trip when streaming MasterData
+MASTER_DATA_STREAM_CHUNK_SIZE = 2000
+
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 # This view handles the login and returns access and refresh tokens.
@@ -102,6 +119,18 @@ class AutoCorrectCodesView(APIView):
 
         try:
             dataset = request.data.get('dataset')
+            upload_id = request.data.get('upload_id')
+            if not dataset and upload_id:
+                # Staged upload: correct it server-side and send back only the corrections
+                try:
+                    upload_id = parse_upload_id(upload_id)
+                except ValueError:
+                    return Response({"error": "Invalid upload_id."}, status=status.HTTP_400_BAD_REQUEST)
+                if not user_can_access(request.user, upload_id):
+                    return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+                corrections = auto_correct_upload(upload_id, request.user)
+                logger.info("Auto-correction completed for upload %s", upload_id)
+                return Response({"upload_id": upload_id, "corrections": corrections}, status=status.HTTP_200_OK)
             if not dataset:
                 logger.warning("Auto-correction request failed: No dataset provided by user %s", request.user.username)
                 return Response({"error": "Dataset is required."}, status=status.HTTP_400_BAD_REQUEST)
@@ -129,42 +158,324 @@ class AutoCorrectCodesView(APIView):
                 "corrections": corrections
             }, status=status.HTTP_200_OK)
 
+        except StagedUploadNotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             logger.error("An unexpected error occurred during auto-correction: %s", str(e))
             return Response({"error": f"An error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def correction_cache_stats(request):
+    """
+    Returns hit/miss counters of the auto-correction cache for this process.
+    """
+    return Response(correction_cache.stats(), status=status.HTTP_200_OK)
+
+def save_uploaded_file(uploaded, upload_id):
+    """
+    Writes a multipart upload to UPLOAD_STAGING_DIR in chunks.
+
+    Returns:
+        tuple: (file path, file format).
+
+    Raises:
+        ValueError: If the file format cannot be staged or ingested.
+    """
+    file_format = os.path.splitext(uploaded.name)[1].lstrip('.').lower()
+    if file_format not in STAGEABLE_FORMATS:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+    os.makedirs(settings.UPLOAD_STAGING_DIR, exist_ok=True)
+    file_path = os.path.join(settings.UPLOAD_STAGING_DIR, f"{upload_id}.{file_format}")
+    with open(file_path, 'wb') as destination:
+        for chunk in uploaded.chunks():
+            destination.write(chunk)
+    return file_path, file_format
+
+
+class StageUploadAPIView(APIView):
+    """
+    API endpoint that converts an upload once into the columnar staging format.
+
+    Accepts a multipart 'file' (csv, xlsx, xls or json) or a JSON 'dataset'. The
+    returned upload_id is then passed to auto-correction and validation in place
+    of the dataset itself.
+    """
+    parser_classes = [MultiPartParser, JSONParser]
+
+    def post(self, request, format=None):
+        upload_id = str(uuid.uuid4())
+        uploaded = request.FILES.get('file')
+        dataset = request.data.get('dataset')
+
+        try:
+            if uploaded is not None:
+                file_path, file_format = save_uploaded_file(uploaded, upload_id)
+                try:
+                    summary = stage_file(upload_id, file_path, file_format)
+                finally:
+                    os.remove(file_path)
+            elif dataset:
+                summary = stage_records(upload_id, dataset)
+            else:
+                return Response({"error": "A file or dataset is required."}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error("Staging failed for upload %s: %s", upload_id, str(e))
+            return Response({"error": f"Could not read upload: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        log_step(upload_id, 'staged', f"Staged {summary['rows']} rows.", summary, request.user)
+        logger.info("User %s staged upload %s with %d rows", request.user.username, upload_id, summary['rows'])
+        return Response(summary, status=status.HTTP_201_CREATED)
+
+
+class IngestUploadAPIView(APIView):
+    """
+    API endpoint that validates and consolidates an uploaded file in one pass.
+
+    The multipart 'file' (csv, xlsx, xls or json) is streamed batch by batch
+    through validation straight into MasterData by a Celery task, so files of any
+    size are handled in bounded memory. Progress and results use the same
+    validation_id URLs as RunAllValidationsAPIView.
+    """
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, format=None):
+        uploaded = request.FILES.get('file')
+        if uploaded is None:
+            return Response({"error": "A file is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload_id = str(uuid.uuid4())
+        validation_id = str(uuid.uuid4())
+        try:
+            file_path, file_format = save_uploaded_file(uploaded, upload_id)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            ingest_file_task.apply_async(
+                args=[validation_id, file_path, file_format, request.user.pk, upload_id], task_id=validation_id,
+            )
+        except Exception as e:
+            os.remove(file_path)
+            logger.error("Could not queue ingestion %s: %s", validation_id, str(e))
+            return Response({"error": "Validation service is unavailable."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        log_step(
+            upload_id, 'validation_queued', f"Ingestion of {uploaded.name} queued.",
+            {"validation_id": validation_id, "file_format": file_format}, request.user,
+        )
+        logger.info("User %s queued ingestion %s of upload %s", request.user.username, validation_id, upload_id)
+        return Response({
+            "validation_id": validation_id,
+            "upload_id": upload_id,
+            "status": "PENDING",
+            "progress_url": f"ws/validations/{validation_id}/",
+            "results_url": reverse('validation-results', args=[validation_id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class UploadSessionAPIView(APIView):
+    """
+    API endpoint returning the state of an upload session: its size and the
+    pipeline steps run on it so far. DELETE rolls back its consolidation.
+    """
+
+    def get(self, request, upload_id, format=None):
+        if not user_can_access(request.user, upload_id):
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            rows = staged_row_count(upload_id)
+        except StagedUploadNotFound:
+            rows = None
+        return Response({
+            "upload_id": str(upload_id),
+            "rows": rows,
+            "valid_entries": ValidEntries.objects.filter(upload_id=upload_id).count(),
+            "steps": upload_steps(upload_id),
+        }, status=status.HTTP_200_OK)
+
+    def delete(self, request, upload_id, format=None):
+        # Uploads consolidated straight from valid_entries have no session log, only
+        # the rows they inserted or the revisions of rows they overwrote
+        owned = MasterData.objects.filter(upload_id=upload_id)
+        revised = MasterDataRevision.objects.filter(upload_id=upload_id)
+        if not request.user.is_staff:
+            owned = owned.filter(user=request.user)
+            revised = revised.filter(user=request.user)
+        if not user_can_access(request.user, upload_id) and not owned.exists() and not revised.exists():
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            # Refused for non-staff users when another user consolidated rows into the upload
+            summary = rollback_upload(upload_id, request.user)
+        except UploadNotOwned as e:
+            return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
+        except Exception as e:
+            logger.error(f"Failed to roll back upload {upload_id}: {str(e)}")
+            return Response({"error": f"Error rolling back upload: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({"upload_id": str(upload_id), **summary}, status=status.HTTP_200_OK)
+
+
 class RunAllValidationsAPIView(APIView):
     """
-    API endpoint to initiate all validations and return results directly.
+    API endpoint to submit a dataset for validation.
+
+    Validation runs as a Celery task; this returns the validation_id straight
+    away. Progress is streamed on ws/validations/<validation_id>/ and the results
+    are fetched from ValidationResultsAPIView once the task has finished.
     """
 
     def post(self, request, format=None):
         logger.info("Validation request initiated by user: %s", request.user.username)
 
-        # Extract dataset from the request body
+        # Extract dataset (or the id of a staged upload) from the request body
         dataset = request.data.get('dataset', [])
-        if not dataset:
+        upload_id = request.data.get('upload_id')
+        if not dataset and not upload_id:
             logger.warning("Validation request failed: No dataset provided by user %s", request.user.username)
             return Response({"error": "No dataset provided."}, status=status.HTTP_400_BAD_REQUEST)
+        if not dataset:
+            try:
+                upload_id = parse_upload_id(upload_id)
+            except ValueError:
+                return Response({"error": "Invalid upload_id."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Generate a unique ID for tracking
+        # Generate a unique ID for tracking; it doubles as the Celery task id
         validation_id = str(uuid.uuid4())
         logger.debug("Generated validation ID: %s", validation_id)
 
-        # Run validations synchronously and get results
         try:
-            result = run_all_validations_task(validation_id, dataset)
-            logger.info("Validation completed for ID: %s", validation_id)
+            if dataset:
+                chunks = submit_validation(validation_id, dataset)
+            elif user_can_access(request.user, upload_id):
+                chunks = submit_validation(validation_id, upload_id=upload_id)
+            else:
+                return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+            # Records who may fetch the results
+            log_step(
+                upload_id if not dataset else None, 'validation_queued', f"Validation {validation_id} queued.",
+                {"validation_id": validation_id}, request.user,
+            )
+            logger.info("Validation queued for ID %s in %d chunk(s)", validation_id, chunks)
+        except StagedUploadNotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
-            logger.error("Validation failed for ID %s with error: %s", validation_id, str(e))
-            return Response({"error": "Validation process encountered an error."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.error("Could not queue validation %s: %s", validation_id, str(e))
+            return Response({"error": "Validation service is unavailable."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-        # Format the response to include validation results and valid entries
         return Response({
             "validation_id": validation_id,
-            "validation_results": result['validation_results'],
-            "valid_entries": result['valid_entries']
-        }, status=status.HTTP_200_OK)
+            "status": "PENDING",
+            "progress_url": f"ws/validations/{validation_id}/",
+            "results_url": reverse('validation-results', args=[validation_id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class MasterDataQueryAPIView(APIView):
+    """
+    API endpoint for paginated, filtered reads of MasterData, newest rows first.
+
+    Filters: upload_id, user, sex, topography, histology (exact, repeatable) and
+    incidence_from / incidence_to (YYYY-MM-DD, inclusive). Pages are requested
+    with limit (max 1000) and the cursor returned as next_cursor; fields selects
+    the columns returned.
+    """
+
+    def get(self, request, format=None):
+        params = request.query_params
+        available = [field.attname for field in MasterData._meta.concrete_fields]
+        fields = [name for name in params.get('fields', '').split(',') if name]
+        unknown = sorted(set(fields) - set(available))
+        if unknown:
+            return Response({"error": f"Unknown fields: {', '.join(unknown)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        try:
+            queryset = filter_master_data(params)
+            rows, next_cursor = keyset_page(queryset, params.get('cursor'), limit, fields)
+        except QueryError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"results": rows, "next_cursor": next_cursor, "limit": limit}, status=status.HTTP_200_OK)
+
+
+class IncidenceReportAPIView(APIView):
+    """
+    API endpoint for registry incidence reports, summed from the IncidenceCube
+    summary table rather than MasterData.
+
+    group_by: comma-separated subset of age_group, sex, topography, incidence_year
+    (default incidence_year,sex). Filters: year_from, year_to, and repeatable
+    sex, topography, age_group and upload_id.
+    """
+
+    def get(self, request, format=None):
+        params = request.query_params
+        group_by = [name for name in params.get('group_by', 'incidence_year,sex').split(',') if name]
+        unknown = sorted(set(group_by) - set(CUBE_FIELDS))
+        if unknown:
+            return Response({"error": f"Unknown group_by fields: {', '.join(unknown)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = {}
+        try:
+            if params.get('year_from'):
+                filters['incidence_year__gte'] = int(params['year_from'])
+            if params.get('year_to'):
+                filters['incidence_year__lte'] = int(params['year_to'])
+            for field in ('sex', 'topography', 'age_group', 'upload_id'):
+                values = [value for value in params.getlist(field) if value]
+                if field == 'upload_id':
+                    values = [str(uuid.UUID(value)) for value in values]
+                if values:
+                    filters[f"{field}__in"] = values
+        except ValueError as e:
+            return Response({"error": f"Invalid filter: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = incidence_report(group_by, filters)
+        return Response({"group_by": group_by, "results": rows}, status=status.HTTP_200_OK)
+
+
+class ValidationResultsAPIView(APIView):
+    """
+    API endpoint returning the results of a validation submitted to RunAllValidationsAPIView.
+
+    Responds 202 with the task state while the validation is still queued or
+    running, and 200 with validation_results and valid_entries once it is done.
+    """
+
+    def get(self, request, validation_id, format=None):
+        # Results contain patient records, so only the submitter (or an admin) may read them
+        if not user_owns_validation(request.user, validation_id):
+            return Response({"error": "Validation not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        result = AsyncResult(str(validation_id))
+
+        if result.state == 'SUCCESS':
+            # Staged uploads return counts and invalid records only; their valid
+            # entries stay server-side for consolidation
+            payload = {key: value for key, value in result.result.items() if key != 'validation_id'}
+            return Response({
+                "validation_id": str(validation_id),
+                "status": result.state,
+                **payload,
+            }, status=status.HTTP_200_OK)
+
+        if result.state == 'FAILURE':
+            logger.error("Validation failed for ID %s with error: %s", validation_id, result.result)
+            return Response({
+                "validation_id": str(validation_id),
+                "status": result.state,
+                "error": "Validation process encountered an error."
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({"validation_id": str(validation_id), "status": result.state}, status=status.HTTP_202_ACCEPTED)
 
 
 class LoginView(APIView):
@@ -241,6 +552,25 @@ def consolidate_data(request):
     # Extract data from request
     upload_id = request.data.get('upload_id')
     valid_entries = request.data.get('valid_entries')
+    # Entries whose (registration_number, date_of_incidence) already exists: 'update' or 'skip'
+    on_conflict = request.data.get('on_conflict', 'update')
+    if on_conflict not in ON_CONFLICT_CHOICES:
+        return Response({'error': f"on_conflict must be one of: {', '.join(ON_CONFLICT_CHOICES)}"}, status=400)
+    if upload_id:
+        try:
+            upload_id = parse_upload_id(upload_id)
+        except ValueError:
+            return Response({'error': 'Invalid upload_id'}, status=400)
+
+    if upload_id and not valid_entries and user_can_access(user, upload_id):
+        # Upload session: consolidate the valid entries stored by its validation
+        try:
+            report = consolidate_upload(user, upload_id, on_conflict=on_conflict)
+        except Exception as e:
+            logger.error(f"Unexpected error while consolidating upload {upload_id}: {str(e)}")
+            return Response({'error': f'Error saving data: {str(e)}'}, status=500)
+        logger.info(f"Data consolidation process completed successfully for upload_id {upload_id}.")
+        return Response({"message": "Data consolidated and saved successfully.", **report.to_dict()}, status=201)
 
     if not upload_id or not valid_entries:
         logger.warning("Missing upload_id or valid_entries in the request.")
@@ -257,29 +587,8 @@ def consolidate_data(request):
 
     # Save each valid entry into MasterData
     try:
-        master_data_instances = []
         logger.info(f"Preparing to save {len(valid_entries)} valid entries to MasterData for upload_id {upload_id}.")
-
-        for entry in valid_entries:
-            master_data_instances.append(
-                MasterData(
-                    user=user,
-                    upload_id=uuid.UUID(upload_id),
-                    registration_number=entry.get('registration_number'),
-                    sex=entry.get('sex'),
-                    birth_date=entry.get('birth_date'),
-                    date_of_incidence=entry.get('date_of_incidence'),
-                    topography=entry.get('topography'),
-                    histology=entry.get('histology'),
-                    behavior=entry.get('behavior'),
-                    grade_code=entry.get('grade_code'),
-                    basis_of_diagnosis=entry.get('basis_of_diagnosis'),
-                )
-            )
-
-        with transaction.atomic():
-            MasterData.objects.bulk_create(master_data_instances, ignore_conflicts=True)
-            logger.info(f"Successfully saved {len(master_data_instances)} entries to MasterData for upload_id {upload_id}.")
+        report = consolidate_entries(user, upload_id, valid_entries, on_conflict=on_conflict)
 
     except IntegrityError as e:
         logger.error(f"Integrity error while saving to MasterData: {str(e)}")
@@ -290,28 +599,60 @@ def consolidate_data(request):
 
 
     logger.info(f"Data consolidation process completed successfully for upload_id {upload_id}.")
-    return Response({"message": "Data consolidated and saved successfully."}, status=201)
+    return Response({"message": "Data consolidated and saved successfully.", **report.to_dict()}, status=201)
 
 
 @csrf_exempt
 def master_data_view(request):
     """
     Endpoint to retrieve raw data from MasterData without any filters or formatting.
+
+    The rows are streamed straight from a database iterator, so memory use does
+    not grow with the table. Optional query parameters:
+        format: 'json' (default, one JSON array) or 'ndjson' (one object per line).
+        fields: Comma-separated columns to return (default: all).
+        after_id, limit: Cursor pagination in id order. When a full page is
+            returned, the X-Next-After-Id header holds the cursor of the next one.
     """
     try:
-        # Retrieve all records from MasterData
-        queryset = MasterData.objects.all()
+        output = request.GET.get('format', 'json')
+        if output not in ('json', 'ndjson'):
+            return JsonResponse({'error': "format must be 'json' or 'ndjson'."}, status=400)
 
-        # Convert queryset to a list of dictionaries for JSON serialization
-        data = list(queryset.values())
+        available = [field.attname for field in MasterData._meta.concrete_fields]
+        fields = [name for name in request.GET.get('fields', '').split(',') if name]
+        unknown = sorted(set(fields) - set(available))
+        if unknown:
+            return JsonResponse({'error': f"Unknown fields: {', '.join(unknown)}"}, status=400)
 
-        # Log the total count of records and a sample record for debugging
-        logger.info(f"Total records retrieved from MasterData: {len(data)}")
-        if len(data) > 0:
-            logger.debug(f"Sample record from MasterData: {data[0]}")
-
-        # Return raw data as JSON
-        return JsonResponse(data, safe=False)
+        try:
+            after_id = int(request.GET['after_id']) if request.GET.get('after_id') else None
+            limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        except ValueError:
+            return JsonResponse({'error': 'after_id and limit must be integers.'}, status=400)
+        if limit is not None and limit <= 0:
+            return JsonResponse({'error': 'limit must be positive.'}, status=400)
+
+        queryset = MasterData.objects.order_by('id')
+        if after_id is not None:
+            queryset = queryset.filter(id__gt=after_id)
+
+        next_after_id = None
+        if limit is not None:
+            last_ids = list(queryset.values_list('id', flat=True)[limit - 1:limit])
+            next_after_id = last_ids[0] if last_ids else None
+            queryset = queryset[:limit]
+
+        rows = queryset.values(*fields).iterator(chunk_size=MASTER_DATA_STREAM_CHUNK_SIZE)
+        logger.info(f"Streaming MasterData as {output} (after_id={after_id}, limit={limit}, fields={fields or 'all'})")
+
+        if output == 'ndjson':
+            response = StreamingHttpResponse(iter_ndjson(rows), content_type='application/x-ndjson')
+        else:
+            response = StreamingHttpResponse(iter_json_array(rows), content_type='application/json')
+        if next_after_id is not None:
+            response['X-Next-After-Id'] = str(next_after_id)
+        return response
 
     except Exception as e:
         logger.error(f"Failed to retrieve records from MasterData: {e}")
@@ -496,24 +837,29 @@ def database_schema_view(request):
 
 @csrf_exempt
 def stratify_data_view(request):
+    """
+    Returns the MasterData counts by sex, grade, topography, histology, behavior,
+    basis of diagnosis and age group. Unfiltered requests read the incrementally
+    maintained StratumCount table; filtered ones and cross-tabs run one
+    aggregation query.
+
+    Accepts the MasterData query filters (upload_id, user, sex, topography,
+    histology, incidence_from, incidence_to) and repeatable crosstab parameters,
+    e.g. ?crosstab=sex,topography.
+    """
     logger.info("Starting data stratification.")
-    stratified_data = {}
     try:
-        # Stratify data by different attributes
-        stratified_data["by_sex"] = MasterData.objects.values('sex').annotate(count=Count('sex'))
-        stratified_data["by_grade"] = MasterData.objects.values('grade_code').annotate(count=Count('grade_code'))
-        stratified_data["by_topography"] = MasterData.objects.values('topography').annotate(count=Count('topography'))
-        stratified_data["by_histology"] = MasterData.objects.values('histology').annotate(count=Count('histology'))
-        stratified_data["by_behavior"] = MasterData.objects.values('behavior').annotate(count=Count('behavior'))
-        stratified_data["by_basis_of_diagnosis"] = MasterData.objects.values('basis_of_diagnosis').annotate(count=Count('basis_of_diagnosis'))
-        
-        # Additional logging for each stratification type
-        logger.info("Data stratified by 'sex', 'grade_code', 'topography', 'histology', 'behavior', and 'basis_of_diagnosis'.")
-        
-        # Convert queryset data to a list for JSON serialization
-        for key, queryset in stratified_data.items():
-            stratified_data[key] = list(queryset)
-        
+        crosstabs = parse_crosstabs(request.GET.getlist('crosstab'))
+        queryset = filter_master_data(request.GET)
+    except (ValueError, QueryError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        if crosstabs or any(param in request.GET for param in (*EXACT_FILTERS, *DATE_FILTERS)):
+            stratified_data = stratify(queryset, crosstabs)
+        else:
+            # Whole-table counts are maintained incrementally; no scan needed
+            stratified_data = stratum_summary()
         logger.info("Data stratification completed successfully.")
     except Exception as e:
         logger.error(f"Error during data stratification: {e}")
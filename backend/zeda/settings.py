@@ -119,6 +119,9 @@ ASGI_APPLICATION = 'zeda.asgi.application'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Columnar (Arrow IPC) copies of uploaded datasets, one file per upload id (api.staging)
+UPLOAD_STAGING_DIR = os.path.join(MEDIA_ROOT, 'staging')
+
 # Celery settings
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
@@ -127,6 +130,24 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Africa/Johannesburg'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+CELERY_TASK_TRACK_STARTED = True  # lets the validation results endpoint report STARTED
+
+# Uploads larger than this are validated in chunks spread across celery workers
+VALIDATION_CHUNK_SIZE = int(os.getenv('VALIDATION_CHUNK_SIZE', '20000'))
+
+# Records per batch when an uploaded file is streamed through validation (api.ingestion)
+INGESTION_BATCH_SIZE = int(os.getenv('INGESTION_BATCH_SIZE', '5000'))
+
+# Entries per transaction when valid entries are consolidated into MasterData (api.consolidation)
+CONSOLIDATION_BATCH_SIZE = int(os.getenv('CONSOLIDATION_BATCH_SIZE', '5000'))
+
+# Memo cache for fuzzy auto-corrections (api.correction_cache). The Redis tier is
+# optional and shared between the daphne and celery containers when configured.
+CORRECTION_CACHE = {
+    'MAX_ENTRIES': int(os.getenv('CORRECTION_CACHE_MAX_ENTRIES', '50000')),
+    'REDIS_URL': os.getenv('CORRECTION_CACHE_REDIS_URL'),
+    'TTL': 60 * 60 * 24 * 30,
+}
 
 CHANNEL_LAYERS = {
     'default': {
@@ -140,12 +161,45 @@ CHANNEL_LAYERS = {
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default; DB_ENGINE=postgresql switches to PostgreSQL, where concurrent
+# consolidations do not queue behind a single writer and bulk loads use COPY.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'zeda'),
+            'USER': os.getenv('POSTGRES_USER', 'zeda'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE', '60')),
+        }
+    }
+else:
+    # Single-node profile (api.backends.sqlite3): WAL lets readers run alongside the
+    # writer, and IMMEDIATE transactions queue writers on busy_timeout instead of
+    # failing with "database is locked". journal_mode=WAL is stored in the database
+    # file itself, so db.sqlite3 is a local, untracked file created by migrate.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '30000')),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+        'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536')),  # Negative: KiB rather than pages
+        'temp_store': 'MEMORY',
+    }
+    DATABASES = {
+        'default': {
+            'ENGINE': 'api.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'pragmas': SQLITE_PRAGMAS,
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
-}
 
 
 # Password validation